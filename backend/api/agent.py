@@ -1,4 +1,6 @@
+import asyncio
 import os
+import time
 from typing import AsyncGenerator, Literal, List, Optional
 import yaml
 
@@ -6,10 +8,18 @@ from langgraph.graph import StateGraph
 from langgraph.graph.message import MessagesState
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_ollama import ChatOllama
+from loguru import logger
 
-from api.tools.contextual_retrieval_tool import ContextualRetrievalTool
+from api.answer_cache import SemanticAnswerCache, get_answer_cache, replay
+from api.metrics import (
+    GENERATION_SECONDS, LLM_TURN_SECONDS, TIME_TO_FIRST_TOKEN,
+    TOKENS_PER_SECOND, llm_turn)
+from api.resources import ollama_client_kwargs
+from api.sessions import compact_history, get_session_store
+from api.tools.contextual_retrieval_tool import (
+    SEARCH_ERROR, ContextualRetrievalTool)
 
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
 OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
@@ -19,11 +29,13 @@ class WarAndPeaceAgent:
     def __init__(
         self,
         system_prompt: Optional[str] = None,
-        temperature: float = 0.3
+        temperature: float = 0.3,
+        use_answer_cache: bool = True
     ):
         self.llm_model = os.getenv('LLM_MODEL', 'qwen3:14b')
         self.ollama_base_url = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
         self.temperature = temperature
+        self.use_answer_cache = use_answer_cache
 
         self.system_prompt = system_prompt or WarAndPeaceAgent._get_promt()
 
@@ -34,6 +46,7 @@ class WarAndPeaceAgent:
             model=self.llm_model,
             base_url=self.ollama_base_url,
             temperature=self.temperature,
+            client_kwargs=ollama_client_kwargs(),
         )
         self.llm_with_tools = llm.bind_tools(self.tools)
 
@@ -47,6 +60,10 @@ class WarAndPeaceAgent:
             return yaml.safe_load(f)['promt']
         return ''
 
+    @property
+    def answer_cache(self) -> Optional[SemanticAnswerCache]:
+        return get_answer_cache() if self.use_answer_cache else None
+
     def _create_system_message(self):
         return [SystemMessage(content=self.system_prompt)]
 
@@ -54,14 +71,28 @@ class WarAndPeaceAgent:
         class AgentState(MessagesState):
             pass
 
-        def agent_node(
-                state: AgentState, config: RunnableConfig) -> AgentState:
+        def with_system_message(state: AgentState) -> List[BaseMessage]:
             messages = state['messages']
             if not messages or not isinstance(messages[0], SystemMessage):
                 messages = [SystemMessage(content=self.system_prompt)] + [
                     m for m in messages if not isinstance(m, SystemMessage)
                 ]
-            response = self.llm_with_tools.invoke(messages, config)
+            return messages
+
+        def agent_node(
+                state: AgentState, config: RunnableConfig) -> AgentState:
+            messages = with_system_message(state)
+            with LLM_TURN_SECONDS.labels(llm_turn(messages)).time():
+                response = self.llm_with_tools.invoke(messages, config)
+            return {'messages': messages + [response]}
+
+        # В astream_events вызов LLM не занимает поток из пула.
+        async def aagent_node(
+                state: AgentState, config: RunnableConfig) -> AgentState:
+            messages = with_system_message(state)
+            with LLM_TURN_SECONDS.labels(llm_turn(messages)).time():
+                response = await self.llm_with_tools.ainvoke(
+                    messages, config)
             return {'messages': messages + [response]}
 
         def should_continue(state: AgentState) -> Literal['tools', '__end__']:
@@ -72,7 +103,8 @@ class WarAndPeaceAgent:
             return '__end__'
 
         workflow = StateGraph(AgentState)
-        workflow.add_node('agent', agent_node)
+        workflow.add_node(
+            'agent', RunnableLambda(agent_node, afunc=aagent_node))
         workflow.add_node('tools', ToolNode(tools=self.tools))
 
         workflow.set_entry_point('agent')
@@ -90,7 +122,7 @@ class WarAndPeaceAgent:
             query: str,
             chat_history: List[BaseMessage] | None = None
     ) -> str:
-        messages = chat_history or []
+        messages = compact_history(chat_history or [])
         messages.append(HumanMessage(content=query))
 
         result = self.graph.invoke({'messages': messages})
@@ -101,15 +133,77 @@ class WarAndPeaceAgent:
             return final_message.content
         return str(final_message)
 
-    async def astream_answer(
+    async def load_history(
         self,
-        query: str,
-        chat_history: List[BaseMessage] | None = None
+        chat_history: List[BaseMessage] | None = None,
+        session_id: Optional[str] = None
+    ) -> List[BaseMessage]:
+        """
+        История для нового вопроса: с `session_id` — из хранилища сессий,
+        иначе переданная `chat_history`; в обоих случаях сжатая до
+        `HISTORY_TOKEN_BUDGET` токенов.
+        """
+        if session_id:
+            chat_history = await asyncio.to_thread(
+                get_session_store().load, session_id)
+        return compact_history(chat_history or [])
+
+    async def record_turn(
+        self, session_id: Optional[str], query: str, answer: str
+    ) -> None:
+        if session_id:
+            await asyncio.to_thread(
+                get_session_store().append_turn, session_id, query, answer)
+
+    async def cached_answer(
+        self, query: str, history: List[BaseMessage]
+    ) -> Optional[str]:
+        """Готовый ответ из кэша ответов или `None`; LLM не вызывается."""
+        # Ответ зависит от истории, поэтому кэшируются только первые вопросы.
+        answer_cache = None if history else self.answer_cache
+        if answer_cache is None:
+            return None
+        try:
+            return await asyncio.to_thread(answer_cache.lookup, query)
+        except Exception as e:
+            # Кэш — только ускорение: без него отвечаем как обычно.
+            logger.warning(f'Ошибка чтения кэша ответов: {str(e)}')
+            return None
+
+    async def generate(
+        self, query: str, history: List[BaseMessage]
+    ) -> AsyncGenerator[str, None]:
+        """Потоково генерирует ответ на вопрос с уже сжатой историей."""
+        cached = await self.cached_answer(query, history)
+        if cached is not None:
+            async for chunk in replay(cached):
+                yield chunk
+            return
+        async for chunk in self.generate_uncached(query, history):
+            yield chunk
+
+    async def generate_uncached(
+        self, query: str, history: List[BaseMessage]
     ) -> AsyncGenerator[str, None]:
-        messages = self._create_system_message()
+        """
+        Как `generate`, но без поиска в кэше ответов: всегда вызывает LLM.
+        Ответ на первый вопрос сессии сохраняется в кэш.
+        """
+        answer_cache = None if history else self.answer_cache
+        messages = self._create_system_message() + history
         messages.append(HumanMessage(content=query))
 
+        answer = []
+        start = time.perf_counter()
+        first_token = None
+        search_failed = False
         async for event in self.graph.astream_events({'messages': messages}):
+            if event['event'] == 'on_tool_end':
+                output = event['data'].get('output')
+                content = getattr(output, 'content', output)
+                if isinstance(content, str) and content.startswith(
+                        SEARCH_ERROR):
+                    search_failed = True
             if (event['event'] == 'on_chat_model_stream' and
                     'agent' in event.get(
                         'metadata', {}).get('langgraph_node', '')):
@@ -117,4 +211,41 @@ class WarAndPeaceAgent:
                 if (chunk and
                         hasattr(chunk, 'content') and
                         isinstance(chunk.content, str)):
+                    if first_token is None and chunk.content:
+                        first_token = time.perf_counter()
+                        TIME_TO_FIRST_TOKEN.observe(first_token - start)
+                    answer.append(chunk.content)
                     yield chunk.content
+
+        end = time.perf_counter()
+        GENERATION_SECONDS.observe(end - start)
+        # Ollama отдаёт ответ по одному токену на фрагмент.
+        tokens = sum(1 for chunk in answer if chunk)
+        if first_token is not None and tokens > 1 and end > first_token:
+            TOKENS_PER_SECOND.observe((tokens - 1) / (end - first_token))
+
+        # Ответ без найденного контекста не кэшируется, чтобы сбой поиска
+        # не повторялся на похожие вопросы.
+        if answer_cache is not None and not search_failed:
+            try:
+                await asyncio.to_thread(
+                    answer_cache.store, query, ''.join(answer))
+            except Exception as e:
+                logger.warning(f'Ошибка записи в кэш ответов: {str(e)}')
+
+    async def astream_answer(
+        self,
+        query: str,
+        chat_history: List[BaseMessage] | None = None,
+        session_id: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Потоково генерирует ответ. С `session_id` вопрос и ответ после
+        генерации добавляются в историю сессии.
+        """
+        history = await self.load_history(chat_history, session_id)
+        answer = []
+        async for chunk in self.generate(query, history):
+            answer.append(chunk)
+            yield chunk
+        await self.record_turn(session_id, query, ''.join(answer))
@@ -0,0 +1,153 @@
+from functools import lru_cache
+import json
+import os
+import re
+import threading
+import time
+from typing import AsyncGenerator, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+from api.resources import get_resources
+from db import VectorStore
+from utils.cache import SQLiteCache
+from utils.checkpoint import content_hash
+from utils.embeddings import normalize_query
+
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH', './cache/answers.sqlite')
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '10000'))
+ANSWER_CACHE_MAX_AGE = float(
+    os.getenv('ANSWER_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+ANSWER_CACHE_REFRESH = float(os.getenv('ANSWER_CACHE_REFRESH', '60'))
+NAMESPACE = 'answer'
+REPLAY_PATTERN = re.compile(r'\s*\S+\s*')
+
+
+class SemanticAnswerCache:
+    """
+    Кэш готовых ответов агента: вопрос считается повторным, если косинусное
+    сходство его эмбеддинга с сохранённым вопросом не ниже `threshold`.
+    Записи хранятся в SQLite (общие для процессов, заполняются командой
+    `warm_answer_cache.py`) и привязаны к версии коллекции хранилища и
+    модели эмбеддингов: после переиндексации старые ответы удаляются.
+    Индекс в памяти перечитывается при смене версии и раз
+    в `refresh_interval` секунд.
+    """
+    def __init__(
+        self,
+        embedder: Embeddings,
+        store: VectorStore,
+        path: str = ANSWER_CACHE_PATH,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        max_age: Optional[float] = ANSWER_CACHE_MAX_AGE,
+        refresh_interval: float = ANSWER_CACHE_REFRESH,
+    ):
+        self.embedder = embedder
+        self.store = store
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.storage = SQLiteCache(
+            path, max_entries=max_entries, max_age=max_age or None)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._loaded_at = 0.0
+        self._keys: List[str] = []
+        self._answers: List[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def _current_version(self) -> str:
+        model = getattr(self.embedder, 'model', '')
+        return f'{self.store.collection_version()}:{model}'
+
+    def _refresh(self) -> str:
+        version = self._current_version()
+        now = time.monotonic()
+        if (version == self._version and
+                now - self._loaded_at < self.refresh_interval):
+            return version
+        if version != self._version:
+            self.storage.invalidate(NAMESPACE, keep_version=version)
+        keys, answers, vectors = [], [], []
+        for key, value in self.storage.items(NAMESPACE, version):
+            entry = json.loads(value)
+            keys.append(key)
+            answers.append(entry['answer'])
+            vectors.append(entry['embedding'])
+        self._keys, self._answers = keys, answers
+        self._matrix = (
+            np.asarray(vectors, dtype=np.float32) if vectors
+            else np.zeros((0, 0), dtype=np.float32))
+        self._version = version
+        self._loaded_at = now
+        return version
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(
+            self.embedder.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question: str) -> Optional[str]:
+        vector = self._embed(question)
+        with self._lock:
+            self._refresh()
+            if self._answers and self._matrix.shape[1] == len(vector):
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return self._answers[best]
+            self.misses += 1
+            return None
+
+    def store(self, question: str, answer: str) -> None:
+        if not answer.strip():
+            return
+        vector = self._embed(question)
+        key = content_hash(normalize_query(question))
+        value = json.dumps({
+            'question': question,
+            'answer': answer,
+            'embedding': vector.tolist(),
+        }, ensure_ascii=False)
+        with self._lock:
+            version = self._refresh()
+            self.storage.set(key, value, namespace=NAMESPACE, version=version)
+            if key in self._keys:
+                row = self._keys.index(key)
+                self._answers[row] = answer
+                self._matrix[row] = vector
+                return
+            self._keys.append(key)
+            self._answers.append(answer)
+            if self._matrix.shape[1] != len(vector):
+                self._matrix = self._matrix.reshape(0, len(vector))
+            self._matrix = np.vstack([self._matrix, vector[None, :]])
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._answers),
+        }
+
+
+async def replay(answer: str) -> AsyncGenerator[str, None]:
+    """Отдаёт сохранённый ответ по словам, как при генерации моделью."""
+    for match in REPLAY_PATTERN.finditer(answer):
+        yield match.group()
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    if not ANSWER_CACHE_PATH:
+        return None
+    resources = get_resources()
+    return SemanticAnswerCache(resources.embedder, resources.store)
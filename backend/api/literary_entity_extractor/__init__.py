@@ -1,3 +1,4 @@
+from .gazetteer import EntityGazetteer, EntityMatches
 from .graph import LiteraryEntityExtractor
 
-__all__ = ['LiteraryEntityExtractor']
+__all__ = ['EntityGazetteer', 'EntityMatches', 'LiteraryEntityExtractor']
@@ -0,0 +1,97 @@
+import asyncio
+from functools import lru_cache
+import json
+import os
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from utils.cache import SQLiteCache
+from utils.checkpoint import content_hash
+
+EXTRACTION_CACHE_PATH = os.getenv(
+    'EXTRACTION_CACHE_PATH', './cache/extraction.sqlite')
+EXTRACTION_CACHE_MAX_ENTRIES = int(
+    os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '100000'))
+EXTRACTION_CACHE_MAX_AGE = float(
+    os.getenv('EXTRACTION_CACHE_MAX_AGE', str(30 * 24 * 3600)))
+
+
+@lru_cache(maxsize=1)
+def get_extraction_cache() -> Optional[SQLiteCache]:
+    if not EXTRACTION_CACHE_PATH:
+        return None
+    return SQLiteCache(
+        EXTRACTION_CACHE_PATH,
+        max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+        max_age=EXTRACTION_CACHE_MAX_AGE or None,
+    )
+
+
+class CachedChain:
+    """
+    Цепочка узла с кэшем ответов LLM. Ключ — хэш входа, промпта узла
+    (содержимое `promt.yaml` и инструкции формата), имени модели
+    и температуры. Промпт задаёт версию записей: при его изменении записи
+    узла со старой версией удаляются при создании цепочки.
+    """
+    def __init__(
+        self,
+        chain,
+        cache: SQLiteCache,
+        namespace: str,
+        prompt: Dict[str, Any],
+        llm,
+        model: Optional[Type[BaseModel]] = None,
+        format_instructions: str = '',
+    ):
+        self.chain = chain
+        self.cache = cache
+        self.namespace = namespace
+        self.model = model
+        self.version = content_hash(
+            json.dumps(prompt, ensure_ascii=False, sort_keys=True),
+            format_instructions,
+        )
+        self.llm_key = content_hash(
+            getattr(llm, 'model', ''), getattr(llm, 'temperature', None))
+        self.cache.invalidate(namespace, keep_version=self.version)
+
+    def _key(self, inputs: Dict[str, Any]) -> str:
+        return content_hash(
+            self.namespace, self.version, self.llm_key,
+            json.dumps(inputs, ensure_ascii=False, sort_keys=True))
+
+    def _dump(self, response: Any) -> str:
+        if isinstance(response, BaseModel):
+            return response.model_dump_json()
+        return json.dumps(response, ensure_ascii=False)
+
+    def _load(self, value: str) -> Any:
+        if self.model is not None:
+            return self.model.model_validate_json(value)
+        return json.loads(value)
+
+    def invoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        key = self._key(inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._load(cached)
+        response = self.chain.invoke(inputs, config, **kwargs)
+        self.cache.set(
+            key, self._dump(response),
+            namespace=self.namespace, version=self.version)
+        return response
+
+    async def ainvoke(
+            self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        # SQLite — в пуле потоков, чтобы не блокировать цикл событий.
+        key = self._key(inputs)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return self._load(cached)
+        response = await self.chain.ainvoke(inputs, config, **kwargs)
+        await asyncio.to_thread(
+            self.cache.set, key, self._dump(response),
+            namespace=self.namespace, version=self.version)
+        return response
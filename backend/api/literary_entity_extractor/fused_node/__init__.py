@@ -0,0 +1,3 @@
+from .node import FusedNode
+
+__all__ = ['FusedNode']
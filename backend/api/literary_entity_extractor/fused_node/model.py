@@ -0,0 +1,17 @@
+from pydantic import Field
+
+from ..characters_node.model import Characters
+from ..locations_node.model import Locations
+
+
+class Entities(Characters, Locations):
+    pass
+
+
+class Extraction(Entities):
+    summary: str = Field(
+        default='',
+        description=(
+            'Краткая фактическая сводка фрагмента в одном предложении: '
+            'кто участвует, где происходит действие и что происходит. '
+            'Без оценок, цитат и слов «герой», «персонаж», «в романе»'))
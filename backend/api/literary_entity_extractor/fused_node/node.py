@@ -0,0 +1,105 @@
+import re
+import os
+from typing import Any, Dict, Optional, Type
+import yaml
+
+from langchain_core.messages import ToolMessage
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import PydanticOutputParser
+from pydantic import BaseModel
+
+from utils.cache import SQLiteCache
+
+from .model import Entities, Extraction
+from ..cache import CachedChain
+from ..states import CreatorState
+from ..parsers import ThinkAwarePydanticOutputParser
+
+
+class FusedNode():
+    """
+    Извлекает сводку, персонажей и локации одним вызовом LLM.
+    Без `need_summary` схема ответа не содержит поля `summary`.
+    """
+    def __init__(
+        self,
+        llm,
+        parser: Type[PydanticOutputParser] = ThinkAwarePydanticOutputParser,
+        need_summary: bool = True,
+        cache: Optional[SQLiteCache] = None,
+    ):
+        self.llm = llm
+        self.cache = cache
+        model: Type[BaseModel] = Extraction if need_summary else Entities
+        self.parser = parser(pydantic_object=model)
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        promt_path = os.path.join(current_dir, 'promt.yaml')
+        self.prompt = self._load_prompt(promt_path)
+        self.chain = self._build_chain()
+
+    def _load_prompt(self, promt_path: str) -> Dict[str, Any]:
+        with open(promt_path, 'r', encoding='utf-8') as f:
+            promt_config = yaml.safe_load(f)
+        return promt_config
+
+    def _build_chain(self):
+        model = self.parser.pydantic_object
+        prompt_template = PromptTemplate(
+            template=self.prompt['template'],
+            input_variables=self.prompt['input_variables'],
+            partial_variables={
+                'format_instructions': self.parser.get_format_instructions()
+            }
+        )
+        chain = prompt_template | self.llm | self.parser
+        if self.cache is None:
+            return chain
+        return CachedChain(
+            chain, self.cache,
+            namespace=f'{type(self).__name__}:{model.__name__}',
+            prompt=self.prompt,
+            llm=self.llm,
+            model=model,
+            format_instructions=self.parser.get_format_instructions(),
+        )
+
+    @staticmethod
+    def camel_to_snake(name):
+        name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+        name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
+        return name.lower()
+
+    def _update(self, response: Entities) -> dict:
+        content = (
+            'Персонажи: ' + ', '.join(response.characters) + '\n' +
+            'Локации: ' + ', '.join(response.locations))
+        tool_msg = ToolMessage(
+            content=content,
+            tool_call_id=FusedNode.camel_to_snake(type(self).__name__),
+            artifact=response
+        )
+
+        result = {
+            'characters': response.characters,
+            'locations': response.locations,
+            'messages': [tool_msg],
+        }
+        if isinstance(response, Extraction):
+            result['summary'] = response.summary
+        return result
+
+    def node(self, state: CreatorState) -> dict:
+        try:
+            return self._update(
+                self.chain.invoke({'question': state.chunk}))
+        except Exception as e:
+            print(e)
+            return {'errors': [str(e)]}
+
+    async def anode(self, state: CreatorState) -> dict:
+        try:
+            return self._update(
+                await self.chain.ainvoke({'question': state.chunk}))
+        except Exception as e:
+            print(e)
+            return {'errors': [str(e)]}
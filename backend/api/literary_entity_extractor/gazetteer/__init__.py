@@ -0,0 +1,3 @@
+from .matcher import EntityGazetteer, EntityMatches
+
+__all__ = ['EntityGazetteer', 'EntityMatches']
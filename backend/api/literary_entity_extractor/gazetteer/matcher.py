@@ -0,0 +1,177 @@
+import os
+import re
+from typing import (
+    Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple, get_args)
+import yaml
+
+from ..characters_node.model import Characters
+from ..locations_node.model import Locations
+
+# Окончания существительных, прилагательных и имён, по которым основа
+# псевдонима совпадает со словом запроса.
+ENDINGS = frozenset([
+    '', 'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'й', 'ь',
+    'ой', 'ей', 'ою', 'ею', 'ом', 'ем', 'ам', 'ям', 'ым', 'им',
+    'ах', 'ях', 'ых', 'их', 'ами', 'ями', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ую', 'юю', 'ые', 'ие',
+    'ого', 'его', 'ому', 'ему', 'ый', 'ий', 'ью',
+    'ия', 'ии', 'ию', 'ием',
+])
+TOKEN_PATTERN = re.compile(r'[а-яa-z]+')
+WORD_PATTERN = re.compile(r'^([а-яa-z]+)(?:\(([^)]*)\))?$')
+KINDS = ('characters', 'locations')
+
+
+class EntityMatches(NamedTuple):
+    characters: List[str]
+    locations: List[str]
+    # Кандидаты неоднозначных упоминаний («Ростовы», «князь»), которые
+    # не подтверждены другими словами запроса.
+    ambiguous: List[str]
+
+
+class _Entry(NamedTuple):
+    kind: str
+    names: Tuple[str, ...]
+
+
+class _Node:
+    __slots__ = ('children', 'entry')
+
+    def __init__(self):
+        self.children: Dict[str, List[Tuple[FrozenSet[str], _Node]]] = {}
+        self.entry: Optional[_Entry] = None
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower().replace('ё', 'е'))
+
+
+class EntityGazetteer:
+    """
+    Сопоставляет вопрос с закрытыми словарями `Characters` и `Locations`
+    без обращения к LLM. Псевдонимы из `aliases.yaml` хранятся в префиксном
+    дереве по словам; слово запроса проходит по ребру, если начинается
+    с основы псевдонима и заканчивается допустимым окончанием. В каждой
+    позиции выбирается самый длинный псевдоним.
+    """
+    def __init__(self, aliases_path: Optional[str] = None):
+        if aliases_path is None:
+            aliases_path = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'aliases.yaml')
+        with open(aliases_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+
+        self.vocabulary: Dict[str, Set[str]] = {
+            'characters': EntityGazetteer._literal_values(
+                Characters, 'characters'),
+            'locations': EntityGazetteer._literal_values(
+                Locations, 'locations'),
+        }
+        self._root = _Node()
+        self._max_ending = 0
+        for kind in KINDS:
+            for name, aliases in (config.get(kind) or {}).items():
+                self._check_name(name, kind)
+                for alias in aliases:
+                    self._add(alias, _Entry(kind, (name,)))
+        for alias, names in (config.get('ambiguous') or {}).items():
+            for name in names:
+                self._check_name(name)
+            self._add(alias, _Entry('ambiguous', tuple(names)))
+        for alias in config.get('ignore') or []:
+            self._add(alias, _Entry('ignore', ()))
+
+    @staticmethod
+    def _literal_values(model, field: str) -> Set[str]:
+        (literal,) = get_args(model.model_fields[field].annotation)
+        return set(get_args(literal))
+
+    def _check_name(self, name: str, kind: Optional[str] = None) -> None:
+        kinds = (kind,) if kind else KINDS
+        if not any(name in self.vocabulary[k] for k in kinds):
+            raise ValueError(
+                f'Сущность "{name}" из aliases.yaml отсутствует в словаре')
+
+    def _add(self, alias: str, entry: _Entry) -> None:
+        node = self._root
+        for word in alias.split():
+            parsed = WORD_PATTERN.match(word)
+            if parsed is None:
+                raise ValueError(f'Некорректный псевдоним: "{alias}"')
+            stem, endings = parsed.groups()
+            endings = ENDINGS if endings is None else frozenset(
+                ending.strip() for ending in endings.split(','))
+            self._max_ending = max(
+                self._max_ending, *(len(ending) for ending in endings))
+            branches = node.children.setdefault(stem, [])
+            for branch_endings, child in branches:
+                if branch_endings == endings:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                branches.append((endings, child))
+                node = child
+        if node.entry is not None and node.entry != entry:
+            raise ValueError(f'Псевдоним "{alias}" задан дважды')
+        node.entry = entry
+
+    def _step(self, node: _Node, token: str) -> List[_Node]:
+        children = []
+        for cut in range(min(self._max_ending, len(token) - 1) + 1):
+            stem = token[:len(token) - cut]
+            ending = token[len(token) - cut:]
+            for endings, child in node.children.get(stem, ()):
+                if ending in endings:
+                    children.append(child)
+        return children
+
+    def _longest(
+        self, tokens: List[str], start: int
+    ) -> Optional[Tuple[int, _Entry]]:
+        best = None
+        frontier = [self._root]
+        position = start
+        while frontier and position < len(tokens):
+            frontier = [
+                child for node in frontier
+                for child in self._step(node, tokens[position])
+            ]
+            position += 1
+            for node in frontier:
+                if node.entry is not None:
+                    best = (position, node.entry)
+                    break
+        return best
+
+    def match(self, text: str) -> EntityMatches:
+        """Сущности в порядке первого упоминания в тексте."""
+        tokens = tokenize(text)
+        found: Dict[str, List[str]] = {kind: [] for kind in KINDS}
+        ambiguous: List[Tuple[str, ...]] = []
+        position = 0
+        while position < len(tokens):
+            match = self._longest(tokens, position)
+            if match is None:
+                position += 1
+                continue
+            position, entry = match
+            if entry.kind == 'ambiguous':
+                ambiguous.append(entry.names)
+            elif entry.kind in found and entry.names[0] not in found[
+                    entry.kind]:
+                found[entry.kind].append(entry.names[0])
+
+        matched = set(found['characters']) | set(found['locations'])
+        unresolved = []
+        for names in ambiguous:
+            if matched.intersection(names):
+                continue
+            unresolved.extend(n for n in names if n not in unresolved)
+        return EntityMatches(
+            found['characters'], found['locations'], unresolved)
+
+    def invoke(self, message: str) -> Dict[str, List[str]]:
+        """Тот же формат, что у `LiteraryEntityExtractor.invoke`."""
+        return self.match(message)._asdict()
@@ -1,35 +1,106 @@
+import os
+from typing import Dict, Literal, Optional
+
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 
+from utils.cache import SQLiteCache
+
+from .cache import get_extraction_cache
 from .characters_node import CharactersNode
+from .fused_node import FusedNode
 from .locations_node import LocationsNode
 from .states import CreatorState
 from .summary_node import SummaryNode
 
+ExtractionMode = Literal['sequential', 'parallel', 'fused']
+EXTRACTION_MODE: ExtractionMode = os.getenv('EXTRACTION_MODE', 'parallel')
+
 
 class LiteraryEntityExtractor():
-    def __init__(self, llm, need_summary: bool = True):
+    """
+    Режимы извлечения (`mode`):
+    - `sequential` — summary → characters → locations, по одному вызову LLM;
+    - `parallel` — characters и locations запускаются одновременно
+      (после summary, если он нужен);
+    - `fused` — сводка, персонажи и локации одним вызовом LLM.
+
+    Ответы узлов кэшируются на диске (`EXTRACTION_CACHE_PATH`), если не
+    передан другой `cache`; `use_cache=False` отключает кэш.
+    """
+    def __init__(
+        self,
+        llm,
+        need_summary: bool = True,
+        mode: ExtractionMode = EXTRACTION_MODE,
+        cache: Optional[SQLiteCache] = None,
+        use_cache: bool = True
+    ):
+        if mode not in ('sequential', 'parallel', 'fused'):
+            raise ValueError(f'Неизвестный режим извлечения: {mode}')
+        self.mode = mode
+        self.cache = (cache or get_extraction_cache()) if use_cache else None
         self.workflow = StateGraph(CreatorState)
 
-        self.workflow.add_node('characters_node', CharactersNode(llm=llm).node)
-        self.workflow.add_node('locations_node', LocationsNode(llm=llm).node)
-        if need_summary:
-            self.workflow.add_node('summary_node', SummaryNode(llm=llm).node)
+        if mode == 'fused':
+            self.workflow.add_node(
+                'fused_node',
+                LiteraryEntityExtractor._runnable(FusedNode(
+                    llm=llm, need_summary=need_summary, cache=self.cache)))
+            self.workflow.set_entry_point('fused_node')
+            self.workflow.set_finish_point('fused_node')
+            self.graph = self.workflow.compile()
+            return
 
+        self.workflow.add_node(
+            'characters_node', LiteraryEntityExtractor._runnable(
+                CharactersNode(llm=llm, cache=self.cache)))
+        self.workflow.add_node(
+            'locations_node', LiteraryEntityExtractor._runnable(
+                LocationsNode(llm=llm, cache=self.cache)))
         if need_summary:
-            self.workflow.set_entry_point('summary_node')
-            self.workflow.add_edge('summary_node', 'characters_node')
+            self.workflow.add_node(
+                'summary_node', LiteraryEntityExtractor._runnable(
+                    SummaryNode(llm=llm, cache=self.cache)))
+
+        if mode == 'parallel':
+            if need_summary:
+                self.workflow.set_entry_point('summary_node')
+                self.workflow.add_edge('summary_node', 'characters_node')
+                self.workflow.add_edge('summary_node', 'locations_node')
+            else:
+                self.workflow.set_entry_point('characters_node')
+                self.workflow.set_entry_point('locations_node')
+            self.workflow.set_finish_point('characters_node')
+            self.workflow.set_finish_point('locations_node')
         else:
-            self.workflow.set_entry_point('characters_node')
-        self.workflow.add_edge('characters_node', 'locations_node')
-        self.workflow.set_finish_point('locations_node')
+            if need_summary:
+                self.workflow.set_entry_point('summary_node')
+                self.workflow.add_edge('summary_node', 'characters_node')
+            else:
+                self.workflow.set_entry_point('characters_node')
+            self.workflow.add_edge('characters_node', 'locations_node')
+            self.workflow.set_finish_point('locations_node')
 
         self.graph = self.workflow.compile()
 
+    @staticmethod
+    def _runnable(node) -> RunnableLambda:
+        # Синхронный вызов графа идёт через `node`, асинхронный — через
+        # `anode` с асинхронным клиентом Ollama.
+        return RunnableLambda(node.node, afunc=node.anode)
+
     def print_graph(self) -> None:
         self.graph.get_graph().print_ascii()
 
     def get_graph_ascii(self) -> None:
         self.graph.get_graph().draw_ascii()
 
+    def cache_stats(self) -> Dict[str, float]:
+        return self.cache.stats() if self.cache else {}
+
     def invoke(self, message: str):
         return self.graph.invoke(CreatorState.create(message))
+
+    async def ainvoke(self, message: str):
+        return await self.graph.ainvoke(CreatorState.create(message))
@@ -1,6 +1,6 @@
 import re
 import os
-from typing import Any, Dict, Type
+from typing import Any, Dict, Optional, Type
 import yaml
 
 from langchain_core.messages import ToolMessage
@@ -8,7 +8,10 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel
 
+from utils.cache import SQLiteCache
+
 from .model import Locations
+from ..cache import CachedChain
 from ..states import CreatorState
 from ..parsers import ThinkAwarePydanticOutputParser
 
@@ -19,8 +22,10 @@ class LocationsNode():
         llm,
         parser: Type[PydanticOutputParser] = ThinkAwarePydanticOutputParser,
         model: Type[BaseModel] = Locations,
+        cache: Optional[SQLiteCache] = None,
     ):
         self.llm = llm
+        self.cache = cache
         self.parser = parser(pydantic_object=model)
         current_dir = os.path.dirname(os.path.abspath(__file__))
         promt_path = os.path.join(current_dir, 'promt.yaml')
@@ -33,6 +38,7 @@ class LocationsNode():
         return promt_config
 
     def _build_chain(self):
+        model = self.parser.pydantic_object
         prompt_template = PromptTemplate(
             template=self.prompt['template'],
             input_variables=self.prompt['input_variables'],
@@ -40,7 +46,17 @@ class LocationsNode():
                 'format_instructions': self.parser.get_format_instructions()
             }
         )
-        return prompt_template | self.llm | self.parser
+        chain = prompt_template | self.llm | self.parser
+        if self.cache is None:
+            return chain
+        return CachedChain(
+            chain, self.cache,
+            namespace=f'{type(self).__name__}:{model.__name__}',
+            prompt=self.prompt,
+            llm=self.llm,
+            model=model,
+            format_instructions=self.parser.get_format_instructions(),
+        )
 
     @staticmethod
     def camel_to_snake(name):
@@ -48,26 +64,35 @@ class LocationsNode():
         name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
         return name.lower()
 
+    @staticmethod
+    def _inputs(state: CreatorState) -> dict:
+        return {'question': state.summary or state.chunk}
+
+    def _update(self, response: Locations) -> dict:
+        content = (
+            'Локации: ' + ', '.join(c for c in response.locations))
+        tool_msg = ToolMessage(
+            content=content,
+            tool_call_id=LocationsNode.camel_to_snake(type(self).__name__),
+            artifact=response
+        )
+
+        return {
+            'locations': response.locations,
+            'messages': [tool_msg],
+        }
+
     def node(self, state: CreatorState) -> dict:
         try:
-            if state.summary:
-                response = self.chain.invoke({'question': state.summary})
-            else:
-                response = self.chain.invoke({'question': state.chunk})
-
-            content = (
-                'Локации: ' + ', '.join(c for c in response.locations))
-            tool_msg = ToolMessage(
-                content=content,
-                tool_call_id=LocationsNode.camel_to_snake(type(self).__name__),
-                artifact=response
-            )
-            msg = state.messages + [tool_msg]
+            return self._update(self.chain.invoke(self._inputs(state)))
+        except Exception as e:
+            print(e)
+            return {'errors': [str(e)]}
 
-            return {
-                'locations': response.locations,
-                'messages': msg,
-            }
+    async def anode(self, state: CreatorState) -> dict:
+        try:
+            return self._update(
+                await self.chain.ainvoke(self._inputs(state)))
         except Exception as e:
             print(e)
-            return {'error': e}
+            return {'errors': [str(e)]}
@@ -1,4 +1,5 @@
-from typing import List
+import operator
+from typing import Annotated, List
 
 from langchain_core.messages import BaseMessage
 from pydantic import BaseModel, Field
@@ -20,10 +21,14 @@ class CreatorState(BaseModel):
         default='',
         description='Суммаризированный моделью чанк'
     )
-    messages: List[BaseMessage] = Field(
+    messages: Annotated[List[BaseMessage], operator.add] = Field(
         default=[],
         description='История сообщений'
     )
+    errors: Annotated[List[str], operator.add] = Field(
+        default=[],
+        description='Ошибки узлов (например, недоступность LLM)'
+    )
 
     @classmethod
     def create(cls, chunk: str = ''):
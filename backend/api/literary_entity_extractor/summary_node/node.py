@@ -1,12 +1,15 @@
 import re
 import os
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 import yaml
 
 from langchain_core.messages import ToolMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 
+from utils.cache import SQLiteCache
+
+from ..cache import CachedChain
 from ..states import CreatorState
 
 
@@ -14,8 +17,10 @@ class SummaryNode():
     def __init__(
         self,
         llm,
+        cache: Optional[SQLiteCache] = None,
     ):
         self.llm = llm
+        self.cache = cache
         self.parser = StrOutputParser()
         current_dir = os.path.dirname(os.path.abspath(__file__))
         promt_path = os.path.join(current_dir, 'promt.yaml')
@@ -32,7 +37,15 @@ class SummaryNode():
             template=self.prompt['template'],
             input_variables=self.prompt['input_variables'],
         )
-        return prompt_template | self.llm | self.parser
+        chain = prompt_template | self.llm | self.parser
+        if self.cache is None:
+            return chain
+        return CachedChain(
+            chain, self.cache,
+            namespace=type(self).__name__,
+            prompt=self.prompt,
+            llm=self.llm,
+        )
 
     @staticmethod
     def camel_to_snake(name):
@@ -40,20 +53,28 @@ class SummaryNode():
         name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
         return name.lower()
 
+    def _update(self, response: str) -> dict:
+        content = response
+        tool_msg = ToolMessage(
+            content=content,
+            tool_call_id=SummaryNode.camel_to_snake(type(self).__name__),
+        )
+
+        return {
+            'summary': response,
+            'messages': [tool_msg],
+        }
+
     def node(self, state: CreatorState) -> dict:
         try:
-            response = self.chain.invoke({'question': state.chunk})
-
-            content = response
-            tool_msg = ToolMessage(
-                content=content,
-                tool_call_id=SummaryNode.camel_to_snake(type(self).__name__),
-            )
-            msg = state.messages + [tool_msg]
-
-            return {
-                'summary': response,
-                'messages': msg,
-            }
+            return self._update(
+                self.chain.invoke({'question': state.chunk}))
+        except Exception as e:
+            return {'errors': [str(e)]}
+
+    async def anode(self, state: CreatorState) -> dict:
+        try:
+            return self._update(
+                await self.chain.ainvoke({'question': state.chunk}))
         except Exception as e:
-            return {'error': e}
+            return {'errors': [str(e)]}
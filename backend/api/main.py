@@ -1,25 +1,177 @@
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncGenerator, List, Optional
+
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from langchain_core.messages import BaseMessage
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 
 from api.agent import WarAndPeaceAgent
+from api.answer_cache import replay
+from api.metrics import (
+    CACHE_STATS, REQUESTS, REQUESTS_IN_FLIGHT, SERVING_STATS)
+from api.resources import get_resources
+from api.scheduler import AdmissionRejected, get_scheduler
+from api.single_flight import SingleFlight
 from utils import setup_logger
+from utils.checkpoint import content_hash
+from utils.embeddings import normalize_query
 
 load_dotenv()
-app = FastAPI()
 agent = WarAndPeaceAgent()
+flights = SingleFlight()
 logger = setup_logger()
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Модели, экстрактор и клиент ChromaDB создаются до первого запроса.
+    get_resources()
+    logger.info('Ресурсы инициализированы')
+    register_stats()
+    yield
+
+
+def register_stats() -> None:
+    # Статистика читается только при запросе /metrics.
+    cache_metrics = dict(
+        counters=[('hits', 'cache_hits'), ('misses', 'cache_misses')],
+        gauges=[('size', 'cache_entries')])
+    CACHE_STATS.add(
+        'answer',
+        lambda: agent.answer_cache.stats() if agent.answer_cache else {},
+        **cache_metrics)
+    CACHE_STATS.add(
+        'embedding', lambda: get_resources().embedder.stats(),
+        **cache_metrics)
+    CACHE_STATS.add(
+        'extraction', lambda: get_resources().extractor.cache_stats(),
+        **cache_metrics)
+    SERVING_STATS.add(
+        'scheduler', lambda: get_scheduler().stats(),
+        counters=[
+            ('admitted', 'scheduler_admitted'),
+            ('rejected_429', 'scheduler_rejected_429'),
+            ('rejected_503', 'scheduler_rejected_503'),
+        ],
+        gauges=[
+            ('active', 'scheduler_active'),
+            ('queued', 'scheduler_queued'),
+            ('wait_p95_ms', 'scheduler_wait_p95_ms'),
+        ])
+    SERVING_STATS.add(
+        'single_flight', flights.stats,
+        counters=[('coalesced', 'flights_coalesced')],
+        gauges=[('in_flight', 'flights_in_flight')])
+
+
+app = FastAPI(lifespan=lifespan)
+
+
 class MessageRequest(BaseModel):
     message: str
+    # Без идентификатора сессии вопрос обрабатывается без истории.
+    session_id: Optional[str] = Field(default=None, max_length=64)
+
+
+def client_key(http_request: Request) -> str:
+    # Бэкенд доступен только через прокси фронтенда, который передаёт
+    # в X-Forwarded-For цепочку адресов, начиная с адреса пользователя.
+    forwarded = http_request.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return http_request.client.host if http_request.client else ''
+
+
+def flight_key(message: str, history: List[BaseMessage]) -> str:
+    return content_hash(
+        normalize_query(message),
+        *(f'{m.type}:{m.content}' for m in history))
+
+
+async def answer_stream(
+    client: str, request: MessageRequest
+) -> AsyncGenerator[str, None]:
+    """
+    Первый шаг находит идущую генерацию того же вопроса с той же историей
+    или готовый ответ в кэше ответов; если нет ни того, ни другого, ждёт
+    места в планировщике (или бросает `AdmissionRejected`) и запускает
+    новую генерацию, затем отдаёт пустую строку; дальше идёт ответ.
+    Место в планировщике занимает только генерация, вызывающая LLM, и
+    держит его до своего окончания; ответы из кэша и повторные вопросы
+    места не занимают, повторные получают ответ с начала. Генератор
+    запускается до начала ответа, поэтому подписка снимается и тогда,
+    когда клиент отключился раньше, чем началась передача.
+    """
+    history = await agent.load_history(session_id=request.session_id)
+    key = flight_key(request.message, history)
+    flight = flights.get(key)
+    cached = None
+    if flight is None:
+        cached = await agent.cached_answer(request.message, history)
+    if flight is None and cached is None:
+        scheduler = get_scheduler()
+        started = await scheduler.acquire(client)
+        flight = flights.get(key)
+        if flight is None:
+            flight = flights.start(
+                key, agent.generate_uncached(request.message, history),
+                on_done=partial(scheduler.release, started))
+        else:
+            scheduler.release()
+    if flight is None:
+        logger.info('Ответ найден в кэше ответов')
+        chunks = replay(cached)
+    else:
+        if flight.subscribers:
+            logger.info('Вопрос уже обрабатывается, ответ будет общим')
+        flight.join()
+        chunks = flight.subscribe()
+
+    answer = []
+    status = 'cancelled'
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        yield ''
+        async for chunk in chunks:
+            answer.append(chunk)
+            yield chunk
+        await agent.record_turn(
+            request.session_id, request.message, ''.join(answer))
+        status = 'ok'
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        if flight is not None:
+            flight.leave()
+        REQUESTS_IN_FLIGHT.dec()
+        REQUESTS.labels(status).inc()
 
 
 @app.post('/api/generate', summary='Генерация ответа нейросетью')
-async def generate(request: MessageRequest):
+async def generate(request: MessageRequest, http_request: Request):
     logger.info(f'Получен запрос к API: {request.message}')
-    return StreamingResponse(
-        agent.astream_answer(query=request.message),
-        media_type='text/event-stream'
-    )
+    stream = answer_stream(client_key(http_request), request)
+    try:
+        await stream.__anext__()
+    except AdmissionRejected as e:
+        logger.warning(f'Запрос отклонён ({e.status_code}): {e.reason}')
+        REQUESTS.labels(str(e.status_code)).inc()
+        return JSONResponse(
+            {'detail': e.reason}, status_code=e.status_code,
+            headers={'Retry-After': str(e.retry_after)})
+    return StreamingResponse(stream, media_type='text/event-stream')
+
+
+@app.get('/api/queue', summary='Состояние очереди запросов')
+async def queue_stats():
+    return {**get_scheduler().stats(), **flights.stats()}
+
+
+@app.get('/metrics', summary='Метрики в формате Prometheus')
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
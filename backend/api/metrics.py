@@ -0,0 +1,140 @@
+from typing import (
+    Awaitable, Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar)
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import (
+    REGISTRY, CounterMetricFamily, GaugeMetricFamily, Metric)
+from prometheus_client.registry import Collector
+
+T = TypeVar('T')
+
+PREFIX = 'war_and_peace'
+STAGE_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Наблюдения дешёвые (блокировка и поиск корзины), а статистика кэшей
+# и очереди читается только при запросе /metrics.
+STAGE_SECONDS = Histogram(
+    f'{PREFIX}_stage_seconds',
+    'Длительность этапов поиска контекста',
+    ['stage'], buckets=STAGE_BUCKETS)
+LLM_TURN_SECONDS = Histogram(
+    f'{PREFIX}_llm_turn_seconds',
+    'Длительность вызова LLM агентом по номеру хода внутри вопроса',
+    ['turn'], buckets=LLM_BUCKETS)
+TIME_TO_FIRST_TOKEN = Histogram(
+    f'{PREFIX}_time_to_first_token_seconds',
+    'Время от начала генерации до первого фрагмента ответа',
+    buckets=LLM_BUCKETS)
+TOKENS_PER_SECOND = Histogram(
+    f'{PREFIX}_tokens_per_second',
+    'Скорость потоковой генерации ответа (фрагментов в секунду)',
+    buckets=(1, 2.5, 5, 10, 15, 20, 30, 50, 75, 100, 200))
+GENERATION_SECONDS = Histogram(
+    f'{PREFIX}_generation_seconds',
+    'Полное время генерации ответа', buckets=LLM_BUCKETS)
+RETRIEVED_CHUNKS = Histogram(
+    f'{PREFIX}_retrieved_chunks',
+    'Число чанков, найденных поиском',
+    ['search'], buckets=(0, 1, 2, 3, 5, 10, 20, 50))
+REQUESTS = Counter(
+    f'{PREFIX}_requests',
+    'Запросы к /api/generate по результату', ['status'])
+REQUESTS_IN_FLIGHT = Gauge(
+    f'{PREFIX}_requests_in_flight',
+    'Запросы к /api/generate, ответ на которые ещё передаётся')
+
+
+def stage(name: str):
+    """Контекстный менеджер, замеряющий длительность этапа `name`."""
+    return STAGE_SECONDS.labels(name).time()
+
+
+async def timed(name: str, awaitable: Awaitable[T]) -> T:
+    """Дожидается `awaitable`, замеряя длительность как этап `name`."""
+    with stage(name):
+        return await awaitable
+
+
+def llm_turn(messages: List[BaseMessage]) -> str:
+    """Номер вызова LLM после последнего вопроса пользователя."""
+    turn = 1
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            turn += 1
+    return str(turn) if turn < 3 else '3+'
+
+
+Stats = Callable[[], Dict[str, float]]
+# Описания метрик, значения которых берутся из `stats()` компонентов.
+DESCRIPTIONS = {
+    'cache_hits': 'Попадания в кэш',
+    'cache_misses': 'Промахи кэша',
+    'cache_entries': 'Записей в кэше',
+    'scheduler_active': 'Генерации, занимающие место в планировщике',
+    'scheduler_queued': 'Запросы в очереди планировщика',
+    'scheduler_admitted': 'Запросы, допущенные планировщиком',
+    'scheduler_rejected_429': 'Отказы 429 (очередь клиента полна)',
+    'scheduler_rejected_503': 'Отказы 503 (общая очередь или таймаут)',
+    'scheduler_wait_p95_ms': 'p95 ожидания в очереди, мс',
+    'flights_in_flight': 'Идущие генерации с подписчиками',
+    'flights_coalesced': 'Запросы, присоединённые к идущей генерации',
+}
+
+
+class StatsCollector(Collector):
+    """
+    Экспортирует уже собираемую статистику (`stats()` кэшей, очереди и
+    объединения запросов) при каждом чтении /metrics; между чтениями
+    ничего не делает. `counters` и `gauges` — пары (ключ `stats()`,
+    имя метрики); метрики одного имени из разных источников различаются
+    меткой `label`.
+    """
+    def __init__(self, label: str = 'source'):
+        self.label = label
+        self._sources: List[
+            Tuple[str, Stats, Iterable[Tuple[str, str]],
+                  Iterable[Tuple[str, str]]]] = []
+
+    def add(
+        self, name: str, stats: Stats,
+        counters: Iterable[Tuple[str, str]] = (),
+        gauges: Iterable[Tuple[str, str]] = ()
+    ) -> None:
+        self._sources.append((name, stats, tuple(counters), tuple(gauges)))
+
+    def collect(self) -> Iterator[Metric]:
+        families: Dict[str, Metric] = {}
+
+        def family(kind: type, metric: str) -> Metric:
+            if metric not in families:
+                families[metric] = kind(
+                    f'{PREFIX}_{metric}', DESCRIPTIONS.get(metric, metric),
+                    labels=[self.label])
+            return families[metric]
+
+        for name, stats, counters, gauges in self._sources:
+            try:
+                values = stats()
+            except Exception:
+                # Компонент ещё не создан или недоступен — пропускаем.
+                continue
+            for key, metric in counters:
+                if key in values:
+                    family(CounterMetricFamily, metric).add_metric(
+                        [name], values[key])
+            for key, metric in gauges:
+                if key in values:
+                    family(GaugeMetricFamily, metric).add_metric(
+                        [name], values[key])
+        yield from families.values()
+
+
+CACHE_STATS = StatsCollector(label='cache')
+SERVING_STATS = StatsCollector(label='component')
+REGISTRY.register(CACHE_STATS)
+REGISTRY.register(SERVING_STATS)
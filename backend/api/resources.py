@@ -0,0 +1,115 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache, partial
+import os
+from typing import Any, Callable, Dict, TypeVar
+
+import httpx
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+from api.literary_entity_extractor import (
+    EntityGazetteer, LiteraryEntityExtractor)
+from db import VECTOR_STORE, ChromaManager, NumpyVectorStore, VectorStore
+from db.numpy_store import NUMPY_STORE_DIR
+from utils import BatchEmbedder, CachedEmbedder
+from utils.cache import SQLiteCache
+from utils.embeddings import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_TTL
+
+OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
+OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
+OLLAMA_BASE_URL = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '32'))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv('OLLAMA_MAX_KEEPALIVE', '16'))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv('OLLAMA_KEEPALIVE_EXPIRY', '60'))
+QUERY_EMBEDDING_BATCH_TIMEOUT = float(
+    os.getenv('QUERY_EMBEDDING_BATCH_TIMEOUT', '0.005'))
+# Потоки для блокирующих обращений к хранилищу из асинхронного кода.
+STORE_WORKERS = int(os.getenv('STORE_WORKERS', '8'))
+
+T = TypeVar('T')
+
+
+def ollama_client_kwargs() -> Dict[str, Any]:
+    """
+    Параметры пула соединений httpx для клиентов Ollama: соединения
+    переиспользуются между запросами, а не открываются на каждый вызов.
+    """
+    return {
+        'limits': httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+@dataclass(frozen=True)
+class Resources:
+    """
+    Общие для всех запросов объекты: создаются один раз при старте
+    и безопасны для одновременного использования из нескольких потоков.
+    """
+    llm: ChatOllama
+    extractor: LiteraryEntityExtractor
+    gazetteer: EntityGazetteer
+    embedder: CachedEmbedder
+    store: VectorStore
+    executor: ThreadPoolExecutor
+
+    async def run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Выполняет блокирующий вызов (ChromaDB, индексы) в ограниченном
+        пуле `executor`, не занимая цикл событий.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+
+def build_vector_store() -> VectorStore:
+    if VECTOR_STORE == 'numpy':
+        return NumpyVectorStore(NUMPY_STORE_DIR)
+    if VECTOR_STORE != 'chroma':
+        raise ValueError(
+            f'Неизвестное хранилище "{VECTOR_STORE}", '
+            'ожидается "chroma" или "numpy"')
+    return ChromaManager(
+        persist_directory=os.getenv('CHROMA_PERSIST_DIR', './chroma_db'))
+
+
+def build_resources() -> Resources:
+    llm = ChatOllama(
+        model=os.getenv('LLM_MODEL', 'qwen3:14b'),
+        base_url=OLLAMA_BASE_URL,
+        temperature=0.0,
+        client_kwargs=ollama_client_kwargs(),
+    )
+    embedding_model = os.getenv('EMBEDDING_MODEL', 'bge-m3:567m')
+    embedder = CachedEmbedder(
+        BatchEmbedder(
+            OllamaEmbeddings(
+                model=embedding_model,
+                base_url=OLLAMA_BASE_URL,
+                client_kwargs=ollama_client_kwargs(),
+            ),
+            max_wait=QUERY_EMBEDDING_BATCH_TIMEOUT
+        ),
+        model=embedding_model,
+        disk_cache=SQLiteCache(
+            EMBEDDING_CACHE_PATH, max_age=EMBEDDING_CACHE_TTL or None
+        ) if EMBEDDING_CACHE_PATH else None,
+    )
+    return Resources(
+        llm=llm,
+        extractor=LiteraryEntityExtractor(llm=llm, need_summary=False),
+        gazetteer=EntityGazetteer(),
+        embedder=embedder,
+        store=build_vector_store(),
+        executor=ThreadPoolExecutor(
+            max_workers=STORE_WORKERS, thread_name_prefix='store'),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_resources() -> Resources:
+    return build_resources()
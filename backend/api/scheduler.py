@@ -0,0 +1,175 @@
+import asyncio
+from collections import OrderedDict, deque
+from functools import lru_cache
+import math
+import os
+import time
+from typing import Deque, Dict, Hashable, Optional
+
+# Сколько ответов генерируется одновременно (запросы к LLM).
+MAX_CONCURRENT_GENERATIONS = int(
+    os.getenv('MAX_CONCURRENT_GENERATIONS', '4'))
+MAX_QUEUED_REQUESTS = int(os.getenv('MAX_QUEUED_REQUESTS', '32'))
+MAX_QUEUED_PER_CLIENT = int(os.getenv('MAX_QUEUED_PER_CLIENT', '4'))
+# Меньше `BACKEND_READ_TIMEOUT` фронтенда (120 с), чтобы клиент получил
+# 503, а не обрыв соединения.
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', '30'))
+# Начальная оценка длительности генерации для `Retry-After`, секунды.
+INITIAL_SERVICE_TIME = 10.0
+WAIT_SAMPLES = 1000
+
+
+class AdmissionRejected(Exception):
+    """Запрос не принят: 429 — лимит клиента, 503 — общая очередь."""
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RequestScheduler:
+    """
+    Допуск запросов к генерации: не больше `max_concurrent` одновременно,
+    остальные ждут в ограниченной очереди. Очередь разбита по клиентам и
+    обслуживается по кругу, так что клиент с пачкой запросов не задержит
+    остальных больше, чем на один свой запрос. Переполнение очереди
+    клиента — 429, общей очереди или ожидание дольше `queue_timeout` —
+    503; в обоих случаях с оценкой `retry_after` в секундах.
+    Используется из одного цикла событий.
+    """
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_GENERATIONS,
+        max_queued: int = MAX_QUEUED_REQUESTS,
+        max_queued_per_client: int = MAX_QUEUED_PER_CLIENT,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {429: 0, 503: 0}
+        self.timed_out = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._queues: 'OrderedDict[Hashable, Deque[asyncio.Future]]' = (
+            OrderedDict())
+
+    def retry_after(self) -> int:
+        """Оценка времени до освобождения места в очереди, секунды."""
+        rounds = (self.queued + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.service_time))
+
+    def _reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        self.rejected[status_code] += 1
+        return AdmissionRejected(status_code, self.retry_after(), reason)
+
+    async def acquire(self, client: Hashable) -> float:
+        """
+        Ждёт места для генерации и возвращает время начала обслуживания
+        (для `release`). Бросает `AdmissionRejected`, если очередь полна
+        или место не освободилось за `queue_timeout`.
+        """
+        start = time.monotonic()
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            return self._admit(start)
+        waiting = self._queues.get(client)
+        if waiting is not None and (
+                len(waiting) >= self.max_queued_per_client):
+            raise self._reject(429, 'Слишком много запросов от клиента')
+        if self.queued >= self.max_queued:
+            raise self._reject(503, 'Очередь запросов переполнена')
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(future), timeout=self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Место уже передано этому запросу — возвращаем его.
+                self._hand_over()
+            else:
+                future.cancel()
+                self._discard(client, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise self._reject(
+                    503, 'Превышено время ожидания в очереди') from None
+            raise
+        return self._admit(start)
+
+    def _admit(self, start: float) -> float:
+        now = time.monotonic()
+        self._waits.append(now - start)
+        self.admitted += 1
+        return now
+
+    def _discard(self, client: Hashable, future: asyncio.Future) -> None:
+        waiting = self._queues.get(client)
+        if waiting is not None and future in waiting:
+            waiting.remove(future)
+            self.queued -= 1
+            if not waiting:
+                del self._queues[client]
+
+    def release(self, started: Optional[float] = None) -> None:
+        """
+        Освобождает место и передаёт его следующему клиенту по кругу.
+        `started` — результат `acquire`; без него (место не понадобилось)
+        длительность не учитывается в оценке `retry_after`.
+        """
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self.service_time = 0.9 * self.service_time + 0.1 * elapsed
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        self.active -= 1
+        while self._queues and self.active < self.max_concurrent:
+            client, waiting = next(iter(self._queues.items()))
+            future = waiting.popleft()
+            self.queued -= 1
+            if waiting:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            if not future.done():
+                future.set_result(None)
+                self.active += 1
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self._waits)
+
+        def percentile(q: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * q))] * 1000
+
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'clients_queued': len(self._queues),
+            'max_concurrent': self.max_concurrent,
+            'max_queued': self.max_queued,
+            'admitted': self.admitted,
+            'rejected_429': self.rejected[429],
+            'rejected_503': self.rejected[503],
+            'timed_out': self.timed_out,
+            'wait_p50_ms': percentile(0.5),
+            'wait_p95_ms': percentile(0.95),
+            'wait_max_ms': waits[-1] * 1000 if waits else 0.0,
+            'service_time_s': self.service_time,
+            'retry_after_s': self.retry_after(),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_scheduler() -> RequestScheduler:
+    return RequestScheduler()
@@ -0,0 +1,114 @@
+from functools import lru_cache
+import json
+import os
+import threading
+from typing import List, Optional
+
+from langchain_core.messages import (
+    AIMessage, BaseMessage, HumanMessage, messages_from_dict,
+    messages_to_dict)
+
+from utils.cache import LRUCache, SQLiteCache
+
+# Пустой путь — сессии хранятся только в памяти процесса.
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', '')
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '1000'))
+SESSION_MAX_AGE = float(os.getenv('SESSION_MAX_AGE', str(24 * 3600)))
+# Сколько токенов истории передаётся модели вместе с новым вопросом.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '2048'))
+# Грубая оценка для qwen3 на русском тексте.
+CHARS_PER_TOKEN = 3
+NAMESPACE = 'session'
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    content = message.content
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return len(content) // CHARS_PER_TOKEN + 1
+
+
+def compact_history(
+    messages: List[BaseMessage], budget: int = HISTORY_TOKEN_BUDGET
+) -> List[BaseMessage]:
+    """
+    Сжимает историю перед новым ходом: от каждого прошлого хода остаются
+    вопрос и итоговый ответ агента (вызовы инструмента и найденные
+    фрагменты отбрасываются — ответ их уже учитывает), затем старые ходы
+    отбрасываются, пока история не уложится в `budget` токенов.
+    Системные сообщения не сохраняются: агент добавляет свой промпт сам.
+    """
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            turns.append([message, None])
+        elif (turns and isinstance(message, AIMessage) and
+                not message.tool_calls and message.content):
+            turns[-1][1] = message
+
+    kept: List[BaseMessage] = []
+    used = 0
+    for question, answer in reversed(turns):
+        turn = [question] + ([answer] if answer is not None else [])
+        cost = sum(estimate_tokens(message) for message in turn)
+        if used + cost > budget:
+            break
+        kept[:0] = turn
+        used += cost
+    return kept
+
+
+class SessionStore:
+    """
+    История диалогов по идентификатору сессии: последние сессии — в LRU
+    в памяти, при заданном `path` — ещё и в SQLite, так что история
+    переживает вытеснение из памяти и перезапуск. Хранится уже сжатая
+    история (`compact_history`), поэтому её размер ограничен `budget`.
+    Ходы добавляются под блокировкой: одновременные запросы одной сессии
+    (повторная отправка, две вкладки) не затирают ходы друг друга.
+    """
+    def __init__(
+        self,
+        path: str = SESSION_STORE_PATH,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        max_age: Optional[float] = SESSION_MAX_AGE,
+        budget: int = HISTORY_TOKEN_BUDGET,
+    ):
+        self.budget = budget
+        self.memory: LRUCache[List[BaseMessage]] = LRUCache(
+            max_entries=max_entries, max_age=max_age or None)
+        self.storage = (
+            SQLiteCache(path, max_age=max_age or None) if path else None)
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> List[BaseMessage]:
+        messages = self.memory.get(session_id)
+        if messages is None and self.storage is not None:
+            value = self.storage.get(session_id)
+            if value is not None:
+                messages = messages_from_dict(json.loads(value))
+                self.memory.set(session_id, messages)
+        return list(messages or [])
+
+    def save(self, session_id: str, messages: List[BaseMessage]) -> None:
+        messages = compact_history(messages, self.budget)
+        self.memory.set(session_id, messages)
+        if self.storage is not None:
+            self.storage.set(
+                session_id,
+                json.dumps(messages_to_dict(messages), ensure_ascii=False),
+                namespace=NAMESPACE)
+
+    def append_turn(
+        self, session_id: str, question: str, answer: str
+    ) -> None:
+        if not answer.strip():
+            return
+        with self._lock:
+            self.save(session_id, self.load(session_id) + [
+                HumanMessage(content=question), AIMessage(content=answer)])
+
+
+@lru_cache(maxsize=1)
+def get_session_store() -> SessionStore:
+    return SessionStore()
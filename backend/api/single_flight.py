@@ -0,0 +1,122 @@
+import asyncio
+from typing import (
+    AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional)
+
+from loguru import logger
+
+
+class Flight:
+    """
+    Одна генерация ответа, на поток которой подписаны все запросы с тем же
+    ключом. Генерация идёт в отдельной задаче и не отменяется, когда
+    отключается один из подписчиков; задача отменяется только если
+    отключились все. Подписчик учитывается с момента `join`, а не с
+    начала чтения `subscribe`, так что присоединившийся запрос не
+    потеряет генерацию, если до начала чтения отключится единственный
+    читающий. Фрагменты накапливаются, так что подписчик,
+    пришедший позже, сначала получает всё сгенерированное до него.
+    """
+    def __init__(
+        self,
+        stream: AsyncIterator[str],
+        on_done: Optional[Callable[[], None]] = None,
+    ):
+        self.chunks: List[str] = []
+        self.done = False
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            # Подписчикам — обычная ошибка: `CancelledError` в чужой
+            # задаче выглядел бы как отмена её самой.
+            self.error = RuntimeError('Генерация ответа прервана')
+            raise
+        except Exception as e:
+            logger.error(f'Ошибка генерации ответа: {str(e)}')
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            if self._on_done is not None:
+                self._on_done()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def join(self) -> None:
+        """Учитывает подписчика; на каждый `join` — один `leave`."""
+        self.subscribers += 1
+
+    def leave(self) -> None:
+        """Снимает подписчика; без подписчиков генерация отменяется."""
+        self.subscribers -= 1
+        if not self.subscribers and not self.done:
+            self.cancelled = True
+            self._task.cancel()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """Поток ответа с начала; вызывается между `join` и `leave`."""
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока генерация с ключом
+    идёт, новые запросы с тем же ключом подписываются на неё, а не
+    запускают свою. Ключ удаляется по окончании генерации, так что
+    следующий запрос снова запускает генерацию (или попадает в кэш
+    ответов). Используется из одного цикла событий.
+    """
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Flight]:
+        flight = self._flights.get(key)
+        if flight is None or flight.cancelled:
+            return None
+        self.coalesced += 1
+        return flight
+
+    def start(
+        self, key: str, stream: AsyncIterator[str],
+        on_done: Optional[Callable[[], None]] = None
+    ) -> Flight:
+        def finish() -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if on_done is not None:
+                on_done()
+
+        flight = Flight(stream, finish)
+        self._flights[key] = flight
+        self.started += 1
+        return flight
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._flights),
+            'started': self.started,
+            'coalesced': self.coalesced,
+        }
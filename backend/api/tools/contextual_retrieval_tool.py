@@ -1,41 +1,34 @@
+import asyncio
 import os
 from typing import Any, Dict, List
 import yaml
 
 from langchain_core.tools import BaseTool
-from langchain_ollama import ChatOllama, OllamaEmbeddings
 from loguru import logger
 from pydantic import BaseModel, Field
 
-from api.literary_entity_extractor import LiteraryEntityExtractor
-from db.chroma_manager import ChromaManager
+from api.metrics import RETRIEVED_CHUNKS, stage, timed
+from api.resources import Resources, get_resources
+from db import VectorStore
 
-OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
-OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
-OLLAMA_BASE_URL = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
 MAX_LOG_LEN = 100
 MAX_CONTEXT_LEN = 2
-
-
-def get_llm():
-    return ChatOllama(
-        model=os.getenv('LLM_MODEL', 'qwen3:14b'),
-        base_url=OLLAMA_BASE_URL,
-        temperature=0.0
-    )
-
-
-def get_embedding_model():
-    return OllamaEmbeddings(
-        model=os.getenv('EMBEDDING_MODEL', 'bge-m3:567m'),
-        base_url=OLLAMA_BASE_URL
-    )
-
-
-def get_chroma_manager():
-    persist_dir = os.getenv('CHROMA_PERSIST_DIR', './chroma_db')
-    manager = ChromaManager(persist_directory=persist_dir)
-    return manager
+# gazetteer — словарь псевдонимов без LLM; fallback — словарь, а для
+# неоднозначных вопросов LLM; llm — всегда LiteraryEntityExtractor.
+ENTITY_MATCHER = os.getenv('ENTITY_MATCHER', 'gazetteer')
+# flat — только найденные чанки; neighbors — с соседними чанками.
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'flat')
+# vector — только векторный поиск; hybrid — вместе с BM25 по текстам
+# чанков, списки объединяются reciprocal rank fusion.
+RETRIEVAL_SEARCH = os.getenv('RETRIEVAL_SEARCH', 'hybrid')
+N_RESULTS = 5
+# Сколько результатов берётся из каждого списка перед объединением.
+FUSION_DEPTH = 20
+RRF_K = 60
+# Не больше CHUNK_OVERLAP в db_filling.py.
+MAX_OVERLAP = 256
+# Начало ответа инструмента, когда поиск не удался.
+SEARCH_ERROR = 'Ошибка при поиске контекста'
 
 
 def get_tool_description() -> str:
@@ -61,30 +54,6 @@ class ContextualRetrievalTool(BaseTool):
         super().__init__(**kwargs)
         object.__setattr__(self, 'last_context', '')
 
-    def _filter_by_characters(
-            self, results: Dict, characters: List[str]) -> List[Dict]:
-        if not characters:
-            return self._convert_results(results)
-        items = []
-        metadatas = results['metadatas'][0]
-        documents = results['documents'][0]
-        ids = results['ids'][0]
-
-        for doc, meta, doc_id in zip(documents, metadatas, ids):
-            meta_chars = set(
-                meta.get('characters', '').split(', ')
-            ) if meta.get('characters') else set()
-
-            if set(characters) & meta_chars:
-                items.append(
-                    dict(
-                        id=doc_id, text=doc,
-                        prev_id=meta.get('prev_id', ''),
-                        next_id=meta.get('next_id', '')
-                    )
-                )
-        return items
-
     def _convert_results(self, results: Dict[str, List]) -> List[Dict]:
         items = []
         metadatas = results['metadatas'][0]
@@ -100,79 +69,204 @@ class ContextualRetrievalTool(BaseTool):
             )
         return items
 
+    @staticmethod
+    def _fuse(*rankings: List[Dict], k: int = RRF_K) -> List[Dict]:
+        """Reciprocal rank fusion: оценка чанка — сумма 1 / (k + ранг)."""
+        scores: Dict[str, float] = {}
+        items: Dict[str, Dict] = {}
+        for ranking in rankings:
+            for rank, item in enumerate(ranking, 1):
+                doc_id = item['id']
+                scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank)
+                items.setdefault(doc_id, item)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [items[doc_id] for doc_id in ranked]
+
+    def _vector_search(
+        self, store: VectorStore, query_embedding: List[float],
+        n_results: int, characters: List[str], locations: List[str]
+    ) -> List[Dict]:
+        with stage('vector_search'):
+            items = self._convert_results(store.search(
+                query_embedding=query_embedding,
+                n_results=n_results,
+                characters=characters,
+                locations=locations
+            ))
+        RETRIEVED_CHUNKS.labels('vector').observe(len(items))
+        return items
+
+    def _lexical_search(
+        self, store: VectorStore, query: str,
+        n_results: int, characters: List[str], locations: List[str]
+    ) -> List[Dict]:
+        with stage('lexical_search'):
+            items = self._convert_results(store.lexical_search(
+                query,
+                n_results=n_results,
+                characters=characters,
+                locations=locations
+            ))
+        RETRIEVED_CHUNKS.labels('lexical').observe(len(items))
+        return items
+
+    def _search(
+        self, store: VectorStore, query: str, query_embedding: List[float],
+        characters: List[str], locations: List[str]
+    ) -> List[Dict]:
+        # Кандидаты отбираются по индексу сущностей до поиска соседей.
+        if RETRIEVAL_SEARCH != 'hybrid':
+            return self._vector_search(
+                store, query_embedding, N_RESULTS, characters, locations)
+        vector = self._vector_search(
+            store, query_embedding, FUSION_DEPTH, characters, locations)
+        lexical = self._lexical_search(
+            store, query, FUSION_DEPTH, characters, locations)
+        return self._fuse(vector, lexical)[:N_RESULTS]
+
+    @staticmethod
+    def _join_overlapping(left: str, right: str) -> str:
+        # Соседние чанки пересекаются на CHUNK_OVERLAP символов.
+        for size in range(min(len(left), len(right), MAX_OVERLAP), 0, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return left + '\n' + right
+
     def _expand_context_with_neighbors(
-        self, chroma: ChromaManager, initial_results: List[Dict]
+        self, store: VectorStore, initial_results: List[Dict]
     ) -> List[str]:
-        added_id = []
-        expanded = []
-        for res in initial_results:
-            if res['id'] in added_id:
+        """
+        Добавляет к найденным чанкам соседние (`prev_id`/`next_id`), запрашивая
+        все недостающие тексты одним обращением к хранилищу. Смежные
+        и пересекающиеся окна склеиваются в один фрагмент; фрагменты идут
+        в порядке лучшего попавшего в них результата поиска.
+        """
+        texts: Dict[str, str] = {}
+        rank: Dict[str, int] = {}
+        next_of: Dict[str, str] = {}
+        for i, res in enumerate(initial_results):
+            if res['id'] in rank:
                 continue
-            added_id.append(res['id'])
-            prev_id = res['prev_id']
-            next_id = res['next_id']
-
-            if prev_id:
-                prev_res = chroma.get(prev_id)
-                if prev_res['documents']:
-                    expanded.append(prev_res['documents'][0])
-            expanded.append(res['text'])
-            if next_id:
-                next_res = chroma.get(next_id)
-                if next_res['documents']:
-                    expanded.append(next_res['documents'][0])
-        return expanded
+            rank[res['id']] = i
+            texts[res['id']] = res['text']
+            if res['prev_id']:
+                next_of[res['prev_id']] = res['id']
+            if res['next_id']:
+                next_of[res['id']] = res['next_id']
+
+        window_ids = set(next_of) | set(next_of.values()) | set(rank)
+        texts.update(store.get_documents(
+            doc_id for doc_id in window_ids if doc_id not in texts))
+        next_of = {
+            prev_id: next_id for prev_id, next_id in next_of.items()
+            if prev_id in texts and next_id in texts
+        }
+
+        has_prev = set(next_of.values())
+        windows = []
+        for start in texts:
+            if start in has_prev:
+                continue
+            chain = [start]
+            while (chain[-1] in next_of and
+                    next_of[chain[-1]] not in chain):
+                chain.append(next_of[chain[-1]])
+            merged = texts[chain[0]]
+            for doc_id in chain[1:]:
+                merged = self._join_overlapping(merged, texts[doc_id])
+            best = min(rank.get(doc_id, len(rank)) for doc_id in chain)
+            windows.append((best, merged))
+        return [text for _, text in sorted(windows, key=lambda w: w[0])]
 
     def _flatted_context(self, initial_results: List[Dict]) -> List[str]:
         return [res['text'] for res in initial_results]
 
+    def _extract_entities(
+            self, resources: Resources, query: str) -> Dict[str, List[str]]:
+        if ENTITY_MATCHER == 'llm':
+            return resources.extractor.invoke(query)
+        matches = resources.gazetteer.match(query)
+        if matches.ambiguous and ENTITY_MATCHER == 'fallback':
+            logger.info(
+                f'Неоднозначные сущности {matches.ambiguous}, вызов LLM')
+            return resources.extractor.invoke(query)
+        return matches._asdict()
+
+    async def _aextract_entities(
+            self, resources: Resources, query: str) -> Dict[str, List[str]]:
+        if ENTITY_MATCHER == 'llm':
+            return await resources.extractor.ainvoke(query)
+        matches = resources.gazetteer.match(query)
+        if matches.ambiguous and ENTITY_MATCHER == 'fallback':
+            logger.info(
+                f'Неоднозначные сущности {matches.ambiguous}, вызов LLM')
+            return await resources.extractor.ainvoke(query)
+        return matches._asdict()
+
+    @staticmethod
+    def _log_entities(state: Dict[str, List[str]]) -> None:
+        logger.info(f'Извлечено "Сharacters": {state.get("characters", [])}')
+        logger.info(f'Извлечено "Locations" : {state.get("locations", [])}')
+
+    def _build_context(self, store: VectorStore, items: List[Dict]) -> str:
+        if not items:
+            logger.info('Не найдено релевантных фрагментов')
+            return 'Не найдено релевантных фрагментов.'
+
+        if RETRIEVAL_MODE == 'neighbors':
+            with stage('neighbors'):
+                expanded_context = self._expand_context_with_neighbors(
+                    store, items)
+        else:
+            expanded_context = self._flatted_context(items)
+        for item in expanded_context[:MAX_CONTEXT_LEN]:
+            logger.info(f'Получен ответ от БД: {item[:MAX_LOG_LEN]}')
+        final_context = '\n\n'.join(expanded_context[:MAX_CONTEXT_LEN])
+        object.__setattr__(self, 'last_context', final_context)
+        return final_context
+
     def _run(self, query: str, **kwargs: Any) -> str:
         try:
             logger.info('Вызван "ContextualRetrievalTool"')
-            extractor = LiteraryEntityExtractor(
-                llm=get_llm(), need_summary=False)
-            state = extractor.invoke(query)
-            characters = state.get('characters', [])
-            locations = state.get('locations', [])
-            logger.info(f'Извлечено "Сharacters": {characters}')
-            logger.info(f'Извлечено "Locations" : {locations}')
-
-            where = None
-            if locations:
-                where = {'primary_location': locations[0]}
-            embedder = get_embedding_model()
-            chroma = get_chroma_manager()
-            query_embedding = embedder.embed_query(query)
-
-            try:
-                results = chroma.query(
-                    query_embedding=query_embedding,
-                    n_results=5,
-                    where=where
-                )
-            except Exception:
-                results = chroma.query(query_embedding=query_embedding)
-
-            filtered_by_chars = self._filter_by_characters(results, characters)
-            if not filtered_by_chars:
-                fallback = self._convert_results(results)
-                if fallback:
-                    filtered_by_chars = fallback
-                else:
-                    logger.info('Не найдено релевантных фрагментов')
-                    return 'Не найдено релевантных фрагментов.'
-
-            expanded_context = self._flatted_context(filtered_by_chars)
-            for item in expanded_context[:MAX_CONTEXT_LEN]:
-                logger.info(f'Получен ответ от БД: {item[:MAX_LOG_LEN]}')
-            final_context = '\n\n'.join(expanded_context[:MAX_CONTEXT_LEN])
-            object.__setattr__(self, 'last_context', final_context)
-            return final_context
+            resources = get_resources()
+            with stage('extraction'):
+                state = self._extract_entities(resources, query)
+            self._log_entities(state)
+            with stage('embedding'):
+                query_embedding = resources.embedder.embed_query(query)
+            items = self._search(
+                resources.store, query, query_embedding,
+                state.get('characters', []), state.get('locations', []))
+            return self._build_context(resources.store, items)
+
+        except Exception as e:
+            logger.error(f'{SEARCH_ERROR}: {str(e)}')
+            object.__setattr__(self, 'last_context', '')
+            return f'{SEARCH_ERROR}: {str(e)}'
+
+    async def _arun(self, query: str, **kwargs: Any) -> str:
+        """
+        Асинхронный вариант `_run`: извлечение сущностей и эмбеддинг
+        запроса идут одновременно, а блокирующие обращения к хранилищу —
+        в пуле потоков `Resources.executor`, не занимая цикл событий.
+        """
+        try:
+            logger.info('Вызван "ContextualRetrievalTool" (async)')
+            resources = get_resources()
+            state, query_embedding = await asyncio.gather(
+                timed('extraction', self._aextract_entities(resources, query)),
+                timed('embedding', resources.embedder.aembed_query(query)))
+            self._log_entities(state)
+            items = await resources.run_blocking(
+                self._search, resources.store, query, query_embedding,
+                state.get('characters', []), state.get('locations', []))
+            return await resources.run_blocking(
+                self._build_context, resources.store, items)
 
         except Exception as e:
-            logger.error(f'Ошибка при поиске контекста: {str(e)}')
+            logger.error(f'{SEARCH_ERROR}: {str(e)}')
             object.__setattr__(self, 'last_context', '')
-            return f'Ошибка при поиске контекста: {str(e)}'
+            return f'{SEARCH_ERROR}: {str(e)}'
 
     def get_last_context(self) -> str:
         return getattr(self, 'last_context', '')
@@ -0,0 +1,2 @@
+# Благодаря этому файлу pytest добавляет каталог backend в sys.path, и
+# тесты импортируют `api`, `db` и `utils` при запуске из любого каталога.
@@ -1,3 +1,15 @@
 from .chroma_manager import ChromaManager
+from .entity_index import EntityIndex
+from .lexical_index import LexicalIndex
+from .numpy_store import NumpyVectorStore
+from .parts import (
+    PartWriter, collect_ids, find_parts, iter_json_part, iter_part,
+    iter_records, part_dim, part_files, read_part, write_part)
+from .vector_store import VECTOR_STORE, VectorStore
 
-__all__ = ['ChromaManager']
+__all__ = [
+    'ChromaManager', 'EntityIndex', 'LexicalIndex', 'NumpyVectorStore',
+    'PartWriter', 'VECTOR_STORE', 'VectorStore', 'collect_ids', 'find_parts',
+    'iter_json_part', 'iter_part', 'iter_records', 'part_dim', 'part_files',
+    'read_part', 'write_part'
+]
@@ -1,15 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import copy
 import json
 import os
 from pathlib import Path
-from typing import Any, Dict, List, Union
-from tqdm import tqdm
+import threading
+import time
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple,
+    TypeVar, Union)
 
 import chromadb
+import numpy as np
 from chromadb.api.models.Collection import Collection
 from chromadb.config import Settings
+from chromadb.errors import NotFoundError
 
+from utils.cache import LRUCache
 
-class ChromaManager:
+from .entity_index import EntityIndex
+from .lexical_index import LexicalIndex
+from .quantization import EMBEDDING_QUANTIZATION
+from .parts import Record, collect_ids, iter_records
+from .vector_store import VectorStore
+
+CHROMA_BATCH_SIZE = int(os.getenv('CHROMA_BATCH_SIZE', '512'))
+CHROMA_LOAD_WORKERS = int(os.getenv('CHROMA_LOAD_WORKERS', '4'))
+CHROMA_DOCUMENT_CACHE_SIZE = int(
+    os.getenv('CHROMA_DOCUMENT_CACHE_SIZE', '4096'))
+EXACT_SEARCH_MAX_CANDIDATES = int(
+    os.getenv('EXACT_SEARCH_MAX_CANDIDATES', '2048'))
+REGISTRY_FILE = 'collections.json'
+ENTITY_INDEX_DIR = 'entity_index'
+LEXICAL_INDEX_DIR = 'lexical_index'
+
+T = TypeVar('T')
+
+
+class ChromaManager(VectorStore):
+    """
+    Один экземпляр можно использовать из нескольких потоков. Дескрипторы
+    коллекций кэшируются по физическому имени; реестр перечитывается только
+    при изменении файла, так что переключение коллекции другим процессом
+    (`rebuild`) подхватывается при следующем запросе.
+    """
     def __init__(self, persist_directory: str = "./chroma_db"):
         self.persist_directory = persist_directory
         os.makedirs(self.persist_directory, exist_ok=True)
@@ -18,14 +51,96 @@ class ChromaManager:
             path=self.persist_directory,
             settings=Settings(anonymized_telemetry=False)
         )
+        self._lock = threading.Lock()
+        self._collections: Dict[str, Collection] = {}
+        self._registry_cache: Optional[Tuple[Tuple[int, int], Dict]] = None
+        # Тексты часто запрашиваемых чанков по ключу (версия коллекции, id).
+        self._documents = LRUCache[str](CHROMA_DOCUMENT_CACHE_SIZE)
+        # Реентерабельная: построение BM25-индекса под ней может
+        # запросить индекс сущностей.
+        self._index_lock = threading.RLock()
+        self._indexes: Dict[str, EntityIndex] = {}
+        self._lexical: Dict[str, LexicalIndex] = {}
+
+    def _registry_path(self) -> str:
+        return os.path.join(self.persist_directory, REGISTRY_FILE)
+
+    def _read_registry(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            stat = os.stat(self._registry_path())
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._registry_cache
+        if cached is None or cached[0] != key:
+            with open(self._registry_path(), 'r', encoding='utf-8') as f:
+                cached = self._registry_cache = (key, json.load(f))
+        return copy.deepcopy(cached[1])
+
+    def _write_registry(self, registry: Dict[str, Dict[str, Any]]) -> None:
+        tmp_path = self._registry_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(registry, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._registry_path())
+
+    def _resolve(self, name: str) -> str:
+        """
+        Имя физической коллекции, на которую указывает логическое имя.
+        Для баз без реестра логическое и физическое имена совпадают.
+        """
+        entry = self._read_registry().get(name)
+        return entry['collection'] if entry else name
+
+    def collection_version(self, name: str = 'war_and_peace') -> str:
+        entry = self._read_registry().get(name, {})
+        return f'{self._resolve(name)}:{entry.get("version", 0)}'
+
+    def _bump_version(
+            self, name: str, collection: Optional[str] = None) -> None:
+        registry = self._read_registry()
+        entry = registry.get(name, {'collection': name, 'version': 0})
+        if collection:
+            entry['collection'] = collection
+        entry['version'] = entry.get('version', 0) + 1
+        registry[name] = entry
+        self._write_registry(registry)
 
     def _create_or_get_collection(
             self, name: str = 'war_and_peace') -> Collection:
-        self.collection = self.client.get_or_create_collection(
-            name=name,
-            metadata={'hnsw:space': 'cosine'}
-        )
-        return self.collection
+        physical_name = self._resolve(name)
+        with self._lock:
+            collection = self._collections.get(physical_name)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=physical_name,
+                    metadata={'hnsw:space': 'cosine'}
+                )
+                self._collections[physical_name] = collection
+        self.collection = collection
+        return collection
+
+    def _forget_collection(self, physical_name: str) -> None:
+        with self._lock:
+            self._collections.pop(physical_name, None)
+
+    def _drop_collection(self, physical_name: str) -> None:
+        self._forget_collection(physical_name)
+        self.client.delete_collection(physical_name)
+        EntityIndex.remove(self._index_prefix(physical_name))
+        lexical_path = self._lexical_path(physical_name)
+        if os.path.exists(lexical_path):
+            os.remove(lexical_path)
+
+    def _with_collection(
+        self, collection_name: str, action: Callable[[Collection], T]
+    ) -> T:
+        collection = self._create_or_get_collection(collection_name)
+        try:
+            return action(collection)
+        except NotFoundError:
+            # Коллекция удалена другим процессом — дескриптор устарел.
+            self._forget_collection(collection.name)
+            return action(self._create_or_get_collection(collection_name))
 
     def clear_collection(
             self, collection_name: str = 'war_and_peace') -> None:
@@ -40,10 +155,210 @@ class ChromaManager:
 
     def delete_collection(
             self, collection_name: str = 'war_and_peace') -> None:
-        if collection_name in [
+        physical_name = self._resolve(collection_name)
+        if physical_name in [
             col.name for col in self.client.list_collections()
         ]:
-            self.client.delete_collection(collection_name)
+            self._drop_collection(physical_name)
+        registry = self._read_registry()
+        if registry.pop(collection_name, None):
+            self._write_registry(registry)
+
+    def _batch_size(self, batch_size: Optional[int] = None) -> int:
+        return max(1, min(
+            batch_size or CHROMA_BATCH_SIZE,
+            self.client.get_max_batch_size()))
+
+    def _write_batches(
+        self, collection: Collection,
+        records: Iterable[Record],
+        batch_size: Optional[int] = None,
+        upsert: bool = True
+    ) -> int:
+        write = collection.upsert if upsert else collection.add
+        size = self._batch_size(batch_size)
+        total = 0
+        ids, embeddings, documents, metadatas = [], [], [], []
+
+        def flush():
+            write(
+                ids=ids,
+                embeddings=np.asarray(embeddings, dtype=np.float32),
+                documents=documents,
+                metadatas=metadatas
+            )
+            for batch in (ids, embeddings, documents, metadatas):
+                batch.clear()
+
+        for doc_id, document, embedding, metadata in records:
+            ids.append(doc_id)
+            embeddings.append(embedding)
+            documents.append(document)
+            metadatas.append(metadata)
+            total += 1
+            if len(ids) >= size:
+                flush()
+        if ids:
+            flush()
+        return total
+
+    def load_part(
+        self, path: Union[str, Path],
+        collection_name: str = 'war_and_peace',
+        batch_size: Optional[int] = None,
+        upsert: bool = True,
+        known_ids: Optional[Set[str]] = None
+    ) -> int:
+        """
+        Потоково загружает часть в коллекцию пачками не больше
+        `batch_size` и максимального размера пачки клиента Chroma.
+        `path` — файл `part_N.json` или префикс бинарной части `part_N`.
+        Возвращает число загруженных документов.
+        """
+        collection = self._create_or_get_collection(collection_name)
+        start = time.perf_counter()
+        total = self._write_batches(
+            collection, iter_records(path, known_ids),
+            batch_size, upsert)
+
+        elapsed = time.perf_counter() - start
+        print(
+            f'Из "{path}" загружено {total} документов в коллекцию '
+            f'"{collection_name}" ({total / max(elapsed, 1e-9):.0f} док/с)')
+        return total
+
+    def load_parts(
+        self, paths: Iterable[Union[str, Path]],
+        collection_name: str = 'war_and_peace',
+        batch_size: Optional[int] = None,
+        upsert: bool = True,
+        workers: int = CHROMA_LOAD_WORKERS,
+        on_loaded: Optional[Callable[[Union[str, Path]], None]] = None,
+        known_ids: Optional[Set[str]] = None
+    ) -> int:
+        """
+        Загружает несколько частей параллельно (до `workers` одновременно).
+        `on_loaded` вызывается для каждой успешно загруженной части.
+        """
+        paths = list(paths)
+        self._create_or_get_collection(collection_name)
+        start = time.perf_counter()
+        total = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(
+                    self.load_part, path, collection_name,
+                    batch_size, upsert, known_ids): path
+                for path in paths
+            }
+            for future in as_completed(futures):
+                total += future.result()
+                if on_loaded:
+                    on_loaded(futures[future])
+
+        elapsed = time.perf_counter() - start
+        print(
+            f'Загружено {total} документов из {len(paths)} частей за '
+            f'{elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} док/с)')
+        return total
+
+    def _iter_pages(
+        self, collection_name: str, include: List[str]
+    ) -> Iterator[Dict[str, Any]]:
+        collection = self._create_or_get_collection(collection_name)
+        size = self._batch_size()
+        offset = 0
+        while True:
+            page = collection.get(include=include, limit=size, offset=offset)
+            yield page
+            if len(page['ids']) < size:
+                return
+            offset += size
+
+    def stored_hashes(
+            self, collection_name: str = 'war_and_peace') -> Dict[str, str]:
+        hashes = {}
+        for page in self._iter_pages(collection_name, ['metadatas']):
+            for doc_id, metadata in zip(page['ids'], page['metadatas']):
+                hashes[doc_id] = (metadata or {}).get('content_hash', '')
+        return hashes
+
+    def sync_parts(
+        self, paths: Iterable[Union[str, Path]],
+        collection_name: str = 'war_and_peace',
+        batch_size: Optional[int] = None
+    ) -> Dict[str, int]:
+        """
+        Инкрементальная индексация: сравнивает входящие записи с хранимыми
+        по ID и хэшу содержимого, делает `upsert` только новых и изменённых
+        чанков и удаляет исчезнувшие. Ссылки `prev_id`/`next_id` на чанки,
+        которых нет во входных частях (например, на границе
+        переразбитого раздела), обнуляются.
+        """
+        paths = list(paths)
+        start = time.perf_counter()
+        incoming_ids = collect_ids(paths)
+        stored = self.stored_hashes(collection_name)
+        stats = {'upserted': 0, 'unchanged': 0, 'deleted': 0}
+
+        def changed_records():
+            for path in paths:
+                for doc_id, document, embedding, metadata in (
+                        iter_records(path, incoming_ids)):
+                    if stored.get(doc_id) == metadata['content_hash']:
+                        stats['unchanged'] += 1
+                        continue
+                    yield doc_id, document, embedding, metadata
+
+        collection = self._create_or_get_collection(collection_name)
+        stats['upserted'] = self._write_batches(
+            collection, changed_records(), batch_size)
+
+        vanished = [doc_id for doc_id in stored if doc_id not in incoming_ids]
+        size = self._batch_size(batch_size)
+        for i in range(0, len(vanished), size):
+            collection.delete(ids=vanished[i:i + size])
+        stats['deleted'] = len(vanished)
+
+        if stats['upserted'] or stats['deleted']:
+            self._bump_version(collection_name)
+        self.entity_index(collection_name)
+        elapsed = time.perf_counter() - start
+        print(
+            f'Коллекция "{collection_name}" синхронизирована за '
+            f'{elapsed:.1f} с: добавлено/обновлено {stats["upserted"]}, '
+            f'без изменений {stats["unchanged"]}, удалено {stats["deleted"]}')
+        return stats
+
+    def rebuild(
+        self, paths: Iterable[Union[str, Path]],
+        collection_name: str = 'war_and_peace',
+        **load_kwargs: Any
+    ) -> int:
+        """
+        Полная переиндексация в теневую коллекцию с последующим
+        переключением логического имени на неё. Пока идёт загрузка,
+        запросы продолжают обслуживаться старой коллекцией.
+        """
+        active = self._resolve(collection_name)
+        prefix = f'{collection_name}__'
+        for col in self.client.list_collections():
+            if col.name.startswith(prefix) and col.name != active:
+                self._drop_collection(col.name)
+
+        paths = list(paths)
+        shadow = f'{prefix}{time.time_ns()}'
+        total = self.load_parts(
+            paths, shadow, known_ids=collect_ids(paths),
+            **load_kwargs)
+        self._bump_version(collection_name, collection=shadow)
+        if active != shadow and active in [
+            col.name for col in self.client.list_collections()
+        ]:
+            self._drop_collection(active)
+        print(f'Коллекция "{collection_name}" переключена на "{shadow}"')
+        self.entity_index(collection_name)
+        return total
 
     def load_from_json(
         self, json_path: Union[str, Path],
@@ -60,65 +375,234 @@ class ChromaManager:
             'next_id': str | None
         }
         """
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data: List[Dict[str, Any]] = json.load(f)
-
-        self._create_or_get_collection(collection_name)
+        return self.load_part(json_path, collection_name)
 
-        ids = []
-        embeddings = []
-        documents = []
-        metadatas = []
+    def load_from_part(
+        self, prefix: Union[str, Path],
+        collection_name: str = 'war_and_peace'
+    ):
+        """
+        Загружает часть в бинарном формате (`part_N.jsonl` + `part_N.npy`).
+        Матрица эмбеддингов не разбирается, а отображается в память.
+        """
+        return self.load_part(prefix, collection_name)
 
-        for i, item in enumerate(tqdm(data, desc='Preparing data for Chroma')):
-            ids.append(item.get('id', f'chunk_{i}'))
-            documents.append(item.get('text'))
+    def _index_prefix(self, physical_name: str) -> str:
+        return os.path.join(
+            self.persist_directory, ENTITY_INDEX_DIR, physical_name)
 
-            embedding_str = item.get('embedding')
-            if isinstance(embedding_str, str):
-                embedding = json.loads(embedding_str)
-            else:
-                embedding = embedding_str
-            embeddings.append(embedding)
+    def build_entity_index(
+            self, collection_name: str = 'war_and_peace') -> EntityIndex:
+        """
+        Строит инвертированный индекс сущностей по метаданным коллекции
+        и сохраняет его рядом с базой. Возвращается индекс, заново
+        загруженный с диска: полная матрица float32 отображается в память,
+        а не остаётся в ней после построения.
+        """
+        start = time.perf_counter()
+        version = self.collection_version(collection_name)
+        ids, metadatas, embeddings = [], [], []
+        for page in self._iter_pages(
+                collection_name, ['metadatas', 'embeddings']):
+            ids.extend(page['ids'])
+            metadatas.extend(page['metadatas'])
+            embeddings.extend(page['embeddings'])
+        index = EntityIndex.build(ids, metadatas, embeddings, version)
+        prefix = self._index_prefix(self._resolve(collection_name))
+        index.save(prefix)
+        del embeddings
+        loaded = EntityIndex.load(prefix)
+        if loaded is not None:
+            index = loaded
+        print(
+            f'Индекс сущностей коллекции "{collection_name}" построен за '
+            f'{time.perf_counter() - start:.1f} с: {len(index)} чанков, '
+            f'{len(index.names)} сущностей')
+        return index
 
-            def flat_meta(name: str) -> str:
-                if name in metadata and metadata[name]:
-                    return ', '.join(metadata[name])
-                return ''
-
-            metadata = item.get('metadata', {})
-            metadata['characters'] = flat_meta('characters')
-            pl = metadata.get('locations', [''])
-            metadata['primary_location'] = pl[0] if pl else ''
-            metadata['locations'] = flat_meta('locations')
-            if not metadata['prev_id']:
-                metadata['prev_id'] = ''
-            if not metadata['next_id']:
-                metadata['next_id'] = ''
-            metadatas.append(metadata)
+    def entity_index(
+            self, collection_name: str = 'war_and_peace') -> EntityIndex:
+        """
+        Индекс сущностей текущей версии коллекции: из памяти, с диска или,
+        если его нет либо он устарел, построенный заново.
+        """
+        version = self.collection_version(collection_name)
+        physical_name = self._resolve(collection_name)
+        index = self._indexes.get(physical_name)
+        if index is not None and index.version == version:
+            return index
+        with self._index_lock:
+            index = self._indexes.get(physical_name)
+            if index is None or index.version != version:
+                index = EntityIndex.load(self._index_prefix(physical_name))
+            if (index is None or index.version != version or
+                    index.quantization != EMBEDDING_QUANTIZATION):
+                index = self.build_entity_index(collection_name)
+            self._indexes[physical_name] = index
+        return index
 
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas
-        )
+    def _lexical_path(self, physical_name: str) -> str:
+        return os.path.join(
+            self.persist_directory, LEXICAL_INDEX_DIR, physical_name + '.npz')
 
+    def build_lexical_index(
+        self, collection_name: str = 'war_and_peace',
+        entities: Optional[EntityIndex] = None
+    ) -> LexicalIndex:
+        """
+        Строит BM25-индекс по текстам чанков коллекции и сохраняет его
+        рядом с базой. Строки индекса идут в том же порядке, что и в
+        индексе сущностей (`entities`, по умолчанию текущий), так что
+        кандидаты из него применимы напрямую.
+        """
+        start = time.perf_counter()
+        if entities is None:
+            entities = self.entity_index(collection_name)
+        documents = {}
+        for page in self._iter_pages(collection_name, ['documents']):
+            documents.update(zip(page['ids'], page['documents']))
+        index = LexicalIndex.build(
+            entities.ids, [documents.get(doc_id) for doc_id in entities.ids],
+            entities.version)
+        index.save(self._lexical_path(self._resolve(collection_name)))
         print(
-            f'Из файла "{json_path}" загружено {len(ids)} документов в '
-            f'коллекцию "{collection_name}"')
+            f'BM25-индекс коллекции "{collection_name}" построен за '
+            f'{time.perf_counter() - start:.1f} с: {len(index)} чанков, '
+            f'{len(index.terms)} терминов')
+        return index
+
+    def lexical_index(
+            self, collection_name: str = 'war_and_peace') -> LexicalIndex:
+        """Как `entity_index`, но для BM25-индекса."""
+        entities = self.entity_index(collection_name)
+        physical_name = self._resolve(collection_name)
+        index = self._lexical.get(physical_name)
+        if index is not None and index.version == entities.version:
+            return index
+        with self._index_lock:
+            index = self._lexical.get(physical_name)
+            if index is None or index.version != entities.version:
+                index = LexicalIndex.load(self._lexical_path(physical_name))
+            if (index is None or index.version != entities.version or
+                    index.ids != entities.ids):
+                index = self.build_lexical_index(collection_name, entities)
+            self._lexical[physical_name] = index
+        return index
+
+    def lexical_search(
+        self, query: str, n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ):
+        """
+        Поиск по BM25 среди тех же кандидатов, что и в `search`.
+        Результат в формате `collection.query`, вместо расстояний — оценки.
+        """
+        rows = self.entity_index(collection_name).candidates(
+            list(characters), list(locations))
+        hits = self.lexical_index(collection_name).search(
+            query, n_results, rows)
+        return self._hits_to_results(hits, collection_name, 'scores')
+
+    def _hits_to_results(
+        self, hits: List[Tuple[str, float]], collection_name: str,
+        score_key: str = 'distances'
+    ) -> Dict[str, List[List[Any]]]:
+        if not hits:
+            return {'ids': [[]], 'documents': [[]], 'metadatas': [[]],
+                    score_key: [[]]}
+        version = self.collection_version(collection_name)
+        found = self._with_collection(
+            collection_name,
+            lambda collection: collection.get(
+                ids=[doc_id for doc_id, _ in hits],
+                include=['documents', 'metadatas']))
+        records = {
+            doc_id: (document, metadata)
+            for doc_id, document, metadata in zip(
+                found['ids'], found['documents'], found['metadatas'])
+        }
+        hits = [hit for hit in hits if hit[0] in records]
+        for doc_id, _ in hits:
+            self._documents.set((version, doc_id), records[doc_id][0])
+        return {
+            'ids': [[doc_id for doc_id, _ in hits]],
+            'documents': [[records[doc_id][0] for doc_id, _ in hits]],
+            'metadatas': [[records[doc_id][1] for doc_id, _ in hits]],
+            score_key: [[score for _, score in hits]],
+        }
+
+    def search(
+        self, query_embedding: List[float], n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ):
+        """
+        Поиск ближайших чанков среди тех, где упомянуты `characters`
+        и `locations` (см. `EntityIndex.candidates`). Кандидаты отбираются
+        до k-NN; если их не больше `EXACT_SEARCH_MAX_CANDIDATES`, поиск
+        выполняется точно по матрице индекса, иначе — в Chroma с
+        ограничением по ID. Результат в формате `collection.query`.
+        """
+        index = self.entity_index(collection_name)
+        rows = index.candidates(list(characters), list(locations))
+        if rows is None:
+            return self.query(
+                query_embedding, n_results, collection_name=collection_name)
+        if len(rows) > EXACT_SEARCH_MAX_CANDIDATES:
+            return self.query(
+                query_embedding, min(n_results, len(rows)),
+                collection_name=collection_name,
+                ids=[index.ids[row] for row in rows])
+
+        return self._hits_to_results(
+            index.search(query_embedding, rows, n_results), collection_name)
 
     def query(
         self, query_embedding: List[float], n_results: int = 5,
-        where: Dict = None, collection_name: str = 'war_and_peace'
+        where: Dict = None, collection_name: str = 'war_and_peace',
+        ids: Optional[List[str]] = None
     ):
-        self._create_or_get_collection(collection_name)
-        return self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            where=where
-        )
+        results = self._with_collection(
+            collection_name,
+            lambda collection: collection.query(
+                query_embeddings=[query_embedding],
+                ids=ids,
+                n_results=n_results,
+                where=where
+            ))
+        version = self.collection_version(collection_name)
+        for doc_id, document in zip(
+                results['ids'][0], results['documents'][0]):
+            self._documents.set((version, doc_id), document)
+        return results
 
     def get(self, id: str, collection_name: str = 'war_and_peace'):
-        self._create_or_get_collection(collection_name)
-        return self.collection.get(ids=[id])
+        return self._with_collection(
+            collection_name, lambda collection: collection.get(ids=[id]))
+
+    def get_documents(
+        self, ids: Iterable[str], collection_name: str = 'war_and_peace'
+    ) -> Dict[str, str]:
+        """
+        Тексты чанков по ID: недостающие в кэше запрашиваются одним
+        `collection.get`. Отсутствующие в коллекции ID в ответ не попадают.
+        """
+        version = self.collection_version(collection_name)
+        documents = {}
+        missing = []
+        for doc_id in dict.fromkeys(ids):
+            document = self._documents.get((version, doc_id))
+            if document is None:
+                missing.append(doc_id)
+            else:
+                documents[doc_id] = document
+        if missing:
+            result = self._with_collection(
+                collection_name,
+                lambda collection: collection.get(
+                    ids=missing, include=['documents']))
+            for doc_id, document in zip(result['ids'], result['documents']):
+                documents[doc_id] = document
+                self._documents.set((version, doc_id), document)
+        return documents
@@ -0,0 +1,252 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .quantization import (
+    EMBEDDING_QUANTIZATION, EMBEDDING_RESCORE_FACTOR, RESCORE_DTYPES,
+    QuantizedMatrix)
+
+ENTITY_FIELDS = ('characters', 'locations')
+
+
+def _split(value: Any) -> List[str]:
+    if isinstance(value, list):
+        return [v for v in value if v]
+    return [v for v in (value or '').split(', ') if v]
+
+
+class EntityIndex:
+    """
+    Инвертированный индекс «сущность → чанки» коллекции. Для каждого
+    персонажа и локации хранится битовая маска строк (`np.packbits`:
+    бит на чанк), так что отбор кандидатов — это побитовые OR/AND масок.
+    Вместе с индексом хранится нормированная матрица эмбеддингов
+    (отображается в память) для поиска среди кандидатов: float32, а при
+    квантовании — float16 (`RESCORE_DTYPES`). При `int8` перебор идёт
+    по сжатой копии в памяти, а из матрицы float16 читаются только
+    строки лучших кандидатов для пересчёта расстояний; при `float16`
+    матрица хранится один раз и перебор идёт по ней самой, загруженной
+    в память.
+    """
+    def __init__(
+        self,
+        ids: Sequence[str],
+        names: Sequence[str],
+        bitmaps: np.ndarray,
+        vectors: np.ndarray,
+        version: str,
+        quantized: Optional[QuantizedMatrix] = None,
+    ):
+        self.ids = list(ids)
+        self.names = {name: i for i, name in enumerate(names)}
+        self.bitmaps = bitmaps
+        self.vectors = vectors
+        self.version = version
+        self.quantized = quantized
+
+    @property
+    def quantization(self) -> str:
+        return self.quantized.kind if self.quantized else 'float32'
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        ids: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+        embeddings: np.ndarray,
+        version: str,
+        quantization: str = EMBEDDING_QUANTIZATION,
+    ) -> 'EntityIndex':
+        rows: Dict[str, List[int]] = {}
+        for row, metadata in enumerate(metadatas):
+            for field in ENTITY_FIELDS:
+                for value in _split((metadata or {}).get(field)):
+                    rows.setdefault(f'{field}:{value}', []).append(row)
+
+        names = sorted(rows)
+        bits = np.zeros((len(names), len(ids)), dtype=bool)
+        for i, name in enumerate(names):
+            bits[i, rows[name]] = True
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(
+            len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        quantized = (
+            QuantizedMatrix.quantize(vectors, quantization)
+            if quantization != 'float32' else None)
+        if quantization == 'float16':
+            vectors = quantized.data
+        else:
+            vectors = vectors.astype(
+                RESCORE_DTYPES[quantization], copy=False)
+        return cls(
+            ids, names, np.packbits(bits, axis=1), vectors, version,
+            quantized)
+
+    @staticmethod
+    def files(prefix: str) -> Tuple[str, str]:
+        return prefix + '.npz', prefix + '.npy'
+
+    def save(self, prefix: str) -> None:
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        index_path, vectors_path = EntityIndex.files(prefix)
+        names = sorted(self.names, key=self.names.get)
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, self.vectors)
+        with open(index_path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                names=np.array(names, dtype=str),
+                bitmaps=self.bitmaps,
+                version=np.array(self.version),
+                quantization=np.array(self.quantization),
+            )
+        if self.quantized is None or self.quantized.data is self.vectors:
+            QuantizedMatrix.remove(prefix)
+        else:
+            self.quantized.save(prefix)
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    @classmethod
+    def load(cls, prefix: str) -> Optional['EntityIndex']:
+        index_path, vectors_path = EntityIndex.files(prefix)
+        try:
+            with np.load(index_path, allow_pickle=False) as data:
+                ids = data['ids'].tolist()
+                names = data['names'].tolist()
+                bitmaps = data['bitmaps']
+                version = str(data['version'])
+                quantization = str(data['quantization'])
+            if quantization == 'float16':
+                # Перебор идёт по самой матрице, поэтому она в памяти.
+                vectors = np.load(vectors_path)
+                quantized = QuantizedMatrix(vectors)
+            else:
+                vectors = np.load(vectors_path, mmap_mode='r')
+                quantized = (
+                    QuantizedMatrix.load(prefix)
+                    if quantization != 'float32' else None)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        # Индекс прежнего формата (с матрицей float32 при квантовании)
+        # считается устаревшим и строится заново.
+        if vectors.dtype != RESCORE_DTYPES.get(quantization):
+            return None
+        if vectors.shape[0] != len(ids) or (
+                quantized is not None and quantized.data.shape[0] != len(ids)):
+            return None
+        return cls(ids, names, bitmaps, vectors, version, quantized)
+
+    @staticmethod
+    def remove(prefix: str) -> None:
+        for path in EntityIndex.files(prefix):
+            if os.path.exists(path):
+                os.remove(path)
+        QuantizedMatrix.remove(prefix)
+
+    def _mask(self, field: str, values: Sequence[str]) -> Optional[np.ndarray]:
+        if not values:
+            return None
+        mask = np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        for value in values:
+            row = self.names.get(f'{field}:{value}')
+            if row is not None:
+                mask |= self.bitmaps[row]
+        return mask
+
+    def _rows(self, mask: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(mask, count=len(self.ids)))
+
+    def candidates(
+        self,
+        characters: Sequence[str] = (),
+        locations: Sequence[str] = (),
+    ) -> Optional[np.ndarray]:
+        """
+        Строки чанков, где упомянут хотя бы один из персонажей и хотя бы
+        одна из локаций. Если таких нет, условие ослабляется до одних
+        персонажей, затем до одних локаций. `None` — ограничений нет.
+        """
+        masks = [
+            mask for mask in (
+                self._mask('characters', characters),
+                self._mask('locations', locations))
+            if mask is not None
+        ]
+        if len(masks) > 1:
+            masks.insert(0, np.bitwise_and(*masks))
+        for mask in masks:
+            if mask.any():
+                return self._rows(mask)
+        return None
+
+    def nearest(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        rows: Optional[np.ndarray] = None,
+        rescore_factor: int = EMBEDDING_RESCORE_FACTOR,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Для каждого запроса — до `n_results` пар (строка, косинусное
+        расстояние) среди строк `rows` (всех, если `None`), по возрастанию
+        расстояния. При квантовании по сжатой матрице отбирается
+        `n_results * rescore_factor` кандидатов, расстояния до которых
+        пересчитываются в полной точности.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.vectors.shape[1]:
+            raise ValueError(
+                f'Размерность запроса {queries.shape[-1]} не совпадает '
+                f'с размерностью коллекции {self.vectors.shape[1]}')
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        total = len(self.ids) if rows is None else len(rows)
+        k = min(n_results, total)
+        if k == 0:
+            return [[] for _ in queries]
+        # При float16 перебор идёт по той же матрице, что и пересчёт.
+        rescore = (
+            self.quantized is not None and
+            self.quantized.data is not self.vectors)
+        if self.quantized is None:
+            vectors = self.vectors if rows is None else self.vectors[rows]
+            similarity = np.asarray(vectors) @ queries.T
+            depth = k
+        else:
+            similarity = self.quantized.dot(queries, rows)
+            depth = min(total, k * max(1, rescore_factor)) if rescore else k
+        top = np.argpartition(-similarity, depth - 1, axis=0)[:depth]
+
+        results = []
+        for column, query in enumerate(queries):
+            local = top[:, column]
+            found = local if rows is None else rows[local]
+            if not rescore:
+                exact = similarity[local, column]
+            else:
+                exact = np.asarray(self.vectors[found]) @ query
+            order = np.argsort(-exact)[:k]
+            results.append([
+                (int(found[i]), float(1 - exact[i])) for i in order])
+        return results
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        rows: np.ndarray,
+        n_results: int,
+    ) -> List[Tuple[str, float]]:
+        """Поиск по косинусному расстоянию среди строк `rows`."""
+        return [
+            (self.ids[row], distance)
+            for row, distance in self.nearest(
+                [query_embedding], n_results, rows)[0]
+        ]
@@ -0,0 +1,158 @@
+from collections import Counter
+from functools import lru_cache
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import snowballstemmer
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+WORD_PATTERN = re.compile(r'\w+')
+CYRILLIC_PATTERN = re.compile(r'[а-я]')
+
+_russian = snowballstemmer.stemmer('russian')
+_french = snowballstemmer.stemmer('french')
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    # Латиница в романе — в основном французские реплики; диакритика
+    # снимается, чтобы «Gênes» и «Genes» совпадали.
+    if CYRILLIC_PATTERN.search(word):
+        return _russian.stemWord(word)
+    word = ''.join(
+        c for c in unicodedata.normalize('NFKD', word)
+        if not unicodedata.combining(c))
+    return _french.stemWord(word)
+
+
+def analyze(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, ё → е, после стемминга."""
+    return [
+        stem(word)
+        for word in WORD_PATTERN.findall(text.lower().replace('ё', 'е'))
+        if not word.isdigit()
+    ]
+
+
+class LexicalIndex:
+    """
+    BM25 по текстам чанков. Списки вхождений хранятся подряд в одном
+    массиве (`offsets[i]:offsets[i + 1]` — строки и веса термина `i`),
+    веса BM25 посчитаны заранее, так что запрос — это сложение весов
+    нескольких срезов.
+    """
+    def __init__(
+        self,
+        ids: Sequence[str],
+        terms: Sequence[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        weights: np.ndarray,
+        version: str,
+    ):
+        self.ids = list(ids)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        ids: Sequence[str],
+        documents: Sequence[Optional[str]],
+        version: str,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> 'LexicalIndex':
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(ids), dtype=np.float32)
+        for row, document in enumerate(documents):
+            tokens = analyze(document or '')
+            lengths[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((row, tf))
+
+        avg_length = float(lengths.mean()) if len(ids) else 0.0
+        norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows, weights = [], []
+        for i, term in enumerate(terms):
+            term_rows = np.array([row for row, _ in postings[term]])
+            tf = np.array([tf for _, tf in postings[term]], dtype=np.float32)
+            df = len(term_rows)
+            idf = np.log(1 + (len(ids) - df + 0.5) / (df + 0.5))
+            rows.append(term_rows)
+            weights.append(idf * tf * (k1 + 1) / (tf + norm[term_rows]))
+            offsets[i + 1] = offsets[i] + df
+        return cls(
+            ids, terms, offsets,
+            np.concatenate(rows).astype(np.int32) if rows
+            else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights).astype(np.float32) if weights
+            else np.zeros(0, dtype=np.float32),
+            version)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                terms=np.array(terms, dtype=str),
+                offsets=self.offsets,
+                rows=self.rows,
+                weights=self.weights,
+                version=np.array(self.version),
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['LexicalIndex']:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls(
+                    data['ids'].tolist(), data['terms'].tolist(),
+                    data['offsets'], data['rows'], data['weights'],
+                    str(data['version']))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def search(
+        self,
+        query: str,
+        n_results: int = 5,
+        rows: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Лучшие по BM25 чанки для `query`. Если задан `rows`, в выдачу
+        попадают только эти строки (кандидаты из индекса сущностей).
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(analyze(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            scores[self.rows[start:end]] += self.weights[start:end]
+        if rows is not None:
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[rows] = True
+            scores[~allowed] = 0
+        matched = np.flatnonzero(scores)
+        k = min(n_results, len(matched))
+        if k == 0:
+            return []
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[row], float(scores[row])) for row in top]
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import (
+    Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union)
+
+import numpy as np
+
+from .entity_index import EntityIndex
+from .lexical_index import LexicalIndex
+from .parts import collect_ids, iter_records
+from .vector_store import QueryResult, VectorStore
+
+NUMPY_STORE_DIR = os.getenv('NUMPY_STORE_DIR', './numpy_store')
+
+
+class StoreData(NamedTuple):
+    entities: EntityIndex
+    lexical: LexicalIndex
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    rows: Dict[str, int]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Хранилище без ChromaDB: все эмбеддинги коллекции — одна нормированная
+    матрица float32, отображаемая в память, тексты и метаданные — в
+    памяти процесса. Поиск — одно матричное умножение на пачку запросов
+    (по сжатой копии матрицы, если задано `EMBEDDING_QUANTIZATION`);
+    фильтры по персонажам и локациям — битовые маски `EntityIndex`.
+    Файлы коллекции лежат в `<directory>/<collection>/` и перечитываются,
+    когда `build` в другом процессе их обновит.
+    """
+    def __init__(self, directory: str = NUMPY_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, Tuple[Tuple[int, int], StoreData]] = {}
+
+    def _path(self, collection_name: str, name: str) -> str:
+        return os.path.join(self.directory, collection_name, name)
+
+    def build(
+        self, paths: Iterable[Union[str, Path]],
+        collection_name: str = 'war_and_peace'
+    ) -> int:
+        """
+        Собирает коллекцию из частей (`part_N.json` или `part_N`),
+        полностью заменяя предыдущую. Возвращает число чанков.
+        """
+        start = time.perf_counter()
+        paths = list(paths)
+        known_ids = collect_ids(paths)
+        records: Dict[str, Tuple[str, Any, Dict[str, Any]]] = {}
+        for path in paths:
+            for doc_id, document, embedding, metadata in (
+                    iter_records(path, known_ids)):
+                records[doc_id] = (document, embedding, metadata)
+
+        ids = list(records)
+        digest = hashlib.sha256()
+        for doc_id in ids:
+            digest.update(doc_id.encode('utf-8'))
+            digest.update(records[doc_id][2]['content_hash'].encode('utf-8'))
+        version = digest.hexdigest()[:16]
+        documents = [records[doc_id][0] for doc_id in ids]
+        embeddings = np.asarray(
+            [records[doc_id][1] for doc_id in ids], dtype=np.float32)
+        entities = EntityIndex.build(
+            ids, [records[doc_id][2] for doc_id in ids], embeddings, version)
+        lexical = LexicalIndex.build(ids, documents, version)
+
+        os.makedirs(os.path.join(self.directory, collection_name),
+                    exist_ok=True)
+        documents_path = self._path(collection_name, 'documents.jsonl')
+        with open(documents_path + '.tmp', 'w', encoding='utf-8') as f:
+            for doc_id in ids:
+                document, _, metadata = records[doc_id]
+                f.write(json.dumps(
+                    {'id': doc_id, 'document': document,
+                     'metadata': metadata}, ensure_ascii=False) + '\n')
+        os.replace(documents_path + '.tmp', documents_path)
+        lexical.save(self._path(collection_name, 'lexical.npz'))
+        # Файл индекса сущностей пишется последним: по нему читатели
+        # узнают о новой версии.
+        entities.save(self._path(collection_name, 'entities'))
+        print(
+            f'Коллекция "{collection_name}" собрана в "{self.directory}" за '
+            f'{time.perf_counter() - start:.1f} с: {len(ids)} чанков')
+        return len(ids)
+
+    def _read(self, collection_name: str) -> Optional[StoreData]:
+        entities = EntityIndex.load(self._path(collection_name, 'entities'))
+        lexical = LexicalIndex.load(
+            self._path(collection_name, 'lexical.npz'))
+        if (entities is None or lexical is None or
+                lexical.version != entities.version):
+            return None
+        documents, metadatas = [], []
+        with open(self._path(collection_name, 'documents.jsonl'),
+                  'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                documents.append(record['document'])
+                metadatas.append(record['metadata'])
+        if len(documents) != len(entities):
+            return None
+        return StoreData(
+            entities, lexical, documents, metadatas,
+            {doc_id: row for row, doc_id in enumerate(entities.ids)})
+
+    def _load(self, collection_name: str) -> StoreData:
+        try:
+            stat = os.stat(self._path(collection_name, 'entities.npz'))
+        except FileNotFoundError:
+            raise ValueError(
+                f'Коллекция "{collection_name}" не найдена в '
+                f'"{self.directory}"') from None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._loaded.get(collection_name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with self._lock:
+            cached = self._loaded.get(collection_name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            data = self._read(collection_name)
+            if data is None:
+                if cached is not None:
+                    # Файлы переписываются — пока отвечаем старой версией.
+                    return cached[1]
+                raise ValueError(
+                    f'Файлы коллекции "{collection_name}" в '
+                    f'"{self.directory}" повреждены или не согласованы')
+            self._loaded[collection_name] = (key, data)
+        return data
+
+    def collection_version(self, name: str = 'war_and_peace') -> str:
+        return self._load(name).entities.version
+
+    def entity_index(
+            self, collection_name: str = 'war_and_peace') -> EntityIndex:
+        return self._load(collection_name).entities
+
+    def lexical_index(
+            self, collection_name: str = 'war_and_peace') -> LexicalIndex:
+        return self._load(collection_name).lexical
+
+    @staticmethod
+    def _result(
+        data: StoreData, rows: Sequence[int], scores: Sequence[float],
+        score_key: str = 'distances'
+    ) -> QueryResult:
+        return {
+            'ids': [[data.entities.ids[row] for row in rows]],
+            'documents': [[data.documents[row] for row in rows]],
+            'metadatas': [[data.metadatas[row] for row in rows]],
+            score_key: [[float(score) for score in scores]],
+        }
+
+    def search_batch(
+        self, query_embeddings: Sequence[List[float]], n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> List[QueryResult]:
+        data = self._load(collection_name)
+        index = data.entities
+        rows = index.candidates(list(characters), list(locations))
+        return [
+            self._result(
+                data, [row for row, _ in hits],
+                [distance for _, distance in hits])
+            for hits in index.nearest(query_embeddings, n_results, rows)
+        ]
+
+    def search(
+        self, query_embedding: List[float], n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> QueryResult:
+        return self.search_batch(
+            [query_embedding], n_results, characters, locations,
+            collection_name)[0]
+
+    def lexical_search(
+        self, query: str, n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> QueryResult:
+        data = self._load(collection_name)
+        rows = data.entities.candidates(list(characters), list(locations))
+        hits = data.lexical.search(query, n_results, rows)
+        return self._result(
+            data, [data.rows[doc_id] for doc_id, _ in hits],
+            [score for _, score in hits], 'scores')
+
+    def get_documents(
+        self, ids: Iterable[str], collection_name: str = 'war_and_peace'
+    ) -> Dict[str, str]:
+        data = self._load(collection_name)
+        return {
+            doc_id: data.documents[data.rows[doc_id]]
+            for doc_id in ids if doc_id in data.rows
+        }
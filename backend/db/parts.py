@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import (
+    Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union)
+
+import numpy as np
+
+from .quantization import EMBEDDING_QUANTIZATION, RESCORE_DTYPES
+
+# По умолчанию части хранятся в той же точности, что и матрица пересчёта
+# индекса: при квантовании — float16.
+EMBEDDING_DTYPE = os.getenv(
+    'EMBEDDING_DTYPE', RESCORE_DTYPES.get(EMBEDDING_QUANTIZATION, 'float32'))
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+PathLike = Union[str, Path]
+# (id, текст, эмбеддинг, плоские метаданные с `content_hash`).
+Record = Tuple[str, str, Any, Dict[str, str]]
+
+
+def part_files(prefix: PathLike) -> Tuple[str, str]:
+    prefix = str(prefix)
+    return prefix + '.jsonl', prefix + '.npy'
+
+
+class PartWriter:
+    """
+    Пишет часть базы знаний в бинарном формате:
+    `part_N.npy` — непрерывная матрица эмбеддингов (float32/float16),
+    `part_N.jsonl` — по строке с текстом и метаданными на чанк.
+
+    Каждый `append` сразу сбрасывает на диск строку матрицы и строку JSONL
+    во временные файлы; при `close` они атомарно переименовываются, так что
+    читатель никогда не видит недописанную часть.
+    """
+    def __init__(
+        self,
+        prefix: PathLike,
+        n_rows: int,
+        dim: int,
+        dtype: str = EMBEDDING_DTYPE,
+    ):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f'Неподдерживаемый тип эмбеддингов "{dtype}", '
+                f'ожидается один из {SUPPORTED_DTYPES}')
+        self.records_path, self.vectors_path = part_files(prefix)
+        self.n_rows = n_rows
+        self.dim = dim
+        self._row = 0
+        self._vectors = np.lib.format.open_memmap(
+            self.vectors_path + '.tmp', mode='w+',
+            dtype=dtype, shape=(n_rows, dim))
+        self._records = open(
+            self.records_path + '.tmp', 'w', encoding='utf-8')
+
+    def __enter__(self) -> 'PartWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(
+        self, record: Dict[str, Any], embedding: Optional[List[float]]
+    ) -> None:
+        if self._row >= self.n_rows:
+            raise ValueError(
+                f'Часть рассчитана на {self.n_rows} чанков')
+        if embedding is not None:
+            if len(embedding) != self.dim:
+                raise ValueError(
+                    f'Размерность эмбеддинга {len(embedding)} не совпадает '
+                    f'с размерностью части {self.dim}')
+            self._vectors[self._row] = embedding
+            self._vectors.flush()
+        record = {k: v for k, v in record.items() if k != 'embedding'}
+        record['row'] = self._row
+        self._records.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._records.flush()
+        os.fsync(self._records.fileno())
+        self._row += 1
+
+    def close(self) -> None:
+        if self._row != self.n_rows:
+            self.abort()
+            raise ValueError(
+                f'Записано {self._row} чанков из {self.n_rows}')
+        self._vectors.flush()
+        del self._vectors
+        self._records.close()
+        os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        os.replace(self.records_path + '.tmp', self.records_path)
+
+    def abort(self) -> None:
+        if hasattr(self, '_vectors'):
+            del self._vectors
+        self._records.close()
+        for path in (self.vectors_path, self.records_path):
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+
+
+def write_part(
+    prefix: PathLike,
+    records: List[Dict[str, Any]],
+    dtype: str = EMBEDDING_DTYPE,
+) -> None:
+    dim = len(records[0]['embedding']) if records else 0
+    with PartWriter(prefix, len(records), dim, dtype=dtype) as writer:
+        for record in records:
+            writer.append(record, record['embedding'])
+
+
+def read_part(prefix: PathLike) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    Возвращает записи части и матрицу её эмбеддингов, отображённую
+    в память (`mmap`), — векторы читаются с диска по мере обращения.
+    """
+    records_path, vectors_path = part_files(prefix)
+    with open(records_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    vectors = np.load(vectors_path, mmap_mode='r')
+    return records, vectors
+
+
+def part_dim(prefix: PathLike) -> int:
+    """Размерность эмбеддингов части (читается только заголовок `.npy`)."""
+    return np.load(part_files(prefix)[1], mmap_mode='r').shape[1]
+
+
+def iter_part(
+    prefix: PathLike
+) -> Iterator[Tuple[Dict[str, Any], np.ndarray]]:
+    records_path, vectors_path = part_files(prefix)
+    vectors = np.load(vectors_path, mmap_mode='r')
+    with open(records_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record, vectors[record['row']]
+
+
+def iter_json_part(
+    path: PathLike, block_size: int = 1 << 16
+) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково читает старый формат `part_N.json` (JSON-массив объектов),
+    не загружая весь файл в память.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'Ожидается JSON-массив: {path}')
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip()
+            if buffer.startswith(','):
+                buffer = buffer[1:].lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                block = f.read(block_size)
+                eof = not block
+                buffer += block
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def flat_metadata(metadata: Dict[str, Any]) -> Dict[str, str]:
+    """Метаданные чанка в виде строк, как их хранят векторные хранилища."""
+    def flat_meta(name: str) -> str:
+        if name in metadata and metadata[name]:
+            return ', '.join(metadata[name])
+        return ''
+
+    metadata = dict(metadata)
+    metadata['characters'] = flat_meta('characters')
+    pl = metadata.get('locations', [''])
+    metadata['primary_location'] = pl[0] if pl else ''
+    metadata['locations'] = flat_meta('locations')
+    if not metadata.get('prev_id'):
+        metadata['prev_id'] = ''
+    if not metadata.get('next_id'):
+        metadata['next_id'] = ''
+    return metadata
+
+
+def record_hash(
+        document: str, embedding: Any, metadata: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    digest.update(document.encode('utf-8'))
+    digest.update(json.dumps(
+        {k: v for k, v in metadata.items() if k != 'content_hash'},
+        ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    digest.update(np.asarray(embedding, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def iter_records(
+    path: PathLike, known_ids: Optional[Set[str]] = None
+) -> Iterator[Record]:
+    """
+    Записи части (`part_N.json` или префикс бинарной части `part_N`)
+    с плоскими метаданными и `content_hash`. Если передан `known_ids`,
+    ссылки `prev_id`/`next_id` на чанки вне этого множества (например,
+    на границе переразбитого раздела) обнуляются.
+    """
+    path = Path(path)
+    if path.suffix == '.json':
+        records = (
+            (item.get('id', f'chunk_{i}'), item, item.get('embedding'))
+            for i, item in enumerate(iter_json_part(path))
+        )
+    else:
+        records = (
+            (record['id'], record, vector)
+            for record, vector in iter_part(path)
+        )
+    for doc_id, record, embedding in records:
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        metadata = flat_metadata(record.get('metadata', {}))
+        if known_ids is not None:
+            for link in ('prev_id', 'next_id'):
+                if metadata[link] and metadata[link] not in known_ids:
+                    metadata[link] = ''
+        metadata['content_hash'] = record_hash(
+            record.get('text'), embedding, metadata)
+        yield doc_id, record.get('text'), embedding, metadata
+
+
+def collect_ids(paths: Iterable[PathLike]) -> Set[str]:
+    """ID всех чанков частей — `known_ids` для `iter_records`."""
+    return {
+        doc_id
+        for path in paths
+        for doc_id, _, _, _ in iter_records(path)
+    }
+
+
+def find_parts(directory: PathLike) -> List[Path]:
+    """Префиксы завершённых частей (`part_N`) в каталоге, по номеру части."""
+    directory = Path(directory)
+    prefixes = [
+        path.with_suffix('') for path in directory.glob('*.jsonl')
+        if path.with_suffix('.npy').is_file()
+    ]
+    return sorted(prefixes, key=_part_sort_key)
+
+
+def _part_sort_key(path: Path) -> Tuple[int, str]:
+    suffix = path.stem.rsplit('_', 1)[-1]
+    return (int(suffix) if suffix.isdigit() else -1, path.stem)
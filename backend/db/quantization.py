@@ -0,0 +1,88 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+EMBEDDING_QUANTIZATION = os.getenv('EMBEDDING_QUANTIZATION', 'float32')
+SUPPORTED_QUANTIZATIONS = ('float32', 'float16', 'int8')
+# В каком типе хранится полная матрица для пересчёта расстояний: при
+# квантовании точности float16 достаточно, а на диске она вдвое меньше.
+RESCORE_DTYPES = {
+    'float32': 'float32', 'float16': 'float16', 'int8': 'float16'}
+# Сколько кандидатов на один результат пересчитывается в полной точности.
+EMBEDDING_RESCORE_FACTOR = int(os.getenv('EMBEDDING_RESCORE_FACTOR', '4'))
+BLOCK_ROWS = 4096
+
+
+class QuantizedMatrix:
+    """
+    Матрица эмбеддингов в сжатом виде: `float16` или `int8` с масштабом
+    на строку (`x ≈ data * scale`, `scale = max|x| / 127`). Скалярные
+    произведения считаются блоками по `BLOCK_ROWS` строк, чтобы не
+    разворачивать всю матрицу в float32.
+    """
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.data = data
+        self.scales = scales
+
+    @property
+    def kind(self) -> str:
+        return str(self.data.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (
+            self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def quantize(cls, vectors: np.ndarray, kind: str) -> 'QuantizedMatrix':
+        if kind == 'float16':
+            return cls(vectors.astype(np.float16))
+        if kind != 'int8':
+            raise ValueError(
+                f'Неподдерживаемое квантование "{kind}", '
+                f'ожидается одно из {SUPPORTED_QUANTIZATIONS}')
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        data = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return cls(data, scales.astype(np.float32))
+
+    def dot(
+        self, queries: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Матрица `(строки, запросы)` приближённых скалярных произведений."""
+        data = self.data if rows is None else self.data[rows]
+        scores = np.empty((len(data), len(queries)), dtype=np.float32)
+        for start in range(0, len(data), BLOCK_ROWS):
+            block = data[start:start + BLOCK_ROWS].astype(np.float32)
+            scores[start:start + BLOCK_ROWS] = block @ queries.T
+        if self.scales is not None:
+            scales = self.scales if rows is None else self.scales[rows]
+            scores *= scales[:, None]
+        return scores
+
+    def save(self, prefix: str) -> None:
+        for suffix, array in (('.q.npy', self.data),
+                              ('.scale.npy', self.scales)):
+            if array is None:
+                continue
+            with open(prefix + suffix + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(prefix + suffix + '.tmp', prefix + suffix)
+        if self.scales is None and os.path.exists(prefix + '.scale.npy'):
+            os.remove(prefix + '.scale.npy')
+
+    @classmethod
+    def load(cls, prefix: str) -> 'QuantizedMatrix':
+        # Сжатая матрица читается в память целиком: по ней идёт перебор.
+        data = np.load(prefix + '.q.npy')
+        scales = (
+            np.load(prefix + '.scale.npy') if data.dtype == np.int8
+            else None)
+        return cls(data, scales)
+
+    @staticmethod
+    def remove(prefix: str) -> None:
+        for suffix in ('.q.npy', '.scale.npy'):
+            if os.path.exists(prefix + suffix):
+                os.remove(prefix + suffix)
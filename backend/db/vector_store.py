@@ -0,0 +1,71 @@
+from abc import ABC, abstractmethod
+import os
+from typing import Any, Dict, Iterable, List, Sequence
+
+from .entity_index import EntityIndex
+from .lexical_index import LexicalIndex
+
+# chroma — ChromaManager; numpy — NumpyVectorStore (точный поиск по
+# матрице эмбеддингов в памяти).
+VECTOR_STORE = os.getenv('VECTOR_STORE', 'chroma')
+
+QueryResult = Dict[str, List[List[Any]]]
+
+
+class VectorStore(ABC):
+    """
+    Хранилище чанков, которым пользуется поиск контекста. Результаты
+    поиска возвращаются в формате `collection.query` ChromaDB: словарь
+    списков `ids`, `documents`, `metadatas`, `distances` (по одному
+    списку на запрос).
+    """
+    @abstractmethod
+    def collection_version(self, name: str = 'war_and_peace') -> str:
+        """Меняется при любом изменении содержимого коллекции."""
+
+    @abstractmethod
+    def entity_index(
+            self, collection_name: str = 'war_and_peace') -> EntityIndex:
+        ...
+
+    @abstractmethod
+    def lexical_index(
+            self, collection_name: str = 'war_and_peace') -> LexicalIndex:
+        ...
+
+    @abstractmethod
+    def search(
+        self, query_embedding: List[float], n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> QueryResult:
+        """
+        Ближайшие чанки среди тех, где упомянуты `characters`
+        и `locations` (см. `EntityIndex.candidates`).
+        """
+
+    def search_batch(
+        self, query_embeddings: Sequence[List[float]], n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> List[QueryResult]:
+        characters, locations = list(characters), list(locations)
+        return [
+            self.search(
+                embedding, n_results, characters, locations, collection_name)
+            for embedding in query_embeddings
+        ]
+
+    @abstractmethod
+    def lexical_search(
+        self, query: str, n_results: int = 5,
+        characters: Iterable[str] = (), locations: Iterable[str] = (),
+        collection_name: str = 'war_and_peace'
+    ) -> QueryResult:
+        """Как `search`, но по BM25; вместо `distances` — `scores`."""
+
+    @abstractmethod
+    def get_documents(
+        self, ids: Iterable[str], collection_name: str = 'war_and_peace'
+    ) -> Dict[str, str]:
+        """Тексты чанков по ID; отсутствующие ID в ответ не попадают."""
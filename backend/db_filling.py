@@ -1,28 +1,37 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import httpx
-import json
+from itertools import groupby
+from operator import attrgetter
 import os
 from pathlib import Path
 import sys
-from typing import List, Dict, Any
+from typing import Deque, Dict, List, Tuple
 from tqdm import tqdm
-import uuid
 
 from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
 from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from api.literary_entity_extractor import LiteraryEntityExtractor
-from db import ChromaManager
-from utils import EpubParser
+from db import (
+    VECTOR_STORE, ChromaManager, NumpyVectorStore, PartWriter, find_parts,
+    part_dim)
+from db.numpy_store import NUMPY_STORE_DIR
+from utils import BatchEmbedder, EpubParser, Preprocessor
+from utils.checkpoint import CheckpointManifest, content_hash, make_chunk_id
+from utils.preprocess import PREPROCESS_WORKERS
 
 CHUNK_SIZE = 4096
 CHUNK_OVERLAP = 256
-EMBEDDING_SIZE = 4096
 
 load_dotenv()
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
 OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
 OLLAMA_BASE_URL = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
+INGEST_WORKERS = int(
+    os.getenv('INGEST_WORKERS', os.getenv('OLLAMA_NUM_PARALLEL', '1')))
+INDEX_MODE = os.getenv('INDEX_MODE', 'incremental')
 
 
 def preload_ollama_models():
@@ -55,88 +64,229 @@ def preload_ollama_models():
     return llm, embedder
 
 
+def _process_chunk(
+        graph, embedder: BatchEmbedder, checkpoint: CheckpointManifest,
+        chunk_id: str, chunk_text: str,
+        llm_model: str, embedding_model: str) -> Tuple[Dict, Future]:
+    extract_stage = checkpoint.stage('extract')
+    extract_key = content_hash(chunk_text, llm_model, graph.mode)
+    extraction = extract_stage.get(extract_key)
+    if extraction is None:
+        try:
+            state = graph.invoke(chunk_text)
+            if state.get('errors'):
+                # Узлы перехватывают ошибки LLM: такой результат неполон
+                # и не сохраняется, чтобы при возобновлении чанк
+                # обработался заново.
+                raise RuntimeError('; '.join(state['errors']))
+            extraction = {
+                'characters': state.get('characters', []),
+                'locations': state.get('locations', []),
+                'summary': state.get('summary', '').strip(),
+            }
+            extract_stage.put(extract_key, extraction)
+        except Exception as e:
+            print(f'Ошибка при обработке чанка {chunk_id}: {e}')
+            extraction = {'characters': [], 'locations': [], 'summary': ''}
+
+    record = {
+        'id': chunk_id,
+        'text': chunk_text,
+        'metadata': {
+            'characters': extraction['characters'],
+            'locations': extraction['locations'],
+        }
+    }
+
+    embed_stage = checkpoint.stage('embed')
+    embed_text = extraction['summary'] or chunk_text
+    embed_key = content_hash(embed_text, embedding_model)
+    embedding = embed_stage.get(embed_key)
+    if embedding is not None:
+        future = Future()
+        future.set_result(embedding)
+        return record, future
+
+    def save_embedding(done: Future):
+        if done.exception() is None:
+            embed_stage.put(embed_key, done.result())
+
+    future = embedder.submit(embed_text)
+    future.add_done_callback(save_embedding)
+    return record, future
+
+
+def probe_embedding_dim(embedder: Embeddings, json_path: str) -> int:
+    """
+    Размерность эмбеддингов модели по одному пробному запросу. С ней
+    сверяются уже записанные части и все эмбеддинги чанков.
+    """
+    model = getattr(embedder, 'model', '')
+    dim = len(embedder.embed_query('Война и мир'))
+    if not dim:
+        raise ValueError(f'Модель "{model}" вернула пустой эмбеддинг')
+    for prefix in find_parts(json_path):
+        if part_dim(prefix) != dim:
+            raise ValueError(
+                f'Часть "{prefix}" записана с размерностью эмбеддингов '
+                f'{part_dim(prefix)}, а модель "{model}" возвращает {dim}')
+    print(f'Размерность эмбеддингов: {dim}')
+    return dim
+
+
 def create_json(
         llm, embedder,
         file_path: str,
-        start_from: int = 0) -> str:
+        start_from: int = 0,
+        workers: int = INGEST_WORKERS,
+        preprocess_workers: int = PREPROCESS_WORKERS) -> str:
+    """
+    Разбор EPUB и разбиение разделов на чанки выполняются в пуле из
+    `preprocess_workers` процессов (`Preprocessor`), который отдаёт
+    упорядоченный поток `(section_idx, chunk_idx, text)`.
+
+    Чанки всех разделов обрабатываются пулом из `workers` потоков, так что
+    в Ollama одновременно находится до `workers` запросов. Эмбеддинги
+    запрашиваются пачками через `BatchEmbedder`. Результаты
+    собираются в порядке отправки, поэтому части `part_N` и связи
+    `prev_id`/`next_id` не зависят от порядка завершения запросов.
+
+    Каждый раздел сохраняется как `part_N.jsonl` (текст и метаданные)
+    и `part_N.npy` (матрица эмбеддингов), чанки дописываются по одному.
+
+    Разобранная книга и результаты стадий split, extract и embed
+    сохраняются в `JSON/.checkpoint`, поэтому повторный запуск после
+    падения пропускает уже обработанные чанки.
+    """
+    json_path = os.path.join(os.path.dirname(file_path), 'JSON')
+    os.makedirs(json_path, exist_ok=True)
+    checkpoint = CheckpointManifest(os.path.join(json_path, '.checkpoint'))
     try:
-        book = EpubParser(file_path)
+        parser = EpubParser(
+            file_path, cache_dir=os.path.join(checkpoint.directory, 'epub'))
     except Exception as e:
         print('Невозможно создать экземпляр "EpubParser":', e)
-    json_path = os.path.join(os.path.dirname(file_path), 'JSON')
-    os.makedirs(json_path, exist_ok=True)
+        raise
     graph = LiteraryEntityExtractor(llm)
+    llm_model = getattr(llm, 'model', '')
+    embedding_model = getattr(embedder, 'model', '')
+    dim = probe_embedding_dim(embedder, json_path)
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=['\n\n', '\n', '. ', ' ', '']
-    )
+    preprocessor = Preprocessor(
+        CHUNK_SIZE, CHUNK_OVERLAP, workers=preprocess_workers)
+    try:
+        content = list(preprocessor.parse(parser))
+    except Exception:
+        preprocessor.close()
+        raise
+    work_items = preprocessor.iter_work_items(
+        content, checkpoint.stage('split'), start_from)
+    batch_embedder = BatchEmbedder(embedder)
+    workers = max(1, workers)
+    print(
+        f'Разделов: {len(content)}, процессов предобработки: '
+        f'{preprocessor.workers}, параллельных запросов: {workers}')
 
-    all_chunks: List[Dict[str, Any]] = []
-
-    for block_idx, block_lines in enumerate(book.content):
-        if block_idx + 1 < start_from:
-            continue
-
-        print(f'===== Раздел {block_idx+1} из {len(book.content)} =====')
-        full_block_text = '\n'.join(block_lines).strip()
-        if not full_block_text:
-            continue
-
-        chunks = text_splitter.split_text(full_block_text)
-
-        if not chunks:
-            continue
-
-        chunk_ids = [str(uuid.uuid4()) for _ in chunks]
-
-        for i, chunk_text in enumerate(
-            tqdm(chunks, desc='Обработка раздела')
-        ):
-            chunk_id = chunk_ids[i]
-            prev_id = chunk_ids[i - 1] if i > 0 else None
-            next_id = chunk_ids[i + 1] if i < len(chunks) - 1 else None
-
-            try:
-                extraction = graph.invoke(chunk_text)
-                characters = extraction.get('characters', [])
-                locations = extraction.get('locations', [])
-                summary = extraction.get('summary', '').strip()
-            except Exception as e:
-                print(f'Ошибка при обработке чанка {chunk_id}: {e}')
-
-            try:
-                if not summary:
-                    embedding = embedder.embed_query(chunk_text)
-                else:
-                    embedding = embedder.embed_query(summary)
-            except Exception as e:
-                print(f'Ошибка при генерации эмбеддинга для {chunk_id}: {e}')
-                embedding = [0.0] * EMBEDDING_SIZE
-
-            record = {
-                'id': chunk_id,
-                'text': chunk_text,
-                'embedding': embedding,
-                'metadata': {
-                    'characters': characters,
-                    'locations': locations,
-                    'prev_id': prev_id,
-                    'next_id': next_id,
-                }
-            }
-            all_chunks.append(record)
+    writers: Dict[int, PartWriter] = {}
+    pending: Deque[Tuple[int, List[str], int, Future]] = deque()
+    window = max(workers * 2, batch_embedder.batch_size)
+
+    def collect(progress: tqdm):
+        block_idx, chunk_ids, i, future = pending.popleft()
+        record, embedding_future = future.result()
+        try:
+            embedding = embedding_future.result()
+        except Exception as e:
+            print(f'Ошибка при генерации эмбеддинга для {record["id"]}: {e}')
+            embedding = None
+        if embedding is not None and len(embedding) != dim:
+            print(
+                f'Размерность эмбеддинга {record["id"]} ({len(embedding)}) '
+                f'не совпадает с размерностью модели ({dim})')
+            embedding = None
+        record['metadata']['prev_id'] = chunk_ids[i - 1] if i > 0 else None
+        record['metadata']['next_id'] = (
+            chunk_ids[i + 1] if i < len(chunk_ids) - 1 else None)
 
-        output_path = os.path.join(json_path, f'part_{block_idx + 1}.json')
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(all_chunks, f, ensure_ascii=False, indent=2)
-        all_chunks.clear()
+        if block_idx not in writers:
+            writers[block_idx] = PartWriter(
+                os.path.join(json_path, f'part_{block_idx + 1}'),
+                n_rows=len(chunk_ids),
+                dim=dim)
+        writers[block_idx].append(record, embedding)
+        progress.update()
+        if i == len(chunk_ids) - 1:
+            writers.pop(block_idx).close()
+            print(f'===== Раздел {block_idx + 1} из {len(content)} =====')
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with tqdm(total=0, desc='Обработка чанков') as progress:
+            for block_idx, items in groupby(
+                    work_items, key=attrgetter('section_idx')):
+                chunks = [item.text for item in items]
+                progress.total += len(chunks)
+                progress.refresh()
+                chunk_ids = [
+                    make_chunk_id(chunk_text, block_idx, i)
+                    for i, chunk_text in enumerate(chunks)
+                ]
+                for i, chunk_text in enumerate(chunks):
+                    future = executor.submit(
+                        _process_chunk, graph, batch_embedder, checkpoint,
+                        chunk_ids[i], chunk_text, llm_model, embedding_model)
+                    pending.append((block_idx, chunk_ids, i, future))
+                    if len(pending) >= window:
+                        collect(progress)
+            while pending:
+                collect(progress)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        preprocessor.close()
+        batch_embedder.close()
+        for writer in writers.values():
+            writer.abort()
 
     return json_path
 
 
+def find_part_paths(json_path: Path) -> List[Path]:
+    """
+    Бинарные части `part_N` и старые `part_N.json`, для которых бинарной
+    версии нет.
+    """
+    paths = find_parts(json_path)
+    binary_names = {prefix.name for prefix in paths}
+    for json_file in sorted(json_path.glob('*.json')):
+        if json_file.stem not in binary_names:
+            paths.append(json_file)
+    return paths
+
+
+def load_to_chroma(
+        json_path: Path,
+        persist_directory: str = './chroma_db',
+        mode: str = INDEX_MODE):
+    """
+    `incremental` — обновляет только новые и изменённые чанки и удаляет
+    исчезнувшие; прерванная загрузка при повторном запуске продолжается
+    с незагруженных чанков.
+    `rebuild` — собирает индекс заново в теневой коллекции и атомарно
+    переключается на неё, не прерывая обслуживание запросов.
+    """
+    manager = ChromaManager(persist_directory=persist_directory)
+    paths = find_part_paths(json_path)
+    if mode == 'rebuild':
+        manager.rebuild(paths)
+    elif mode == 'incremental':
+        manager.sync_parts(paths)
+    else:
+        raise ValueError(
+            f'Неизвестный режим индексации "{mode}", '
+            'ожидается "incremental" или "rebuild"')
+    manager.lexical_index()
+
+
 def main(file_path: str | None = None, start_from: int = 0):
     llm, embedder = preload_ollama_models()
     if file_path:
@@ -150,10 +300,11 @@ def main(file_path: str | None = None, start_from: int = 0):
         json_path = Path(
             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'JSON'))
 
-    manager = ChromaManager(persist_directory='./chroma_db')
-    manager.delete_collection()
-    for json_file in json_path.glob('*.json'):
-        manager.load_from_json(json_file)
+    # Хранилищу на numpy ChromaDB не нужна: индексы строятся по частям.
+    if VECTOR_STORE == 'numpy':
+        NumpyVectorStore(NUMPY_STORE_DIR).build(find_part_paths(json_path))
+    else:
+        load_to_chroma(json_path)
 
 
 if __name__ == '__main__':
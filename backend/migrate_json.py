@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+from db.parts import EMBEDDING_DTYPE, SUPPORTED_DTYPES, part_files, write_part
+
+
+def migrate_json(
+        json_path: Path,
+        dtype: str = EMBEDDING_DTYPE,
+        remove: bool = False) -> None:
+    """
+    Переводит части `part_N.json` в формат `part_N.jsonl` + `part_N.npy`.
+    Уже сконвертированные части пропускаются.
+    """
+    for json_file in sorted(json_path.glob('*.json')):
+        prefix = json_file.with_suffix('')
+        records_path, vectors_path = part_files(prefix)
+        if os.path.isfile(records_path) and os.path.isfile(vectors_path):
+            print(f'Часть "{prefix}" уже сконвертирована, пропускаем')
+        else:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            for record in records:
+                if isinstance(record.get('embedding'), str):
+                    record['embedding'] = json.loads(record['embedding'])
+            write_part(prefix, records, dtype=dtype)
+            before = os.path.getsize(json_file)
+            after = (
+                os.path.getsize(records_path) + os.path.getsize(vectors_path))
+            print(
+                f'{json_file.name}: {len(records)} чанков, '
+                f'{before / 2**20:.1f} МБ -> {after / 2**20:.1f} МБ')
+        if remove:
+            os.remove(json_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Конвертация part_N.json в part_N.jsonl + part_N.npy')
+    parser.add_argument(
+        'json_path', nargs='?',
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'JSON'),
+        help='Каталог с файлами part_N.json')
+    parser.add_argument(
+        '--dtype', choices=SUPPORTED_DTYPES, default=EMBEDDING_DTYPE,
+        help='Тип хранения эмбеддингов')
+    parser.add_argument(
+        '--remove', action='store_true',
+        help='Удалить исходные JSON-файлы после конвертации')
+    args = parser.parse_args()
+
+    migrate_json(Path(args.json_path), dtype=args.dtype, remove=args.remove)
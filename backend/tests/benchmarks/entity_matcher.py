@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from dotenv import load_dotenv
+from langchain_ollama import ChatOllama
+
+from api.literary_entity_extractor import (
+    EntityGazetteer, LiteraryEntityExtractor)
+
+load_dotenv()
+OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
+OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
+OLLAMA_BASE_URL = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
+DATASET_PATH = Path(__file__).resolve().parents[1] / 'ragas' / 'dataset.json'
+KEYS = ('characters', 'locations')
+
+
+def load_questions() -> List[str]:
+    with open(DATASET_PATH, 'r', encoding='utf-8') as f:
+        return [item['question'] for item in json.load(f)]
+
+
+def timed(action, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = action()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def scores(expected: List[Set[str]], predicted: List[Set[str]]) -> Dict:
+    tp = sum(len(e & p) for e, p in zip(expected, predicted))
+    n_predicted = sum(len(p) for p in predicted)
+    n_expected = sum(len(e) for e in expected)
+    return {
+        'precision': tp / n_predicted if n_predicted else 1.0,
+        'recall': tp / n_expected if n_expected else 1.0,
+        'exact': statistics.mean(
+            e == p for e, p in zip(expected, predicted)),
+    }
+
+
+def run_report(use_llm: bool):
+    """
+    Сравнивает словарь псевдонимов с LLM-экстрактором на вопросах
+    `tests/ragas/dataset.json`: точность и полнота словаря относительно
+    меток LLM, доля полных совпадений и время на вопрос.
+    """
+    questions = load_questions()
+    gazetteer = EntityGazetteer()
+    extractor = None
+    if use_llm:
+        llm = ChatOllama(
+            model=os.getenv('LLM_MODEL', 'qwen3:14b'),
+            base_url=OLLAMA_BASE_URL,
+            temperature=0.0
+        )
+        extractor = LiteraryEntityExtractor(
+            llm, need_summary=False, use_cache=False)
+
+    gazetteer_results, llm_results = [], []
+    gazetteer_times, llm_times = [], []
+    for question in questions:
+        matches, elapsed = timed(lambda: gazetteer.match(question), 1000)
+        gazetteer_results.append(matches._asdict())
+        gazetteer_times.append(elapsed)
+        line = f'{question}\n  словарь: {matches._asdict()}'
+        if extractor is not None:
+            state, elapsed = timed(lambda: extractor.invoke(question))
+            state = {key: state.get(key, []) for key in KEYS}
+            llm_results.append(state)
+            llm_times.append(elapsed)
+            line += f'\n  LLM:     {state}'
+        print(line)
+
+    print(
+        f'\nСловарь: {statistics.median(gazetteer_times) * 1e6:.1f} мкс '
+        'на вопрос (медиана)')
+    if extractor is None:
+        return
+    print(f'LLM: {statistics.median(llm_times):.2f} с на вопрос (медиана)')
+    print(f'{"поле":<12}{"точность":>10}{"полнота":>10}{"совпадение":>12}')
+    for key in KEYS:
+        result = scores(
+            [set(r[key]) for r in llm_results],
+            [set(r[key]) for r in gazetteer_results])
+        print(
+            f'{key:<12}{result["precision"]:>10.2f}{result["recall"]:>10.2f}'
+            f'{result["exact"]:>12.2f}')
+    ambiguous = sum(bool(r['ambiguous']) for r in gazetteer_results)
+    print(f'Неоднозначных вопросов (вызов LLM в режиме fallback): {ambiguous}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Точность словаря псевдонимов относительно LLM')
+    parser.add_argument(
+        '--no-llm', action='store_true',
+        help='Только результаты и время словаря, без обращения к Ollama')
+    args = parser.parse_args()
+    run_report(use_llm=not args.no_llm)
@@ -0,0 +1,84 @@
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from dotenv import load_dotenv
+from langchain_ollama import ChatOllama
+
+from api.literary_entity_extractor import LiteraryEntityExtractor
+from db import iter_records
+from db_filling import find_part_paths
+
+load_dotenv()
+OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
+OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
+OLLAMA_BASE_URL = f'http://{OLLAMA_HOST}:{OLLAMA_PORT}'
+JSON_PATH = Path(__file__).resolve().parents[2] / 'JSON'
+MODES = ('sequential', 'parallel', 'fused')
+
+
+def load_chunks(limit: int) -> List[str]:
+    chunks = []
+    for path in find_part_paths(JSON_PATH):
+        for _, text, _, _ in iter_records(path):
+            chunks.append(text)
+            if len(chunks) >= limit:
+                return chunks
+    return chunks
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def run_benchmark(limit: int, need_summary: bool):
+    """
+    Сравнивает режимы извлечения по задержке на чанк и согласию меток
+    (коэффициент Жаккара) с последовательным режимом.
+    """
+    llm = ChatOllama(
+        model=os.getenv('LLM_MODEL', 'qwen3:14b'),
+        base_url=OLLAMA_BASE_URL,
+        temperature=0.0
+    )
+    chunks = load_chunks(limit)
+    results: Dict[str, List[dict]] = {}
+    latencies: Dict[str, List[float]] = {}
+
+    for mode in MODES:
+        extractor = LiteraryEntityExtractor(
+            llm, need_summary=need_summary, mode=mode, use_cache=False)
+        results[mode], latencies[mode] = [], []
+        for chunk in chunks:
+            start = time.perf_counter()
+            results[mode].append(extractor.invoke(chunk))
+            latencies[mode].append(time.perf_counter() - start)
+
+    print(f'Чанков: {len(chunks)}, need_summary={need_summary}')
+    print(f'{"режим":<12}{"p50, с":>10}{"среднее, с":>12}'
+          f'{"персонажи":>12}{"локации":>10}')
+    for mode in MODES:
+        agreement = {
+            key: statistics.mean(
+                jaccard(set(ref.get(key, [])), set(res.get(key, [])))
+                for ref, res in zip(results['sequential'], results[mode]))
+            for key in ('characters', 'locations')
+        }
+        print(
+            f'{mode:<12}{statistics.median(latencies[mode]):>10.2f}'
+            f'{statistics.mean(latencies[mode]):>12.2f}'
+            f'{agreement["characters"]:>12.2f}{agreement["locations"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Сравнение режимов LiteraryEntityExtractor')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--no-summary', action='store_true')
+    args = parser.parse_args()
+    run_benchmark(args.limit, need_summary=not args.no_summary)
@@ -0,0 +1,95 @@
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from api.resources import build_resources
+from api.tools.contextual_retrieval_tool import (
+    FUSION_DEPTH, ContextualRetrievalTool)
+
+load_dotenv()
+
+
+def percentiles(timings: List[float]) -> Tuple[float, float]:
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return statistics.median(timings), p99
+
+
+def sample_queries(
+    documents: Dict[str, str], samples: int, words: int, seed: int
+) -> List[Tuple[str, str]]:
+    """Пары (ID чанка, цитата из `words` подряд идущих слов чанка)."""
+    rng = random.Random(seed)
+    candidates = [
+        (doc_id, text.split()) for doc_id, text in documents.items()
+        if text and len(text.split()) > words
+    ]
+    queries = []
+    for doc_id, tokens in rng.sample(
+            candidates, min(samples, len(candidates))):
+        start = rng.randrange(len(tokens) - words)
+        queries.append((doc_id, ' '.join(tokens[start:start + words])))
+    return queries
+
+
+def run_benchmark(samples: int, words: int, k: int, seed: int):
+    """
+    Доля запросов, для которых исходный чанк попал в топ-`k`, и задержка
+    поиска: только векторы против гибридного поиска (векторы + BM25,
+    reciprocal rank fusion). Запросы — цитаты из случайных чанков,
+    то есть вопросы с дословными зацепками. Эмбеддинги запросов
+    считаются заранее и во времени поиска не учитываются.
+    """
+    resources = build_resources()
+    store = resources.store
+    tool = ContextualRetrievalTool()
+    lexical = store.lexical_index()
+    documents = store.get_documents(lexical.ids)
+    queries = sample_queries(documents, samples, words, seed)
+    if not queries:
+        raise SystemExit('В коллекции нет чанков для выборки')
+    embeddings = resources.embedder.embed_documents([q for _, q in queries])
+
+    def vector(embedding, _query):
+        return tool._convert_results(store.search(embedding, n_results=k))
+
+    def hybrid(embedding, query):
+        return tool._fuse(
+            tool._convert_results(
+                store.search(embedding, n_results=FUSION_DEPTH)),
+            tool._convert_results(
+                store.lexical_search(query, n_results=FUSION_DEPTH)),
+        )[:k]
+
+    def bm25_only(_embedding, query):
+        return [{'id': doc_id} for doc_id, _ in lexical.search(query, k)]
+
+    modes: List[Tuple[str, Callable]] = [
+        ('vector', vector), ('hybrid', hybrid), ('bm25', bm25_only)]
+    print(f'Запросов: {len(queries)}, слов в цитате: {words}, k = {k}')
+    print(f'{"режим":<10}{"hit@k":>8}{"p50, мс":>10}{"p99, мс":>10}')
+    for name, search in modes:
+        hits, timings = 0, []
+        for (doc_id, query), embedding in zip(queries, embeddings):
+            start = time.perf_counter()
+            items = search(embedding, query)
+            timings.append((time.perf_counter() - start) * 1000)
+            hits += any(item['id'] == doc_id for item in items)
+        p50, p99 = percentiles(timings)
+        print(f'{name:<10}{hits / len(queries):>8.2f}{p50:>10.3f}{p99:>10.3f}')
+    resources.embedder.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Сравнение гибридного и векторного поиска')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--words', type=int, default=6)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args.samples, args.words, args.k, args.seed)
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import httpx
+
+DATASET_PATH = Path(__file__).resolve().parents[1] / 'ragas' / 'dataset.json'
+
+
+def percentiles(timings: List[float]) -> Tuple[float, float]:
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return statistics.median(timings), p99
+
+
+async def ask(
+    client: httpx.AsyncClient, url: str, question: str
+) -> Tuple[float, float]:
+    """Время до первого фрагмента ответа и до конца потока, в секундах."""
+    start = time.perf_counter()
+    first = None
+    async with client.stream('POST', url, json={'message': question}) as r:
+        r.raise_for_status()
+        async for _ in r.aiter_bytes():
+            if first is None:
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return first if first is not None else total, total
+
+
+async def run_level(
+    url: str, questions: List[str], concurrency: int, requests: int
+) -> Tuple[float, List[float], List[float], int]:
+    pending = itertools.islice(itertools.cycle(questions), requests)
+    first_bytes, totals, errors = [], [], 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for question in pending:
+            try:
+                first, total = await ask(client, url, question)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            first_bytes.append(first)
+            totals.append(total)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, first_bytes, totals, errors
+
+
+async def run_load_test(
+    url: str, concurrency_levels: List[int], requests: int
+):
+    """
+    Пропускная способность `/api/generate` при разном числе одновременных
+    клиентов: каждый клиент последовательно задаёт вопросы из RAGAS-набора,
+    пока не будет отправлено `requests` запросов. Сервер нужно запускать
+    с пустым `ANSWER_CACHE_PATH`, иначе повторные вопросы берутся из кэша
+    ответов.
+    """
+    with open(DATASET_PATH, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)]
+    print(f'URL: {url}, запросов на уровень: {requests}')
+    print(
+        f'{"клиентов":>9}{"запр/с":>9}{"p50, с":>9}{"p99, с":>9}'
+        f'{"первый байт p50, с":>20}{"ошибок":>8}')
+    for concurrency in concurrency_levels:
+        elapsed, first_bytes, totals, errors = await run_level(
+            url, questions, concurrency, requests)
+        if not totals:
+            print(f'{concurrency:>9}{"—":>9}{"":>9}{"":>9}{"":>20}'
+                  f'{errors:>8}')
+            continue
+        p50, p99 = percentiles(totals)
+        print(
+            f'{concurrency:>9}{len(totals) / elapsed:>9.2f}{p50:>9.2f}'
+            f'{p99:>9.2f}{statistics.median(first_bytes):>20.2f}'
+            f'{errors:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест /api/generate')
+    parser.add_argument(
+        '--url', default='http://localhost:8000/api/generate')
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.url, args.concurrency, args.requests))
@@ -0,0 +1,66 @@
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from db_filling import CHUNK_OVERLAP, CHUNK_SIZE
+from utils import EpubParser, Preprocessor, WorkItem
+
+BOOK_PATH = Path(__file__).resolve().parents[2] / 'war_and_peace.epub'
+
+
+def run_once(file_path: str, workers: int) -> Tuple[float, List[WorkItem]]:
+    start = time.perf_counter()
+    # Дисковый кэш парсера отключён, чтобы каждый прогон разбирал EPUB.
+    parser = EpubParser(file_path, cache_dir=None)
+    with Preprocessor(CHUNK_SIZE, CHUNK_OVERLAP, workers=workers) as pool:
+        items = list(pool.iter_work_items(pool.parse(parser)))
+    return time.perf_counter() - start, items
+
+
+def worker_counts(max_workers: int) -> List[int]:
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def run_benchmark(file_path: str, max_workers: int, repeat: int):
+    """
+    Время разбора EPUB и разбиения на чанки в зависимости от числа
+    процессов (включая запуск пула) и ускорение относительно одного
+    процесса. Проверяет, что поток чанков не зависит от числа процессов.
+    """
+    reference = None
+    baseline = None
+    print(f'{"процессов":<12}{"медиана, с":>12}{"ускорение":>12}'
+          f'{"чанков":>10}')
+    for workers in worker_counts(max_workers):
+        timings = []
+        for _ in range(repeat):
+            elapsed, items = run_once(file_path, workers)
+            timings.append(elapsed)
+        if reference is None:
+            reference = items
+        elif items != reference:
+            raise AssertionError(
+                f'Результат для {workers} процессов отличается от '
+                'последовательного')
+        median = statistics.median(timings)
+        baseline = baseline or median
+        print(f'{workers:<12}{median:>12.2f}{baseline / median:>12.2f}'
+              f'{len(items):>10}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Ускорение предобработки EPUB по числу процессов')
+    parser.add_argument('file_path', nargs='?', default=str(BOOK_PATH))
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.file_path, args.max_workers, args.repeat)
@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from db import EntityIndex, collect_ids, iter_records
+from db.quantization import EMBEDDING_RESCORE_FACTOR, SUPPORTED_QUANTIZATIONS
+from db_filling import find_part_paths
+
+JSON_PATH = Path(__file__).resolve().parents[2] / 'JSON'
+
+
+def recall(found: List[List[int]], exact: List[List[int]]) -> float:
+    return statistics.mean(
+        len(set(f) & set(e)) / len(e) for f, e in zip(found, exact))
+
+
+def run_report(
+    json_path: Path, n_queries: int, k: int, rescore_factor: int
+):
+    """
+    Для каждого вида хранения матрицы эмбеддингов индекса: память под
+    матрицу, по которой идёт перебор, размер файлов, время загрузки
+    индекса, задержка поиска и recall@k относительно float32 — без
+    пересчёта и с пересчётом `k * rescore_factor` кандидатов в полной
+    точности. Запросы — эмбеддинги случайных чанков с шумом. Экономия
+    диска — относительно файлов индекса float32.
+    """
+    paths = find_part_paths(json_path)
+    known_ids = collect_ids(paths)
+    ids, metadatas, embeddings = [], [], []
+    for path in paths:
+        for doc_id, _, embedding, metadata in (
+                iter_records(path, known_ids)):
+            ids.append(doc_id)
+            metadatas.append(metadata)
+            embeddings.append(embedding)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    dim = embeddings.shape[1]
+    queries = embeddings[rng.integers(0, len(ids), n_queries)] + rng.normal(
+        0, 0.5 / np.sqrt(dim), (n_queries, dim))
+
+    print(
+        f'Чанков: {len(ids)}, размерность: {dim}, запросов: {n_queries}, '
+        f'k = {k}, пересчёт: k * {rescore_factor}')
+    print(
+        f'{"тип":<9}{"память, МБ":>11}{"байт/чанк":>11}{"диск, МБ":>10}'
+        f'{"экономия":>10}{"загрузка, мс":>14}{"p50, мс":>9}{"recall":>8}'
+        f'{"recall+пересчёт":>17}')
+    exact = None
+    baseline_disk = None
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in SUPPORTED_QUANTIZATIONS:
+            prefix = os.path.join(directory, kind)
+            EntityIndex.build(
+                ids, metadatas, embeddings, 'v', quantization=kind
+            ).save(prefix)
+            start = time.perf_counter()
+            index = EntityIndex.load(prefix)
+            load_ms = (time.perf_counter() - start) * 1000
+            # Полная матрица отображена в память и читается только при
+            # пересчёте, поэтому в памяти держится лишь перебираемая.
+            memory = (
+                index.quantized.nbytes if index.quantized
+                else index.vectors.nbytes)
+            disk = sum(
+                os.path.getsize(path) for path in glob.glob(prefix + '.*'))
+            if baseline_disk is None:
+                baseline_disk = disk
+
+            timings, plain, rescored = [], [], []
+            for query in queries:
+                start = time.perf_counter()
+                hits = index.nearest([query], k, None, rescore_factor)[0]
+                timings.append((time.perf_counter() - start) * 1000)
+                rescored.append([row for row, _ in hits])
+                plain.append([
+                    row for row, _ in index.nearest([query], k, None, 1)[0]])
+            if exact is None:
+                exact = rescored
+            print(
+                f'{kind:<9}{memory / 2**20:>11.2f}{memory / len(ids):>11.0f}'
+                f'{disk / 2**20:>10.2f}{1 - disk / baseline_disk:>10.0%}'
+                f'{load_ms:>14.2f}'
+                f'{statistics.median(timings):>9.3f}'
+                f'{recall(plain, exact):>8.3f}'
+                f'{recall(rescored, exact):>17.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Память, загрузка и полнота при квантовании эмбеддингов')
+    parser.add_argument('json_path', nargs='?', type=Path, default=JSON_PATH)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument(
+        '--rescore-factor', type=int, default=EMBEDDING_RESCORE_FACTOR)
+    args = parser.parse_args()
+    run_report(args.json_path, args.queries, args.k, args.rescore_factor)
@@ -0,0 +1,65 @@
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+from dotenv import load_dotenv
+import numpy as np
+
+from api.literary_entity_extractor import LiteraryEntityExtractor
+from api.resources import build_resources
+from db import ChromaManager, VectorStore
+
+load_dotenv()
+CHROMA_PERSIST_DIR = os.getenv('CHROMA_PERSIST_DIR', './chroma_db')
+
+
+def measure(action: Callable[[], None], requests: int) -> List[float]:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        action()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run_benchmark(requests: int):
+    """
+    Накладные расходы запроса без вызовов моделей: создание экстрактора
+    и клиента ChromaDB на каждый запрос (как раньше) против общих
+    ресурсов, созданных один раз. В обоих случаях выполняется поиск
+    по случайному вектору.
+    """
+    resources = build_resources()
+    vectors = resources.store.entity_index().vectors
+    if not len(vectors):
+        raise SystemExit('Коллекция пуста')
+    dim = vectors.shape[1]
+    rng = np.random.default_rng(0)
+
+    def query(store: VectorStore) -> None:
+        store.search(query_embedding=rng.standard_normal(dim).tolist())
+
+    def cold() -> None:
+        LiteraryEntityExtractor(llm=resources.llm, need_summary=False)
+        query(ChromaManager(persist_directory=CHROMA_PERSIST_DIR))
+
+    def warm() -> None:
+        query(resources.store)
+
+    print(f'Запросов: {requests}')
+    print(f'{"режим":<10}{"p50, мс":>10}{"p99, мс":>10}')
+    for name, action in (('cold', cold), ('warm', warm)):
+        timings = sorted(measure(action, requests))
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f'{name:<10}{statistics.median(timings):>10.2f}{p99:>10.2f}')
+    resources.embedder.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Накладные расходы запроса: холодный и тёплый старт')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+    run_benchmark(args.requests)
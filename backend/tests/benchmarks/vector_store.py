@@ -0,0 +1,88 @@
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from db import ChromaManager, NumpyVectorStore, VectorStore
+from db_filling import find_part_paths
+
+JSON_PATH = Path(__file__).resolve().parents[2] / 'JSON'
+
+
+def percentiles(timings: List[float]) -> Tuple[float, float]:
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return statistics.median(timings), p99
+
+
+def measure(
+    search: Callable[[List[float]], List[str]], queries: np.ndarray
+) -> Tuple[List[List[str]], List[float]]:
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query.tolist()))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, timings
+
+
+def run_benchmark(json_path: Path, n_queries: int, k: int, batch: int):
+    """
+    Задержка поиска в ChromaDB и в NumpyVectorStore на одних и тех же
+    данных (`backend/JSON`) и полнота Chroma относительно точного поиска.
+    Запросы — эмбеддинги случайных чанков с шумом, так что модель
+    эмбеддингов не нужна. Оба хранилища собираются во временном каталоге.
+    """
+    paths = find_part_paths(json_path)
+    with tempfile.TemporaryDirectory() as directory:
+        chroma = ChromaManager(persist_directory=f'{directory}/chroma')
+        chroma.rebuild(paths)
+        numpy_store = NumpyVectorStore(f'{directory}/numpy')
+        numpy_store.build(paths)
+
+        vectors = np.asarray(numpy_store.entity_index().vectors)
+        rng = np.random.default_rng(0)
+        rows = rng.integers(0, len(vectors), n_queries)
+        queries = vectors[rows] + rng.normal(
+            0, 0.5 / np.sqrt(vectors.shape[1]), (n_queries, vectors.shape[1]))
+
+        def ids(store: VectorStore) -> Callable[[List[float]], List[str]]:
+            return lambda query: store.search(query, n_results=k)['ids'][0]
+
+        exact, numpy_timings = measure(ids(numpy_store), queries)
+        approximate, chroma_timings = measure(ids(chroma), queries)
+        recall = statistics.mean(
+            len(set(a) & set(e)) / len(e)
+            for a, e in zip(approximate, exact))
+
+        start = time.perf_counter()
+        for i in range(0, n_queries, batch):
+            numpy_store.search_batch(queries[i:i + batch], n_results=k)
+        batched = (time.perf_counter() - start) * 1000 / n_queries
+
+    print(
+        f'Чанков: {len(vectors)}, размерность: {vectors.shape[1]}, '
+        f'запросов: {n_queries}, k = {k}')
+    print(f'{"хранилище":<22}{"p50, мс":>10}{"p99, мс":>10}{"recall":>8}')
+    for name, timings, value in (
+            ('chroma', chroma_timings, recall),
+            ('numpy', numpy_timings, 1.0)):
+        p50, p99 = percentiles(timings)
+        print(f'{name:<22}{p50:>10.3f}{p99:>10.3f}{value:>8.3f}')
+    print(f'{f"numpy, пачки по {batch}":<22}{batched:>10.3f}'
+          f'{"":>10}{1.0:>8.3f}  (среднее на запрос)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Сравнение ChromaDB и NumpyVectorStore')
+    parser.add_argument('json_path', nargs='?', type=Path, default=JSON_PATH)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=64)
+    args = parser.parse_args()
+    run_benchmark(args.json_path, args.queries, args.k, args.batch)
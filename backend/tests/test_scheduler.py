@@ -0,0 +1,138 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api.scheduler import AdmissionRejected, RequestScheduler
+
+
+async def settle(steps: int = 5) -> None:
+    for _ in range(steps):
+        await asyncio.sleep(0)
+
+
+def test_round_robin_across_clients():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrent=1)
+        await scheduler.acquire('a')
+        order = []
+
+        async def wait(client, name):
+            await scheduler.acquire(client)
+            order.append(name)
+
+        tasks = []
+        for client, name in (('a', 'a1'), ('a', 'a2'), ('b', 'b1'),
+                             ('c', 'c1')):
+            tasks.append(asyncio.create_task(wait(client, name)))
+            await settle()
+        for _ in tasks:
+            scheduler.release()
+            await settle()
+        await asyncio.gather(*tasks)
+        return order
+
+    # Клиент с пачкой запросов не задерживает остальных.
+    assert asyncio.run(scenario()) == ['a1', 'b1', 'c1', 'a2']
+
+
+def test_rejects_429_when_client_queue_is_full():
+    async def scenario():
+        scheduler = RequestScheduler(
+            max_concurrent=1, max_queued_per_client=1)
+        await scheduler.acquire('a')
+        waiting = asyncio.create_task(scheduler.acquire('a'))
+        await settle()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await scheduler.acquire('a')
+        waiting.cancel()
+        return rejected.value, scheduler.stats()
+
+    error, stats = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert stats['rejected_429'] == 1
+
+
+def test_rejects_503_when_queue_is_full():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrent=1, max_queued=1)
+        await scheduler.acquire('a')
+        waiting = asyncio.create_task(scheduler.acquire('b'))
+        await settle()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await scheduler.acquire('c')
+        waiting.cancel()
+        return rejected.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.retry_after >= 1
+
+
+def test_rejects_503_on_queue_timeout():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrent=1, queue_timeout=0.01)
+        await scheduler.acquire('a')
+        with pytest.raises(AdmissionRejected) as rejected:
+            await scheduler.acquire('b')
+        return rejected.value, scheduler.stats()
+
+    error, stats = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert stats['timed_out'] == 1
+    assert stats['queued'] == 0
+
+
+def test_cancelled_waiter_releases_queue_slot():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrent=1, max_queued=1)
+        await scheduler.acquire('a')
+        waiting = asyncio.create_task(scheduler.acquire('b'))
+        await settle()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert scheduler.stats()['queued'] == 0
+
+        # Место в очереди свободно, и освобождённый слот достаётся
+        # следующему, а не отменённому запросу.
+        replacement = asyncio.create_task(scheduler.acquire('c'))
+        await settle()
+        scheduler.release()
+        await asyncio.wait_for(replacement, timeout=1)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['active'] == 1
+    assert stats['queued'] == 0
+    assert stats['rejected_503'] == 0
+
+
+def test_generate_rejection_carries_retry_after(monkeypatch):
+    import api.main as main
+
+    class Agent:
+        async def load_history(self, chat_history=None, session_id=None):
+            return []
+
+        async def cached_answer(self, query, history):
+            return None
+
+        async def generate_uncached(self, query, history):
+            yield 'ответ'
+
+    scheduler = RequestScheduler(max_concurrent=1, max_queued=0)
+    monkeypatch.setattr(main, 'agent', Agent())
+    monkeypatch.setattr(main, 'get_scheduler', lambda: scheduler)
+
+    async def scenario():
+        await scheduler.acquire('other')
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+                transport=transport, base_url='http://test') as client:
+            return await client.post(
+                '/api/generate', json={'message': 'Где Пьер?'})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 503
+    assert int(response.headers['retry-after']) >= 1
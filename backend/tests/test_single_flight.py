@@ -0,0 +1,106 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+
+from api.single_flight import SingleFlight
+
+
+async def words(gate: asyncio.Event, *items: str) -> AsyncIterator[str]:
+    """Отдаёт первый фрагмент сразу, остальные — после `gate`."""
+    for i, item in enumerate(items):
+        if i:
+            await gate.wait()
+        yield item
+
+
+async def read(stream: AsyncIterator[str]) -> List[str]:
+    return [chunk async for chunk in stream]
+
+
+async def settle(steps: int = 5) -> None:
+    for _ in range(steps):
+        await asyncio.sleep(0)
+
+
+def test_late_joiner_gets_full_replay():
+    async def scenario():
+        gate = asyncio.Event()
+        flights = SingleFlight()
+        flight = flights.start('k', words(gate, 'Пьер ', 'был ', 'там'))
+        flight.join()
+        leader = flight.subscribe()
+        assert await leader.__anext__() == 'Пьер '
+
+        follower = flights.get('k')
+        follower.join()
+        gate.set()
+        rest, replay = await asyncio.gather(
+            read(leader), read(follower.subscribe()))
+        return rest, replay, flights.stats()
+
+    rest, replay, stats = asyncio.run(scenario())
+    assert rest == ['был ', 'там']
+    assert replay == ['Пьер ', 'был ', 'там']
+    assert stats == {'in_flight': 0, 'started': 1, 'coalesced': 1}
+
+
+def test_follower_disconnect_does_not_cancel_leader():
+    async def scenario():
+        gate = asyncio.Event()
+        flights = SingleFlight()
+        flight = flights.start('k', words(gate, 'a', 'b', 'c'))
+        flight.join()
+        follower = flights.get('k')
+        follower.join()
+        await follower.subscribe().__anext__()
+        follower.leave()
+        gate.set()
+        return flight.cancelled, await read(flight.subscribe())
+
+    cancelled, chunks = asyncio.run(scenario())
+    assert not cancelled
+    assert chunks == ['a', 'b', 'c']
+
+
+def test_joined_follower_survives_leader_leaving_before_read():
+    async def scenario():
+        gate = asyncio.Event()
+        flights = SingleFlight()
+        flight = flights.start('k', words(gate, 'a', 'b'))
+        flight.join()
+        follower = flights.get('k')
+        follower.join()
+        # Ведущий отключился раньше, чем ведомый начал читать.
+        flight.leave()
+        gate.set()
+        return flight.cancelled, await read(follower.subscribe())
+
+    cancelled, chunks = asyncio.run(scenario())
+    assert not cancelled
+    assert chunks == ['a', 'b']
+
+
+def test_cancelled_only_when_last_subscriber_leaves():
+    done = []
+
+    async def scenario():
+        flights = SingleFlight()
+        flight = flights.start(
+            'k', words(asyncio.Event(), 'a', 'b'),
+            on_done=lambda: done.append(True))
+        flight.join()
+        flight.join()
+        flight.leave()
+        await settle()
+        assert not flight.cancelled
+
+        flight.leave()
+        await settle()
+        assert flight.cancelled and flight.done
+        assert flights.get('k') is None
+        with pytest.raises(RuntimeError):
+            await read(flight.subscribe())
+
+    asyncio.run(scenario())
+    assert done == [True]
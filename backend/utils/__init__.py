@@ -1,4 +1,9 @@
+from .embeddings import BatchEmbedder, CachedEmbedder
 from .epub_parser import EpubParser
 from .logger import setup_logger
+from .preprocess import Preprocessor, WorkItem
 
-__all__ = ['EpubParser', 'setup_logger']
+__all__ = [
+    'BatchEmbedder', 'CachedEmbedder', 'EpubParser', 'Preprocessor',
+    'WorkItem', 'setup_logger'
+]
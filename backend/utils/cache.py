@@ -0,0 +1,185 @@
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+from typing import (
+    Any, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar)
+
+V = TypeVar('V')
+
+
+class SQLiteCache:
+    """
+    Дисковый кэш «ключ → строка» на SQLite с вытеснением по возрасту
+    (`max_age`, секунды) и по числу записей (`max_entries`, вытесняются
+    давно не читанные). Записи группируются по `namespace` и `version`,
+    что позволяет сбросить все записи пространства имён при смене версии.
+    Безопасен для использования из нескольких потоков и процессов.
+    """
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        max_age: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, namespace TEXT, version TEXT, '
+                'value TEXT, created REAL, accessed REAL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS cache_accessed '
+                'ON cache (accessed)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS cache_namespace '
+                'ON cache (namespace, version)')
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None and (
+                    now - row[1] > self.max_age):
+                with self._conn:
+                    self._conn.execute(
+                        'DELETE FROM cache WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE cache SET accessed = ? WHERE key = ?',
+                    (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(
+        self, key: str, value: str,
+        namespace: str = '', version: str = ''
+    ) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache '
+                '(key, namespace, version, value, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, namespace, version, value, now, now))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def invalidate(self, namespace: str, keep_version: str) -> int:
+        """Удаляет записи `namespace`, версия которых не `keep_version`."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                'DELETE FROM cache WHERE namespace = ? AND version != ?',
+                (namespace, keep_version)).rowcount
+
+    def items(
+        self, namespace: str, version: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        """Пары (ключ, значение) пространства имён, не старше `max_age`."""
+        query = 'SELECT key, value FROM cache WHERE namespace = ?'
+        params: List[Any] = [namespace]
+        if version is not None:
+            query += ' AND version = ?'
+            params.append(version)
+        if self.max_age is not None:
+            query += ' AND created >= ?'
+            params.append(time.time() - self.max_age)
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def _evict(self, now: float) -> None:
+        if self.max_age is not None:
+            self._conn.execute(
+                'DELETE FROM cache WHERE created < ?', (now - self.max_age,))
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (count - self.max_entries,))
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class LRUCache(Generic[V]):
+    """
+    Потокобезопасный кэш в памяти: не больше `max_entries` записей
+    (вытесняются давно не читанные), записи старше `max_age` секунд
+    считаются отсутствующими.
+    """
+    def __init__(
+        self, max_entries: int = 1024, max_age: Optional[float] = None
+    ):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self.max_age is not None and (
+                    time.monotonic() - item[0] > self.max_age):
+                del self._items[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._items),
+        }
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterator, Optional
+
+CHUNK_ID_NAMESPACE = uuid.UUID('0f6d1a52-7c1e-4c55-9a43-3e6f1b2d8c90')
+
+
+def content_hash(*parts: Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_id(text: str, section_idx: int, chunk_idx: int) -> str:
+    """
+    Детерминированный ID чанка: одинаковый текст на той же позиции всегда
+    получает тот же UUID, поэтому повторная обработка не меняет связи
+    `prev_id`/`next_id` и ID в ChromaDB.
+    """
+    return str(uuid.uuid5(
+        CHUNK_ID_NAMESPACE,
+        f'{section_idx}:{chunk_idx}:{content_hash(text)}'))
+
+
+class StageCheckpoint:
+    """
+    Результаты одной стадии конвейера в append-only JSONL файле.
+    Каждая запись сбрасывается на диск сразу после вычисления, поэтому
+    после падения теряется не больше одной (недописанной) строки.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Any] = {}
+        if os.path.isfile(path):
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, 'rb+') as f:
+            lines = f.read().split(b'\n')
+            if lines[-1]:
+                # Недописанная при падении строка: отрезаем её, чтобы
+                # следующая запись начиналась с новой строки.
+                f.truncate(f.tell() - len(lines[-1]))
+        for line in lines[:-1]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._data[entry['key']] = entry['value']
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._data))
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        return self._data.get(key, default)
+
+    def put(self, key: str, value: Any) -> None:
+        line = json.dumps(
+            {'key': key, 'value': value}, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._data[key] = value
+
+    def reset(self) -> None:
+        with self._lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            self._data.clear()
+
+
+class CheckpointManifest:
+    """
+    Набор чекпоинтов по стадиям (parse, split, extract, embed, load).
+    Ключ каждой записи — хэш входа стадии и её параметров, так что
+    изменение одной стадии (например, модели эмбеддингов) не затрагивает
+    результаты остальных.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self._stages: Dict[str, StageCheckpoint] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> StageCheckpoint:
+        # Стадии запрашиваются из потоков INGEST_WORKERS: без блокировки
+        # два потока могут создать два чекпоинта одного файла.
+        with self._lock:
+            if name not in self._stages:
+                self._stages[name] = StageCheckpoint(
+                    os.path.join(self.directory, f'{name}.jsonl'))
+            return self._stages[name]
@@ -0,0 +1,251 @@
+import asyncio
+import base64
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+from .cache import LRUCache, SQLiteCache
+from .checkpoint import content_hash
+
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_BATCH_TIMEOUT = float(os.getenv('EMBEDDING_BATCH_TIMEOUT', '0.05'))
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '4096'))
+EMBEDDING_CACHE_TTL = float(os.getenv('EMBEDDING_CACHE_TTL', '86400'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
+
+
+class BatchEmbedder(Embeddings):
+    """
+    Обёртка над эмбеддером LangChain, которая копит тексты из разных потоков
+    и отправляет их одним вызовом `embed_documents` (в Ollama это один
+    запрос к `/api/embed`). Пачка уходит, когда набралось `batch_size`
+    текстов или с момента прихода первого прошло `max_wait` секунд.
+    При ошибке из-за входа пачка делится пополам, поэтому исключение
+    получают только те тексты, на которых падает модель; при ошибке
+    соединения, таймауте или 5xx исключение сразу получает вся пачка.
+    """
+    def __init__(
+        self,
+        embedder: Embeddings,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_wait: float = EMBEDDING_BATCH_TIMEOUT,
+    ):
+        self.embedder = embedder
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self._queue: queue.Queue[Optional[Tuple[str, Future]]] = (
+            queue.Queue())
+        self._worker = threading.Thread(
+            target=self._run, name='batch-embedder', daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # Ожидание без блокировки цикла событий; запрос к модели уходит
+        # в общей пачке из фонового потока.
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(
+            asyncio.wrap_future(self.submit(text)) for text in texts)))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            closing = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = (
+                        self._queue.get(timeout=timeout) if timeout > 0
+                        else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if closing:
+                return
+
+    def _flush(self, batch: List[Tuple[str, Future]]) -> None:
+        batch = [
+            (text, future) for text, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+        if batch:
+            self._embed(batch)
+
+    def _embed(self, batch: List[Tuple[str, Future]]) -> None:
+        try:
+            vectors = self.embedder.embed_documents(
+                [text for text, _ in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(
+                    f'Модель вернула {len(vectors)} эмбеддингов '
+                    f'на {len(batch)} текстов')
+        except Exception as e:
+            if len(batch) == 1 or is_transport_error(e):
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            middle = len(batch) // 2
+            self._embed(batch[:middle])
+            self._embed(batch[middle:])
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+def is_transport_error(error: Exception) -> bool:
+    """
+    Ошибка не из-за содержимого запроса (сервер недоступен, таймаут,
+    5xx): повтор частями лишь умножит ожидание.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError,
+                          httpx.TransportError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(
+            getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status_code, int) and status_code >= 500
+
+
+def normalize_query(text: str) -> str:
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+class CachedEmbedder(Embeddings):
+    """
+    Кэш эмбеддингов запросов поверх любого эмбеддера. Ключ — имя модели
+    и нормализованный текст (регистр, `ё`, пробелы). Первый уровень — LRU
+    в памяти с TTL, второй (если передан `disk_cache`) — общий для
+    процессов SQLite. При попадании запрос к модели не выполняется.
+    """
+    def __init__(
+        self,
+        embedder: Embeddings,
+        model: str,
+        max_entries: int = EMBEDDING_CACHE_SIZE,
+        max_age: Optional[float] = EMBEDDING_CACHE_TTL,
+        disk_cache: Optional[SQLiteCache] = None,
+    ):
+        self.embedder = embedder
+        self.model = model
+        self.namespace = f'embedding:{model}'
+        self.memory = LRUCache[List[float]](max_entries, max_age or None)
+        self.disk_cache = disk_cache
+        self.disk_hits = 0
+
+    def _key(self, text: str) -> str:
+        return content_hash(self.model, normalize_query(text))
+
+    @staticmethod
+    def _dump(vector: List[float]) -> str:
+        data = np.asarray(vector, dtype=np.float32).tobytes()
+        return base64.b64encode(data).decode('ascii')
+
+    @staticmethod
+    def _load(value: str) -> List[float]:
+        data = base64.b64decode(value)
+        return np.frombuffer(data, dtype=np.float32).tolist()
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        vector = self.memory.get(key)
+        if vector is None and self.disk_cache is not None:
+            value = self.disk_cache.get(key)
+            if value is not None:
+                vector = CachedEmbedder._load(value)
+                self.memory.set(key, vector)
+                self.disk_hits += 1
+        return vector
+
+    def _store(self, key: str, vector: List[float]) -> None:
+        self.memory.set(key, vector)
+        if self.disk_cache is not None:
+            self.disk_cache.set(
+                key, CachedEmbedder._dump(vector), namespace=self.namespace)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = (
+            self._lookup(key) if self.disk_cache is None
+            else await asyncio.to_thread(self._lookup, key))
+        if vector is None:
+            vector = await self.embedder.aembed_query(text)
+            if self.disk_cache is None:
+                self._store(key, vector)
+            else:
+                await asyncio.to_thread(self._store, key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embedder.embed_documents(
+                [texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self._store(keys[i], vector)
+        return vectors
+
+    def close(self) -> None:
+        close = getattr(self.embedder, 'close', None)
+        if close is not None:
+            close()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        `hits` — попадания в любой уровень, `disk_hits` — из них на диске,
+        `misses` — запросы к модели.
+        """
+        memory = self.memory.stats()
+        hits = memory['hits']
+        misses = memory['misses'] - self.disk_hits
+        total = hits + memory['misses']
+        return {
+            'hits': hits + self.disk_hits,
+            'disk_hits': self.disk_hits,
+            'misses': misses,
+            'hit_rate': (hits + self.disk_hits) / total if total else 0.0,
+            'size': memory['size'],
+        }
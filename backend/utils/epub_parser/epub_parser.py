@@ -1,65 +1,151 @@
+from concurrent.futures import Executor
+import json
 import os
+from typing import Dict, Iterator, List, Optional
 
-from bs4 import BeautifulSoup
 from ebooklib import epub
+from lxml import html
+
+from utils.checkpoint import file_hash
+
+EPUB_CACHE_DIR = os.getenv('EPUB_CACHE_DIR', './cache/epub')
+# Меняется при изменении логики извлечения текста, чтобы не читать
+# кэш, собранный старой версией парсера.
+PARSER_VERSION = 2
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+TEXT_XPATH = './/text()[not(ancestor::script) and not(ancestor::style)]'
 
 
 class EpubParser():
-    def __init__(self, file_path: str):
+    """
+    Разбирает EPUB в список разделов (каждый раздел — список подглав).
+    Каждый документ книги разбирается один раз, даже если на него
+    ссылаются несколько пунктов оглавления. Результат кэшируется на диске
+    по хэшу файла: при повторном запуске EPUB не разбирается вовсе.
+    """
+    def __init__(
+        self,
+        file_path: str,
+        cache_dir: Optional[str] = EPUB_CACHE_DIR
+    ):
         if not os.path.isfile(file_path):
             raise FileNotFoundError(f'Файл не найден: {file_path}')
         if not file_path.lower().endswith('.epub'):
             raise ValueError(
                 f'Файл не является EPUB: {file_path}. '
                 'Ожидается ".epub" расширение.')
+        self.file_path = file_path
+        self.cache_path = None
+        self._content: Optional[List[List[str]]] = None
+        self._book = None
+        if cache_dir:
+            self.cache_path = os.path.join(
+                cache_dir, f'{file_hash(file_path)}.v{PARSER_VERSION}.json')
+            self._content = self._read_cache()
+        if self._content is None:
+            # Книга читается сразу, чтобы повреждённый файл был обнаружен
+            # при создании парсера, как и раньше.
+            self._book = self._read_book()
+
+    def _read_book(self):
         try:
-            self.book = epub.read_epub(file_path)
+            return epub.read_epub(self.file_path)
         except (IOError, epub.EpubException) as e:
             raise ValueError(
                 'Файл не является действительным EPUB или поврежден: '
-                f'{file_path}. Ошибка: {e}')
-        self._parse_content()
+                f'{self.file_path}. Ошибка: {e}')
+
+    def _read_cache(self) -> Optional[List[List[str]]]:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_cache(self, content: List[List[str]]) -> None:
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    @property
+    def book(self):
+        if self._book is None:
+            self._book = self._read_book()
+        return self._book
+
+    @property
+    def chapters_info(self) -> List[Dict]:
+        return EpubParser._walk_toc(self.book.toc)
+
+    @property
+    def content(self) -> List[List[str]]:
+        if self._content is None:
+            self._content = list(self.iter_sections())
+        return self._content
 
     @staticmethod
-    def _extract_text_from_item(item, subchapter_class='Z2_1K'):
-        soup = BeautifulSoup(item.get_content(), 'html.parser')
-        subchapter_markers = soup.find_all('p', class_=subchapter_class)
+    def _is_marker(element, subchapter_class: str) -> bool:
+        return (
+            element.tag == 'p' and
+            subchapter_class in (element.get('class') or '').split())
 
-        if not subchapter_markers:
-            return soup.get_text(strip=True)
+    @staticmethod
+    def _normalize(text: Optional[str]) -> str:
+        # Как в BeautifulSoup: пробельные строки между тегами сводятся
+        # к одному переводу строки или пробелу.
+        if not text:
+            return ''
+        if not text.strip(ASCII_SPACES):
+            return '\n' if '\n' in text else ' '
+        return text
 
-        sections = []
-        previous_element = soup
+    @staticmethod
+    def _text_content(element) -> str:
+        return ''.join(
+            EpubParser._normalize(s) for s in element.xpath(TEXT_XPATH))
 
-        for marker in subchapter_markers:
-            current_text = []
-            for sibling in previous_element.next_siblings:
-                if sibling == marker:
+    @staticmethod
+    def extract_sections(
+            content: bytes, subchapter_class: str = 'Z2_1K') -> List[str]:
+        """
+        Делит HTML-документ на подглавы по абзацам-маркерам
+        `<p class="Z2_1K">` за один проход по дереву lxml: каждый узел
+        просматривается один раз. Подглава — заголовок маркера и текст до
+        следующего маркера. Документ без маркеров возвращается одним
+        разделом.
+        """
+        root = html.document_fromstring(content)
+        markers = [
+            p for p in root.iter('p')
+            if EpubParser._is_marker(p, subchapter_class)
+        ]
+
+        if not markers:
+            text = ''.join(s.strip() for s in root.xpath(TEXT_XPATH))
+            return [text] if text else []
+
+        sections = []
+        for marker in markers:
+            current_text = [EpubParser._normalize(marker.tail)]
+            for sibling in marker.itersiblings():
+                if EpubParser._is_marker(sibling, subchapter_class):
                     break
-                if isinstance(sibling, str):
-                    current_text.append(sibling)
-                else:
-                    current_text.append(sibling.get_text())
-            section_text = "".join(current_text).strip()
+                if isinstance(sibling.tag, str):
+                    current_text.append(EpubParser._text_content(sibling))
+                current_text.append(EpubParser._normalize(sibling.tail))
+            section_text = ''.join(current_text).strip()
             if section_text:
                 sections.append(
-                    previous_element.get_text() + '\n' + section_text
-                )
-
-            previous_element = marker
-
-        current_text = []
-        for sibling in previous_element.next_siblings:
-            if isinstance(sibling, str):
-                current_text.append(sibling)
-            else:
-                current_text.append(sibling.get_text())
-        section_text = "".join(current_text).strip()
-        if section_text:
-            sections.append(section_text)
-
+                    EpubParser._text_content(marker) + '\n' + section_text)
         return sections
 
+    @staticmethod
+    def _extract_text_from_item(item, subchapter_class='Z2_1K'):
+        return EpubParser.extract_sections(
+            item.get_content(), subchapter_class)
+
     @staticmethod
     def _walk_toc(toc, level=0):
         chapters = []
@@ -81,11 +167,38 @@ class EpubParser():
                 chapters.extend(EpubParser._walk_toc(subitems, level + 1))
         return chapters
 
-    def _parse_content(self):
-        self.chapters_info = EpubParser._walk_toc(self.book.toc)
-        self.content = []
-        for ch in self.chapters_info:
-            item = self.book.get_item_with_href(ch['href'])
-            text = EpubParser._extract_text_from_item(item)
-            if text:
-                self.content.append(text)
+    def iter_sections(
+            self, executor: Optional[Executor] = None) -> Iterator[List[str]]:
+        """
+        Лениво отдаёт разделы книги в порядке оглавления. Если передан
+        `executor` (например, пул процессов), документы разбираются в нём
+        параллельно, порядок разделов при этом сохраняется. После полного
+        прохода результат сохраняется в дисковый кэш.
+        """
+        if self._content is not None:
+            yield from self._content
+            return
+
+        hrefs = [ch['href'] for ch in self.chapters_info]
+        unique_hrefs = list(dict.fromkeys(hrefs))
+        documents = (
+            self.book.get_item_with_href(href).get_content()
+            for href in unique_hrefs
+        )
+        if executor is None:
+            results = map(EpubParser.extract_sections, documents)
+        else:
+            results = executor.map(EpubParser.extract_sections, documents)
+
+        parsed: Dict[str, List[str]] = {}
+        content = []
+        for href in hrefs:
+            while href not in parsed:
+                parsed[unique_hrefs[len(parsed)]] = next(results)
+            sections = parsed[href]
+            if sections:
+                content.append(sections)
+                yield sections
+
+        if self.cache_path:
+            self._write_cache(content)
@@ -0,0 +1,118 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import os
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.checkpoint import StageCheckpoint, content_hash
+from utils.epub_parser import EpubParser
+
+PREPROCESS_WORKERS = int(
+    os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 1)))
+
+_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+
+class WorkItem(NamedTuple):
+    section_idx: int
+    chunk_idx: int
+    text: str
+
+
+def make_splitter(
+        chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=['\n\n', '\n', '. ', ' ', '']
+    )
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int) -> None:
+    # Сплиттер создаётся один раз на процесс, а не на каждый раздел.
+    global _splitter
+    _splitter = make_splitter(chunk_size, chunk_overlap)
+
+
+def _split_text(text: str) -> List[str]:
+    return _splitter.split_text(text)
+
+
+class Preprocessor:
+    """
+    Параллельная предобработка книги: разбор документов EPUB и разбиение
+    разделов на чанки выполняются в пуле из `workers` процессов, чтобы
+    CPU-нагрузка не конкурировала за GIL с потоками, ожидающими LLM.
+    При `workers <= 1` всё выполняется в текущем процессе.
+    """
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_overlap: int,
+        workers: int = PREPROCESS_WORKERS,
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(chunk_size, chunk_overlap))
+            # Процессы запускаются сразу: пока создаётся пул, других
+            # потоков (BatchEmbedder, запросы к LLM) ещё нет, и fork
+            # безопасен.
+            self._executor.submit(int).result()
+        else:
+            _init_worker(chunk_size, chunk_overlap)
+
+    def __enter__(self) -> 'Preprocessor':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def parse(self, parser: EpubParser) -> Iterator[List[str]]:
+        return parser.iter_sections(self._executor)
+
+    def iter_work_items(
+        self,
+        sections: Iterable[List[str]],
+        split_stage: Optional[StageCheckpoint] = None,
+        start_from: int = 0,
+    ) -> Iterator[WorkItem]:
+        """
+        Упорядоченный поток `(section_idx, chunk_idx, text)`: чанки раздела
+        отдаются подряд, разделы — в порядке книги. Разделы разбиваются
+        параллельно, уже разбитые берутся из чекпоинта `split_stage`.
+        """
+        jobs = []
+        for section_idx, lines in enumerate(sections):
+            if section_idx + 1 < start_from:
+                continue
+            text = '\n'.join(lines).strip()
+            if not text:
+                continue
+            key = content_hash(text, self.chunk_size, self.chunk_overlap)
+            chunks = (
+                split_stage.get(key) if split_stage is not None else None)
+            if chunks is None and self._executor is not None:
+                chunks = self._executor.submit(_split_text, text)
+            jobs.append((section_idx, key, text, chunks))
+
+        for section_idx, key, text, chunks in jobs:
+            if chunks is None:
+                chunks = _split_text(text)
+            elif isinstance(chunks, Future):
+                chunks = chunks.result()
+            if split_stage is not None and key not in split_stage:
+                split_stage.put(key, chunks)
+            for chunk_idx, chunk in enumerate(chunks):
+                yield WorkItem(section_idx, chunk_idx, chunk)
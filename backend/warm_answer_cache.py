@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+
+from dotenv import load_dotenv
+
+from api.agent import WarAndPeaceAgent
+from api.answer_cache import get_answer_cache
+
+load_dotenv()
+DATASET_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'tests', 'ragas', 'dataset.json')
+
+
+def warm_answer_cache(dataset_path: str, force: bool = False) -> None:
+    """
+    Заполняет кэш ответов ответами агента на вопросы из датасета.
+    Вопросы, на которые в кэше уже есть ответ, пропускаются, если не
+    указан `force`.
+    """
+    cache = get_answer_cache()
+    if cache is None:
+        print('Кэш ответов отключён (ANSWER_CACHE_PATH не задан)')
+        return
+    agent = WarAndPeaceAgent(use_answer_cache=False)
+
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)]
+
+    added = 0
+    for i, question in enumerate(questions, 1):
+        if not force and cache.lookup(question) is not None:
+            print(f'[{i}/{len(questions)}] Уже в кэше: {question}')
+            continue
+        cache.store(question, agent.invoke(query=question))
+        added += 1
+        print(f'[{i}/{len(questions)}] Добавлен ответ: {question}')
+    print(f'Добавлено ответов: {added}, всего в кэше: {cache.stats()["size"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Предварительное заполнение кэша ответов агента')
+    parser.add_argument(
+        'dataset_path', nargs='?', default=DATASET_PATH,
+        help='JSON-файл со списком объектов {"question": ...}')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Перегенерировать ответы, которые уже есть в кэше')
+    args = parser.parse_args()
+    warm_answer_cache(args.dataset_path, force=args.force)
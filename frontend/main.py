@@ -1,23 +1,68 @@
+from contextlib import asynccontextmanager
 import os
 from pathlib import Path
+from typing import AsyncGenerator
 
 import httpx
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import (
+    FileResponse, JSONResponse, Response, StreamingResponse)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-
-app = FastAPI()
-app.mount('/static', StaticFiles(directory='static'), 'static')
-templates = Jinja2Templates(directory='static')
+from loguru import logger
 
 load_dotenv()
 FRONTEND_PORT = os.getenv('FRONTEND_PORT', '8001')
 BACKEND_HOST = os.getenv('BACKEND_HOST', 'localhost')
 BACKEND_PORT = os.getenv('BACKEND_PORT', '8000')
 BACKEND_URL = f'http://{BACKEND_HOST}:{BACKEND_PORT}'
+BACKEND_MAX_CONNECTIONS = int(os.getenv('BACKEND_MAX_CONNECTIONS', '100'))
+BACKEND_MAX_KEEPALIVE = int(os.getenv('BACKEND_MAX_KEEPALIVE', '20'))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv('BACKEND_KEEPALIVE_EXPIRY', '60'))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv('BACKEND_CONNECT_TIMEOUT', '5'))
+# Наибольшая пауза между фрагментами ответа, а не время всего ответа.
+BACKEND_READ_TIMEOUT = float(os.getenv('BACKEND_READ_TIMEOUT', '120'))
+# Адреса прокси перед фронтендом (nginx, балансировщик) через запятую:
+# только от них принимается X-Forwarded-For.
+TRUSTED_PROXIES = {
+    address.strip()
+    for address in os.getenv('TRUSTED_PROXIES', '').split(',')
+    if address.strip()
+}
+# Заголовки ответа бэкенда, которые передаются пользователю.
+FORWARDED_HEADERS = ('content-type', 'retry-after')
+
+
+def create_backend_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=BACKEND_URL,
+        limits=httpx.Limits(
+            max_connections=BACKEND_MAX_CONNECTIONS,
+            max_keepalive_connections=BACKEND_MAX_KEEPALIVE,
+            keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=BACKEND_CONNECT_TIMEOUT,
+            read=BACKEND_READ_TIMEOUT,
+            write=BACKEND_CONNECT_TIMEOUT,
+            pool=BACKEND_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Один клиент с пулом соединений на всё время работы приложения.
+    async with create_backend_client() as client:
+        app.state.backend = client
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.mount('/static', StaticFiles(directory='static'), 'static')
+templates = Jinja2Templates(directory='static')
 
 
 @app.get('/favicon.ico')
@@ -25,25 +70,67 @@ async def favicon():
     return FileResponse(Path('static/image/favicon.png'))
 
 
+async def relay(
+    backend_resp: httpx.Response
+) -> AsyncGenerator[bytes, None]:
+    # Байты передаются как пришли, без декодирования и перенарезки.
+    try:
+        async for chunk in backend_resp.aiter_raw():
+            yield chunk
+    except httpx.HTTPError as e:
+        # Заголовки уже отправлены — остаётся только оборвать поток.
+        logger.error(f'Ошибка чтения ответа бэкенда: {e!r}')
+    finally:
+        await backend_resp.aclose()
+
+
+def forwarded_for(request: Request) -> str:
+    """
+    X-Forwarded-For для бэкенда, по первому адресу которого он распределяет
+    очередь запросов. Адрес соединения дописывается к цепочке, пришедшей
+    от доверенного прокси; от остальных цепочка отбрасывается, чтобы
+    пользователь не мог подменить свой адрес.
+    """
+    host = request.client.host if request.client else ''
+    incoming = request.headers.get('x-forwarded-for')
+    if incoming and host in TRUSTED_PROXIES:
+        return f'{incoming}, {host}'
+    return host
+
+
 @app.post('/api/generate')
 async def proxy_generate(request: Request):
-    body = await request.body()
-    headers = {'Content-Type': 'application/json'}
-
-    async def stream_from_backend():
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream(
-                'POST',
-                f'{BACKEND_URL}/api/generate',
-                content=body,
-                headers=headers,
-            ) as backend_resp:
-                async for chunk in backend_resp.aiter_bytes():
-                    yield chunk
+    client: httpx.AsyncClient = request.app.state.backend
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Forwarded-For': forwarded_for(request),
+    }
+    backend_req = client.build_request(
+        'POST', '/api/generate', content=await request.body(),
+        headers=headers)
+    try:
+        backend_resp = await client.send(backend_req, stream=True)
+    except httpx.TimeoutException:
+        return JSONResponse(
+            {'detail': 'Бэкенд не ответил вовремя'}, status_code=504)
+    except httpx.HTTPError:
+        return JSONResponse(
+            {'detail': 'Бэкенд недоступен'}, status_code=502)
 
+    forwarded = {
+        name: value for name, value in backend_resp.headers.items()
+        if name.lower() in FORWARDED_HEADERS
+    }
+    if backend_resp.is_error:
+        content = await backend_resp.aread()
+        await backend_resp.aclose()
+        return Response(
+            content, status_code=backend_resp.status_code,
+            headers=forwarded)
     return StreamingResponse(
-        stream_from_backend(),
-        media_type='text/event-stream',
+        relay(backend_resp),
+        status_code=backend_resp.status_code,
+        headers=forwarded,
     )
 
 
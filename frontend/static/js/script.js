@@ -11,6 +11,14 @@ const chatMessages = document.getElementById('chat-messages');
 const messageInput = document.getElementById('message-input');
 const sendButton = document.getElementById('send-button');
 const typingIndicator = document.getElementById('typing-indicator');
+// Session id: the backend keeps the history of this page's chat
+const sessionId = createSessionId();
+
+function createSessionId() {
+    // crypto.randomUUID is only available in secure contexts
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
 
 // Auto-resize textarea
 messageInput.addEventListener('input', function() {
@@ -53,8 +61,16 @@ async function sendMessage() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ message: message })
+            body: JSON.stringify({ message: message, session_id: sessionId })
         });
+        // The backend is busy: show when to retry instead of a generic error
+        if (response.status === 429 || response.status === 503) {
+            const retryAfter = response.headers.get('Retry-After');
+            const wait = retryAfter ? ` через ${retryAfter} с` : ' позже';
+            agentMessageElement.querySelector('.message-content').innerHTML = marked.parse(
+                `*Сервер сейчас перегружен, повторите вопрос${wait}.*`);
+            return;
+        }
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import threading
+import time
+from typing import Callable, List, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import httpx
+import uvicorn
+
+N_CHUNKS = 50
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(port: int) -> uvicorn.Server:
+    """Бэкенд-заглушка: сразу отдаёт ответ из `N_CHUNKS` фрагментов."""
+    backend = FastAPI()
+
+    @backend.post('/api/generate')
+    async def generate():
+        async def stream():
+            for _ in range(N_CHUNKS):
+                yield 'слово '
+        return StreamingResponse(stream(), media_type='text/event-stream')
+
+    server = uvicorn.Server(uvicorn.Config(
+        backend, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def legacy_app(backend_url: str) -> FastAPI:
+    """Прокси в прежнем виде: новый клиент и соединение на каждый запрос."""
+    app = FastAPI()
+
+    @app.post('/api/generate')
+    async def proxy_generate(request: Request):
+        body = await request.body()
+        headers = {'Content-Type': 'application/json'}
+
+        async def stream_from_backend():
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                async with client.stream(
+                    'POST',
+                    f'{backend_url}/api/generate',
+                    content=body,
+                    headers=headers,
+                ) as backend_resp:
+                    async for chunk in backend_resp.aiter_bytes():
+                        yield chunk
+
+        return StreamingResponse(
+            stream_from_backend(), media_type='text/event-stream')
+
+    return app
+
+
+async def measure(
+    client: httpx.AsyncClient, requests: int, concurrency: int
+) -> Tuple[List[float], float]:
+    timings: List[float] = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.post(
+                '/api/generate', json={'message': 'вопрос'})
+            response.raise_for_status()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return timings, requests / (time.perf_counter() - start)
+
+
+async def run_variant(
+    make_client: Callable[[], httpx.AsyncClient],
+    requests: int, concurrency: int
+) -> Tuple[List[float], float, float]:
+    async with make_client() as client:
+        await measure(client, min(requests, 20), 1)
+        sequential, _ = await measure(client, requests, 1)
+        _, throughput = await measure(client, requests, concurrency)
+    p99 = sorted(sequential)[min(len(sequential) - 1,
+                                 int(len(sequential) * 0.99))]
+    return sequential, p99, throughput
+
+
+async def run_benchmark(requests: int, concurrency: int):
+    """
+    Накладные расходы прокси `/api/generate` фронтенда на запрос: прежний
+    вариант (клиент и TCP-соединение на каждый запрос) против общего
+    клиента с пулом соединений. Бэкенд — заглушка на localhost, которая
+    сразу отдаёт потоковый ответ; накладные расходы — разница с прямым
+    запросом к бэкенду.
+    """
+    port = free_port()
+    backend_url = f'http://127.0.0.1:{port}'
+    os.environ['BACKEND_HOST'] = '127.0.0.1'
+    os.environ['BACKEND_PORT'] = str(port)
+    import main
+
+    server = start_backend(port)
+    try:
+        def asgi(app: FastAPI) -> Callable[[], httpx.AsyncClient]:
+            return lambda: httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app),
+                base_url='http://frontend')
+
+        results = [(
+            'напрямую', await run_variant(
+                lambda: httpx.AsyncClient(base_url=backend_url),
+                requests, concurrency))]
+        results.append((
+            'прежний прокси', await run_variant(
+                asgi(legacy_app(backend_url)), requests, concurrency)))
+        async with main.app.router.lifespan_context(main.app):
+            results.append((
+                'общий клиент', await run_variant(
+                    asgi(main.app), requests, concurrency)))
+    finally:
+        server.should_exit = True
+
+    direct = statistics.median(results[0][1][0])
+    print(
+        f'Запросов: {requests}, фрагментов в ответе: {N_CHUNKS}, '
+        f'одновременных клиентов для пропускной способности: {concurrency}')
+    print(
+        f'{"вариант":<16}{"p50, мс":>9}{"p99, мс":>9}'
+        f'{"накладные p50, мс":>19}{"запр/с":>9}')
+    for name, (timings, p99, throughput) in results:
+        p50 = statistics.median(timings)
+        print(
+            f'{name:<16}{p50:>9.2f}{p99:>9.2f}{p50 - direct:>19.2f}'
+            f'{throughput:>9.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Накладные расходы прокси фронтенда')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.requests, args.concurrency))